@@ -3,6 +3,7 @@ import sys
 import os
 import logging
 import queue
+import threading
 from flask_socketio import SocketIO
 from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
@@ -17,6 +18,10 @@ from App.services.song import Song
 import json
 from queue import Queue
 from routes import register_routes
+from App.services.sampleProgress import progress as indexing_progress
+from App.services import sampleRetrieval
+from App.services.llmStream import responses as llm_responses
+from App.config import Config
 
 app = Flask(__name__, static_url_path='/static', static_folder=os.path.join(parent_dir, 'Songs'))
 CORS(app)
@@ -26,10 +31,6 @@ app.logger.setLevel(logging.DEBUG)  # Set Flask logger to DEBUG level
 input_callback = None
 input_queue = Queue()
 
-# Global variable to track progress
-progress = 0
-progress_file = os.path.join(os.path.dirname(__file__), 'progress.json')
-
 def create_input_callback():
     def callback(prompt):
         logger.info(f"Requesting input: {prompt}")
@@ -64,6 +65,16 @@ logger.addHandler(queue_handler)
 
 register_routes(app)
 
+# Push sample listing progress to connected clients instead of letting them poll
+indexing_progress.subscribe(lambda snapshot: socketio.emit('sample_metadata_progress', snapshot))
+# Push the text of LLM responses as it is generated
+llm_responses.subscribe(lambda event: socketio.emit('llm_response', event))
+
+# Load the embedding model and the sample index in the background, so the first Sampling phase does not wait
+if Config.SAMPLE_RETRIEVAL_WARMUP:
+    threading.Thread(target=sampleRetrieval.warm_up, args=(os.path.join(parent_dir, 'Samples'),),
+                     name="sample-retrieval-warmup", daemon=True).start()
+
 # Global variable to store the current configuration
 current_config = None
 
@@ -156,15 +167,6 @@ def load_config(agent_type):
 
 import shutil
 
-def read_progress():
-    global progress
-    try:
-        with open(progress_file, 'r') as f:
-            data = json.load(f)
-            progress = data.get("progress", 0)
-    except Exception as e:
-        progress = 0
-
 executor = ThreadPoolExecutor(max_workers=1)
 
 # Remove sample-related endpoints (now in sample_routes.py)
@@ -0,0 +1,248 @@
+'''
+Benchmark suite of the sample analysis on synthetic corpora (see corpus.py).
+
+For every corpus size it reports:
+- the latency of decode_audio, measure_audio, detect_key, YAMNet classification and process_audio on a
+  subset of the files (mean, p50 and p95)
+- a full listing run (process_directory, or only analyse_files with --analysis-only): files/sec and the
+  seconds spent per stage
+- the peak RSS of the benchmark process and of its child processes (analysis pool, YAMNet worker)
+- BPM, key and duration accuracy against the ground truth of the corpus
+
+Every size runs in a fresh process, so peak RSS is measured per size. Everything runs offline on CPU:
+YAMNet is reported as unavailable when TensorFlow is not installed, and the embedding model is only loaded
+from the local cache (use --analysis-only when it is not there).
+
+Usage: python -m App.benchmarks.bench_analysis [--sizes 10 100 1000 10000] [--root DIR] [--workers N]
+                                               [--latency-files N] [--analysis-only] [--json FILE]
+'''
+import os
+import sys
+import json
+import time
+import queue
+import tempfile
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+from App.benchmarks.corpus import build_corpus, KEY_NAMES
+
+RESULT_POLL_SECONDS = 5  # how often the parent checks that a size's process is still alive
+
+BPM_TOLERANCE = 2.0
+DURATION_TOLERANCE = 0.05
+
+
+def relative_minor(key):
+    """Index of the relative minor of a key label; the key templates cannot tell a major key from it."""
+    try:
+        name, mode = key.split()
+        root = KEY_NAMES.index(name)
+    except (AttributeError, ValueError):
+        return None
+    return (root + 9) % 12 if mode == "major" else root
+
+
+def accuracy(metadata, ground_truth):
+    """BPM, key and duration accuracy of metadata entries against the corpus ground truth."""
+    entries = {item["Filename"]: item for item in metadata}
+    bpm_total = bpm_exact = bpm_octave = 0
+    key_total = key_correct = 0
+    duration_correct = 0
+    missing = 0
+    for file, truth in ground_truth.items():
+        item = entries.get(file)
+        if item is None or "Error" in item:
+            missing += 1
+            continue
+        if abs(item["Duration"] - truth["duration"]) <= DURATION_TOLERANCE:
+            duration_correct += 1
+        if truth["bpm"]:
+            bpm_total += 1
+            if abs(item["BPM"] - truth["bpm"]) <= BPM_TOLERANCE:
+                bpm_exact += 1
+            if any(abs(item["BPM"] - truth["bpm"] * factor) <= BPM_TOLERANCE * factor for factor in (0.5, 1, 2)):
+                bpm_octave += 1
+        if truth["key"]:
+            key_total += 1
+            if relative_minor(item.get("Key")) == relative_minor(truth["key"]):
+                key_correct += 1
+    found = len(ground_truth) - missing
+    return {
+        "analysed": found,
+        "failed": missing,
+        "bpm": bpm_exact / bpm_total if bpm_total else None,
+        "bpm_octave": bpm_octave / bpm_total if bpm_total else None,
+        "key": key_correct / key_total if key_total else None,
+        "duration": duration_correct / found if found else None,
+    }
+
+
+def latency_stats(seconds):
+    milliseconds = np.array(seconds) * 1000
+    return {
+        "mean_ms": round(float(milliseconds.mean()), 2),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 2),
+    }
+
+
+def measure_latencies(file_paths):
+    """Latency per call of every analysis function, on already decoded audio where the function takes it."""
+    from App.services import SampleMedataListing as listing
+    from App.services import audioFeatures
+
+    timings = {"decode": [], "features": [], "key": [], "yamnet": [], "process_audio": []}
+    yamnet_available = True
+    for file_path in file_paths:
+        started = time.perf_counter()
+        y, sr = listing.decode_audio(file_path)
+        timings["decode"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        audioFeatures.measure_audio(y, sr)
+        timings["features"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        audioFeatures.detect_key(y, sr)
+        timings["key"].append(time.perf_counter() - started)
+
+        waveform = listing.yamnet_waveform(y, sr)
+        started = time.perf_counter()
+        classes = listing.classify_sound(waveform)
+        timings["yamnet"].append(time.perf_counter() - started)
+        yamnet_available = yamnet_available and classes[0][0] != "Error"
+
+        started = time.perf_counter()
+        listing.process_audio(file_path)
+        timings["process_audio"].append(time.perf_counter() - started)
+
+    results = {stage: latency_stats(seconds) for stage, seconds in timings.items() if seconds}
+    if not yamnet_available:
+        results["yamnet"]["unavailable"] = True
+    return results
+
+
+def run_size(root, size, seed, workers, latency_files, analysis_only, results_queue):
+    """Benchmark one corpus size; runs in its own process and puts its results on results_queue."""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")  # never download the embedding model during a benchmark
+    from App.services import SampleMedataListing as listing
+    from App.services import sampleProgress
+    from App.services import yamnetWorker
+
+    directory, ground_truth = build_corpus(root, size, seed)
+    file_paths = [os.path.join(directory, file) for file in sorted(ground_truth)]
+    result = {"size": size, "workers": listing.resolve_workers(workers)}
+
+    try:
+        # First call pays for lazy imports and starting the YAMNet worker, keep it out of the numbers
+        listing.process_audio(file_paths[0])
+        result["latency"] = measure_latencies(file_paths[:latency_files])
+
+        started = time.perf_counter()
+        if analysis_only:
+            stage_seconds = {}
+
+            def add_timings(timings):
+                for stage, seconds in timings.items():
+                    stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+
+            metadata = listing.analyse_files(file_paths, workers, on_timings=add_timings)
+        else:
+            listing.process_directory(directory, workers, full_rescan=True)
+            stage_seconds = sampleProgress.progress.snapshot()["stage_seconds"]
+            with open(os.path.join(directory, "sample_metadata.json"), "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        elapsed = time.perf_counter() - started
+
+        result["run"] = {
+            "seconds": round(elapsed, 2),
+            "files_per_sec": round(size / elapsed, 2),
+            "mb_per_sec": round(sum(os.path.getsize(path) for path in file_paths) / elapsed / 2 ** 20, 2),
+            "stage_seconds": {stage: round(seconds, 2) for stage, seconds in stage_seconds.items()},
+        }
+        result["accuracy"] = accuracy(metadata, ground_truth)
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        yamnetWorker.get_client().stop()  # joined, so it counts in the children's peak RSS
+
+    result["peak_rss_mb"] = {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    results_queue.put(result)
+
+
+def percent(value):
+    return f"{value * 100:.1f}%" if value is not None else "-"
+
+
+def print_result(result):
+    print(f"\n=== {result['size']} files, {result['workers'] or '?'} worker(s) ===")
+    if "error" in result:
+        print(f"Failed: {result['error']}")
+    for stage, stats in result.get("latency", {}).items():
+        note = " (unavailable, classification failed)" if stats.get("unavailable") else ""
+        print(f"  {stage:<14} mean {stats['mean_ms']:>8.1f} ms   p50 {stats['p50_ms']:>8.1f} ms   p95 {stats['p95_ms']:>8.1f} ms{note}")
+    if "run" in result:
+        run = result["run"]
+        stages = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in run["stage_seconds"].items())
+        print(f"  run            {run['seconds']:.1f} s, {run['files_per_sec']:.2f} files/s, {run['mb_per_sec']:.2f} MB/s")
+        print(f"  stage time     {stages}")
+    if "accuracy" in result:
+        acc = result["accuracy"]
+        print(f"  accuracy       BPM {percent(acc['bpm'])} (octave errors allowed {percent(acc['bpm_octave'])}), "
+              f"key {percent(acc['key'])}, duration {percent(acc['duration'])}, {acc['failed']} failed")
+    rss = result.get("peak_rss_mb")
+    if rss:
+        print(f"  peak RSS       {rss['self']:.0f} MB (benchmark process), {rss['children']:.0f} MB (largest child process)")
+
+
+def wait_for_result(process, results_queue, size):
+    """Result of the process benchmarking size, or an error result when it exits without one (e.g. killed)."""
+    while True:
+        try:
+            return results_queue.get(timeout=RESULT_POLL_SECONDS)
+        except queue.Empty:
+            if process.exitcode is not None:
+                try:  # the result may have been put just before the process exited
+                    return results_queue.get(timeout=RESULT_POLL_SECONDS)
+                except queue.Empty:
+                    return {"size": size, "workers": None, "error": f"process exited with code {process.exitcode}"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sample analysis on synthetic corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--root", default=os.path.join(tempfile.gettempdir(), "musicagent_corpus"),
+                        help="Where corpora are generated (and reused by later runs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="Analysis processes (default: sample_workers setting)")
+    parser.add_argument("--latency-files", type=int, default=20, help="Files used for the per-function latencies")
+    parser.add_argument("--analysis-only", action="store_true", help="Skip embedding, indexing and JSON output")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in args.sizes:
+        results_queue = context.Queue()
+        process = context.Process(target=run_size, args=(args.root, size, args.seed, args.workers,
+                                                         args.latency_files, args.analysis_only, results_queue))
+        process.start()
+        result = wait_for_result(process, results_queue, size)
+        process.join()
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
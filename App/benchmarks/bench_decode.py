@@ -0,0 +1,79 @@
+'''
+Benchmark of the per-file decode cost of the sample metadata listing.
+
+Compares decoding every sample twice (native rate for the librosa features, then again at 16kHz for YAMNet)
+with decoding once and resampling the buffer in memory, as process_audio does.
+
+Usage: python -m App.benchmarks.bench_decode [samples_directory] [--limit N] [--repeat N]
+'''
+import os
+import sys
+import time
+import argparse
+import librosa
+from App.services.SampleMedataListing import SUPPORTED_FORMATS
+from App.services.yamnetWorker import YAMNET_SAMPLE_RATE
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
+
+
+def double_decode(file_path):
+    y, sr = librosa.load(file_path, sr=None)
+    waveform, _ = librosa.load(file_path, sr=YAMNET_SAMPLE_RATE, mono=True)
+    return y, waveform
+
+
+def single_decode(file_path):
+    y, sr = librosa.load(file_path, sr=None)
+    waveform = y if sr == YAMNET_SAMPLE_RATE else librosa.resample(y, orig_sr=sr, target_sr=YAMNET_SAMPLE_RATE)
+    return y, waveform
+
+
+def find_audio_files(directory, limit):
+    file_paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith(SUPPORTED_FORMATS):
+                file_paths.append(os.path.join(root, file))
+    return file_paths[:limit] if limit else file_paths
+
+
+def time_per_file(decode, file_paths, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file_path in file_paths:
+            decode(file_path)
+        best = min(best, time.perf_counter() - start)
+    return best / len(file_paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare double vs single audio decoding per sample.")
+    parser.add_argument("directory", nargs="?", default=os.path.join(root_dir, 'Samples'))
+    parser.add_argument("--limit", type=int, default=50, help="Number of files to decode (0 = all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the fastest one is reported")
+    args = parser.parse_args(argv)
+
+    file_paths = find_audio_files(args.directory, args.limit)
+    if not file_paths:
+        print(f"No audio files found in {args.directory}")
+        return 1
+
+    # Warm up librosa/soxr so the first variant does not pay for lazy imports
+    single_decode(file_paths[0])
+
+    double = time_per_file(double_decode, file_paths, args.repeat)
+    single = time_per_file(single_decode, file_paths, args.repeat)
+
+    print(f"Files decoded:            {len(file_paths)}")
+    print(f"Decode twice (per file):  {double * 1000:.1f} ms")
+    print(f"Decode once (per file):   {single * 1000:.1f} ms")
+    print(f"Saving per file:          {(double - single) * 1000:.1f} ms ({(1 - single / double) * 100:.0f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
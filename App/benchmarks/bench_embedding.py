@@ -0,0 +1,184 @@
+'''
+Throughput, latency and retrieval overlap of the embedding backends (see sampleIndex.load_embedding_model).
+
+Every backend runs in a fresh process and reports:
+- the cold start: seconds to load the model (sentence_transformers is imported before timing) and the peak RSS
+- indexing throughput: sample texts embedded per second in batches of ENCODE_BATCH_SIZE
+- query latency: one Sampling-phase query at a time (mean, p50 and p95)
+Retrieval overlap compares every backend with the first one (torch by default): the share of the top-k
+samples of a query both find, each searching an exact index of its own embeddings, and the mean cosine
+between the two embeddings of the same sample text.
+
+Sample texts are built like those of the library (tags, vibe and description) from YAMNet class names, or
+taken from a listing with --metadata (Samples/sample_metadata.json). The model is only loaded from the
+local cache; run the app once with each backend to download it.
+
+Usage: python -m App.benchmarks.bench_embedding [--backends torch onnx-int8] [--samples 2000] [--queries 100]
+                                                [--k 10] [--metadata FILE] [--json FILE]
+'''
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+from App.services import sampleIndex
+
+YAMNET_CLASS_MAP = os.path.join(os.path.dirname(__file__), "..", "inc", "yamnet-tensorflow2-yamnet-v1", "assets",
+                                "yamnet_class_map.csv")
+KEYS = [f"{name} {mode}" for mode in ("minor", "major") for name in
+        ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]]
+THEMES = ["heartbreak", "a summer road trip", "city lights at night", "rising from defeat", "an autumn forest",
+          "a space odyssey", "childhood memories", "a rainy Sunday", "dancing until sunrise", "the open sea"]
+MOODS = ["melancholic piano", "uplifting synth leads", "dreamy pads", "gritty guitar riffs", "warm strings",
+         "playful plucks", "dark drones", "soulful vocals", "bright brass stabs", "lo-fi keys"]
+RHYTHMS = ["a slow and steady groove", "a driving four-on-the-floor beat", "syncopated jazzy drums",
+           "laid-back hip hop drums", "fast breakbeats", "a shuffling swing", "sparse hand percussion"]
+
+
+def synthetic_metadata(count, seed=0):
+    """Metadata entries with the fields process_audio writes, for the embedded text only."""
+    with open(YAMNET_CLASS_MAP, newline="", encoding="utf-8") as f:
+        classes = [row["display_name"] for row in csv.DictReader(f)]
+    rng = np.random.default_rng(seed)
+    metadata = []
+    for _ in range(count):
+        tempo = rng.choice(["slow", "moderate", "fast"])
+        brightness = rng.choice(["warm", "bright"])
+        energy = rng.choice(["very low energy", "low energy", "high energy"])
+        dynamics = rng.choice(["compressed", "dynamic"])
+        key = rng.choice(KEYS)
+        bpm = int(rng.integers(60, 180))
+        metadata.append({
+            "Vibe": f"The track has a {tempo} tempo at {bpm} BPM, featuring a {brightness} and {energy} sound. "
+                    f"It feels {dynamics} with a {key} tonality.",
+            "Tags": [tempo, brightness, energy, dynamics, key] + list(rng.choice(classes, 5, replace=False)),
+            "Description": f"A {brightness}, {energy} track with a {tempo} tempo and a {key} tonality.",
+        })
+    return metadata
+
+
+def sampling_queries(count, seed=1):
+    """Queries as the Sampling phase builds them (see GPTAgent.local_discussion)."""
+    rng = np.random.default_rng(seed)
+    return [f"We are creating a new song with the following details: - Theme: {rng.choice(THEMES)}. "
+            f"- Melody: {rng.choice(MOODS)}. - Rhythm: {rng.choice(RHYTHMS)}. "
+            f"- Song Description: a song about {rng.choice(THEMES)}. "
+            "Please suggest suitable samples with tags matching the mood, progression, and instrumentation described above."
+            for _ in range(count)]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend, texts, queries, results_queue):
+    """Measure one backend in this (fresh) process and put its stats and embeddings on results_queue."""
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")  # never download the model during a benchmark
+    try:
+        import sentence_transformers  # noqa: F401 -- imported outside the cold start timing
+        started = time.perf_counter()
+        model = sampleIndex.load_embedding_model(backend)
+        load_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        sample_vectors = sampleIndex.encode_texts(model, texts)
+        encode_seconds = time.perf_counter() - started
+
+        sampleIndex.encode_query(model, queries[0])  # first call allocates the runtime's buffers
+        milliseconds, query_vectors = [], []
+        for query in queries:
+            started = time.perf_counter()
+            query_vectors.append(sampleIndex.encode_query(model, query))
+            milliseconds.append((time.perf_counter() - started) * 1000)
+        milliseconds = np.array(milliseconds)
+
+        results_queue.put({
+            "backend": backend,
+            "load_seconds": round(load_seconds, 2),
+            "texts_per_second": round(len(texts) / encode_seconds, 1),
+            "query_mean_ms": round(float(milliseconds.mean()), 2),
+            "query_p50_ms": round(float(np.percentile(milliseconds, 50)), 2),
+            "query_p95_ms": round(float(np.percentile(milliseconds, 95)), 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "sample_vectors": sample_vectors,
+            "query_vectors": np.concatenate(query_vectors),
+        })
+    except Exception as e:
+        results_queue.put({"backend": backend, "error": f"{type(e).__name__}: {e}"})
+
+
+def top_k(sample_vectors, query_vectors, k):
+    index = sampleIndex.build_index(sample_vectors, "flat")
+    _, ids = index.search(query_vectors, k)
+    return ids
+
+
+def add_overlap(results, k):
+    """Top-k overlap and embedding cosine of every backend against the first one that ran."""
+    measured = [result for result in results if "error" not in result]
+    if not measured:
+        return
+    reference = measured[0]
+    reference_ids = top_k(reference["sample_vectors"], reference["query_vectors"], k)
+    for result in measured:
+        ids = top_k(result["sample_vectors"], result["query_vectors"], k)
+        result["overlap_at_k"] = round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, reference_ids)])), 4)
+        result["mean_cosine"] = round(float(np.mean(np.sum(result["sample_vectors"] * reference["sample_vectors"], axis=1))), 4)
+
+
+def print_results(results, k):
+    print(f"{'backend':<10} {'load s':>7} {'texts/s':>9} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8} "
+          f"{f'overlap@{k}':>10} {'cosine':>7}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<10} unavailable: {r['error']}")
+            continue
+        print(f"{r['backend']:<10} {r['load_seconds']:>7.2f} {r['texts_per_second']:>9.1f} {r['query_mean_ms']:>8.2f} "
+              f"{r['query_p50_ms']:>8.2f} {r['query_p95_ms']:>8.2f} {r['peak_rss_mb']:>8.1f} "
+              f"{r['overlap_at_k']:>10.3f} {r['mean_cosine']:>7.4f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the embedding backends of the sample index.")
+    parser.add_argument("--backends", nargs="+", default=list(sampleIndex.EMBEDDING_BACKENDS),
+                        choices=sampleIndex.EMBEDDING_BACKENDS)
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--metadata", help="Sample listing to take the texts from (sample_metadata.json)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.metadata:
+        with open(args.metadata, "r", encoding="utf-8") as f:
+            metadata = json.load(f)[:args.samples]
+    else:
+        metadata = synthetic_metadata(args.samples)
+    texts = [sampleIndex.sample_text(item) for item in metadata]
+    queries = sampling_queries(args.queries)
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in args.backends:
+        results_queue = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, texts, queries, results_queue))
+        process.start()
+        results.append(results_queue.get())
+        process.join()
+    add_overlap(results, min(args.k, len(texts)))
+    print_results(results, args.k)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([{name: value for name, value in r.items() if not name.endswith("_vectors")} for r in results],
+                      f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
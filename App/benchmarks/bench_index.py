@@ -0,0 +1,132 @@
+'''
+Recall versus latency of the sample index types (see sampleIndex.build_index) against exact search.
+
+For every library size and index type it reports the build time and index size, and for every setting of the
+search knobs (efSearch for HNSW; nprobe and the refine factor for IVF-PQ) the recall@k against the flat index
+and the latency of one query. Embeddings are synthetic by default: normalised 384-d vectors around topic
+centres, like sentence embeddings of sample descriptions. --embeddings uses the cached embeddings of a sample
+library instead (Samples/sample_embeddings.npz), with queries taken near random samples.
+
+Usage: python -m App.benchmarks.bench_index [--sizes 10000 100000 1000000] [--types flat hnsw ivfpq]
+                                            [--queries 200] [--k 10] [--embeddings FILE] [--json FILE]
+'''
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import faiss
+
+from App.services import sampleIndex
+
+DIMENSION = 384
+TOPICS = 1000
+KNOBS = {
+    "flat": [{}],
+    "hnsw": [{"ef_search": ef_search} for ef_search in (16, 32, 64, 128, 256)],
+    "ivfpq": [{"nprobe": nprobe, "refine": refine} for nprobe in (4, 16, 64) for refine in (1, 4, 16)],
+}
+
+
+def normalise(vectors):
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+def synthetic_embeddings(count, seed=0, dimension=DIMENSION, topics=TOPICS):
+    rng = np.random.default_rng(seed)
+    centres = normalise(rng.standard_normal((topics, dimension)))
+    assignment = rng.integers(topics, size=count)
+    vectors = np.empty((count, dimension), dtype="float32")
+    for start in range(0, count, 100000):  # bounded temporary memory for a million vectors
+        rows = slice(start, min(count, start + 100000))
+        noise = rng.standard_normal((len(assignment[rows]), dimension)).astype("float32")
+        vectors[rows] = normalise(centres[assignment[rows]] + 0.06 * noise)
+    return vectors
+
+
+def queries_near(embeddings, count, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(embeddings), count, replace=len(embeddings) < count)
+    noise = rng.standard_normal((count, embeddings.shape[1])).astype("float32")
+    return normalise(embeddings[rows] + 0.03 * noise)
+
+
+def query_latencies(index, queries, k, knob):
+    ids = np.empty((len(queries), k), dtype="int64")
+    seconds = []
+    sampleIndex.set_search_parameters(index, k, **knob)
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids[i] = index.search(query[np.newaxis], k)
+        seconds.append(time.perf_counter() - started)
+    return ids, np.array(seconds) * 1000
+
+
+def recall(ids, exact_ids):
+    return float(np.mean([len(set(found) & set(exact)) / len(exact) for found, exact in zip(ids, exact_ids)]))
+
+
+def bench_size(embeddings, index_types, query_count, k):
+    queries = queries_near(embeddings, query_count)
+    exact = sampleIndex.build_index(embeddings, "flat")
+    _, exact_ids = exact.search(queries, k)
+    results = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = exact if index_type == "flat" else sampleIndex.build_index(embeddings, index_type)
+        build_seconds = time.perf_counter() - started if index_type != "flat" else 0.0
+        built = sampleIndex.index_type_of(index)
+        size_mb = faiss.serialize_index(index).nbytes / 2 ** 20
+        for knob in KNOBS[built]:
+            ids, milliseconds = query_latencies(index, queries, k, knob)
+            results.append({
+                "size": len(embeddings),
+                "type": built,
+                "knobs": knob,
+                "build_seconds": round(build_seconds, 2),
+                "index_mb": round(size_mb, 1),
+                "recall": round(recall(ids, exact_ids), 4),
+                "mean_ms": round(float(milliseconds.mean()), 3),
+                "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+            })
+    return results
+
+
+def print_results(results, k):
+    print(f"{'size':>9} {'type':<6} {'knobs':<22} {'build s':>8} {'MB':>8} {f'recall@{k}':>9} {'mean ms':>8} {'p95 ms':>8}")
+    for r in results:
+        knobs = " ".join(f"{name}={value}" for name, value in r["knobs"].items()) or "-"
+        print(f"{r['size']:>9} {r['type']:<6} {knobs:<22} {r['build_seconds']:>8.1f} {r['index_mb']:>8.1f} "
+              f"{r['recall']:>9.3f} {r['mean_ms']:>8.3f} {r['p95_ms']:>8.3f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recall and latency of the sample index types.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--types", nargs="+", default=list(sampleIndex.INDEX_TYPES), choices=sampleIndex.INDEX_TYPES)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--embeddings", help="Embedding cache of a sample library (sample_embeddings.npz)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.embeddings:
+        with np.load(args.embeddings) as cache:
+            sets = [cache["vectors"].astype("float32")]
+    else:
+        sets = (synthetic_embeddings(size) for size in args.sizes)
+
+    results = []
+    for embeddings in sets:
+        size_results = bench_size(embeddings, args.types, args.queries, args.k)
+        print_results(size_results, args.k)
+        results.extend(size_results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+'''
+Deterministic synthetic sample corpus for the analysis benchmarks.
+
+File i of a corpus only depends on (seed, i), so the corpus of 100 files is the first 100 files of the corpus
+of 10,000. Files are rendered once into a pool directory and hard-linked into one directory per corpus size.
+
+Kinds of files, with their ground truth (ground_truth.json, keyed like the Filename of the metadata):
+- tonal: a sustained pad in a known key (tonic bass, tonic triad, other scale degrees above) with a click
+  on every beat at a known BPM
+- clicks: a click track at a known BPM
+- noise: white or pink noise, without key or tempo
+
+Durations (mostly 1-12 s, some 30-90 s files that are analysed block by block), channel counts, sampling rates
+and formats (WAV/FLAC) vary from file to file.
+
+Usage: python -m App.benchmarks.corpus directory --count N [--seed S]
+'''
+import os
+import sys
+import json
+import shutil
+import argparse
+import numpy as np
+import soundfile as sf
+from App.services.audioFeatures import KEY_NAMES
+
+KINDS = ("tonal", "tonal", "clicks", "noise")  # tonal files are the most common
+SAMPLE_RATES = (22050, 44100, 48000)
+FORMATS = ("wav", "flac")
+BPM_RANGE = (70, 160)
+GROUND_TRUTH_FILE = "ground_truth.json"
+MAJOR_STEPS = [0, 2, 4, 5, 7, 9, 11]
+MINOR_STEPS = [0, 2, 3, 5, 7, 8, 10]
+
+
+def synth_sample(root, steps, bpm, seconds=8.0, level=0.7, clicks=0.9, hats=0.0, seed=0, sr=44100):
+    """A sustained pad in the key of root and steps, with a click (and optionally a hi-hat) on every beat.
+
+    The pad is voiced like an arrangement would be: the tonic in the bass, the tonic triad in the middle
+    and the remaining scale degrees an octave above it.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sr)) / sr
+    notes = [(36, 0, 1.0)]  # (octave base, scale degree, weight)
+    notes += [(60, degree, 0.8) for degree in (0, 2, 4)]
+    notes += [(72, degree, 0.4) for degree in (1, 3, 5, 6)]
+    y = np.zeros(len(t))
+    for base, degree, weight in notes:
+        frequency = 440.0 * 2 ** ((base + root + steps[degree] - 69) / 12)
+        for harmonic in (1, 2, 3):
+            y += weight / harmonic * np.sin(2 * np.pi * frequency * harmonic * t + rng.uniform(0, 2 * np.pi))
+    y *= level / np.abs(y).max()
+
+    for beat in np.arange(0, seconds, 60.0 / bpm):
+        start = int(beat * sr)
+        y[start:start + 200] += clicks
+        if hats:
+            noise = rng.standard_normal(min(3000, len(y) - start))
+            y[start:start + len(noise)] += hats * noise * np.exp(-np.arange(len(noise)) / 800)
+    return np.clip(y, -1, 1).astype(np.float32)
+
+
+def file_spec(seed, i):
+    """Ground truth and rendering parameters of file i."""
+    rng = np.random.default_rng([seed, i])
+    kind = KINDS[rng.integers(len(KINDS))]
+    length = rng.random()
+    if length < 0.7:
+        duration = rng.uniform(1, 4)
+    elif length < 0.95:
+        duration = rng.uniform(4, 12)
+    else:
+        duration = rng.uniform(30, 90)
+    file_format = FORMATS[rng.integers(len(FORMATS))]
+    spec = {
+        "file": f"{kind}/{i:05d}_{kind}.{file_format}",
+        "kind": kind,
+        "duration": round(float(duration), 2),
+        "sr": int(SAMPLE_RATES[rng.integers(len(SAMPLE_RATES))]),
+        "channels": int(rng.integers(1, 3)),
+        "bpm": None,
+        "key": None,
+    }
+    if kind in ("tonal", "clicks"):
+        spec["bpm"] = int(rng.integers(*BPM_RANGE))
+    if kind == "tonal":
+        spec["key"] = f"{KEY_NAMES[rng.integers(12)]} {'minor' if rng.random() < 0.5 else 'major'}"
+    if kind == "noise":
+        spec["noise"] = "pink" if rng.random() < 0.5 else "white"
+    return spec
+
+
+def noise(spec, length, rng):
+    y = rng.standard_normal(length)
+    if spec["noise"] == "pink":
+        spectrum = np.fft.rfft(y)
+        spectrum /= np.sqrt(np.maximum(np.arange(len(spectrum)), 1))
+        y = np.fft.irfft(spectrum, length)
+    return 0.3 * y / np.abs(y).max()
+
+
+def render(spec, seed, i):
+    """Audio of file i as a (frames, channels) float32 array."""
+    if spec["kind"] == "tonal":
+        name, mode = spec["key"].split()
+        y = synth_sample(KEY_NAMES.index(name), MINOR_STEPS if mode == "minor" else MAJOR_STEPS, spec["bpm"],
+                         spec["duration"], level=0.6, clicks=0.8, seed=[seed, i, 1], sr=spec["sr"])
+    elif spec["kind"] == "clicks":  # the same clicks without the pad
+        y = synth_sample(0, MAJOR_STEPS, spec["bpm"], spec["duration"], level=0.0, clicks=0.8, sr=spec["sr"])
+    else:
+        rng = np.random.default_rng([seed, i, 1])
+        y = np.clip(noise(spec, int(spec["duration"] * spec["sr"]), rng), -1, 1)
+    channels = [y] if spec["channels"] == 1 else [y, np.roll(y, int(0.01 * spec["sr"]))]  # slightly wider stereo
+    return np.stack(channels, axis=1).astype(np.float32)
+
+
+def write_file(path, spec, seed, i):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sf.write(path, render(spec, seed, i), spec["sr"], format=spec["file"].rsplit(".", 1)[1].upper())
+
+
+def build_corpus(root, count, seed=0):
+    """Directory holding the first `count` files of corpus `seed` below root, created if needed.
+
+    Returns (directory, ground truth keyed by relative path).
+    """
+    pool = os.path.join(root, f"pool_{seed}")
+    directory = os.path.join(root, f"corpus_{seed}_{count}")
+    ground_truth = {}
+    for i in range(count):
+        spec = file_spec(seed, i)
+        ground_truth[spec["file"]] = spec
+        pooled = os.path.join(pool, spec["file"])
+        if not os.path.exists(pooled):
+            write_file(pooled, spec, seed, i)
+        target = os.path.join(directory, spec["file"])
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(pooled, target)
+            except OSError:
+                shutil.copyfile(pooled, target)
+    with open(os.path.join(directory, GROUND_TRUTH_FILE), "w", encoding="utf-8") as f:
+        json.dump(ground_truth, f, indent=1)
+    return directory, ground_truth
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic sample corpus.")
+    parser.add_argument("root", help="Directory that receives the file pool and the corpus directory")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    directory, ground_truth = build_corpus(args.root, args.count, args.seed)
+    print(f"{len(ground_truth)} files in {directory}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,56 @@ class Config:
     SONIC_PI_HOST = os.environ.get('SONIC_PI_HOST') or SETTINGS.get('sonic_pi_IP', 'localhost')
     SONIC_PI_PORT = int(os.environ.get('SONIC_PI_PORT') or SETTINGS.get('sonic_pi_port', 4557))
 
+    # Number of worker processes used for sample analysis (0 = one per CPU core, 1 = serial)
+    SAMPLE_WORKERS = int(os.environ.get('SAMPLE_WORKERS') or SETTINGS.get('sample_workers', 0))
+    # Number of samples classified per YAMNet inference call, and how frame scores are pooled ('mean' or 'max')
+    SAMPLE_BATCH_SIZE = int(os.environ.get('SAMPLE_BATCH_SIZE') or SETTINGS.get('sample_batch_size', 16))
+    YAMNET_POOLING = os.environ.get('YAMNET_POOLING') or SETTINGS.get('yamnet_pooling', 'mean')
+    # Number of uploads analysed and indexed at the same time in the background
+    SAMPLE_INGEST_WORKERS = int(os.environ.get('SAMPLE_INGEST_WORKERS') or SETTINGS.get('sample_ingest_workers', 1))
+    # Collapse exact and near-duplicate samples (share of differing fingerprint bits up to SAMPLE_DEDUP_MAX_BIT_ERROR)
+    SAMPLE_DEDUP = str(os.environ.get('SAMPLE_DEDUP') or SETTINGS.get('sample_dedup', True)).lower() not in ('0', 'false', 'no')
+    SAMPLE_DEDUP_MAX_BIT_ERROR = float(os.environ.get('SAMPLE_DEDUP_MAX_BIT_ERROR') or SETTINGS.get('sample_dedup_max_bit_error', 0.05))
+    # Sample index type: 'auto' (flat, HNSW or IVF-PQ by library size), 'flat', 'hnsw' or 'ivfpq';
+    # IVF lists visited, IVF candidates re-ranked per result and HNSW candidates per query trade recall for latency
+    SAMPLE_INDEX_TYPE = os.environ.get('SAMPLE_INDEX_TYPE') or SETTINGS.get('sample_index_type', 'auto')
+    SAMPLE_INDEX_NPROBE = int(os.environ.get('SAMPLE_INDEX_NPROBE') or SETTINGS.get('sample_index_nprobe', 16))
+    SAMPLE_INDEX_REFINE = int(os.environ.get('SAMPLE_INDEX_REFINE') or SETTINGS.get('sample_index_refine', 16))
+    SAMPLE_INDEX_EF_SEARCH = int(os.environ.get('SAMPLE_INDEX_EF_SEARCH') or SETTINGS.get('sample_index_ef_search', 64))
+    # Runtime of the sample embedding model: 'torch' (full precision) or 'onnx-int8' (int8-quantised ONNX export,
+    # needs sentence-transformers[onnx]); SAMPLE_EMBEDDING_ONNX_FILE picks the export for the CPU (avx2, avx512, arm64)
+    SAMPLE_EMBEDDING_BACKEND = os.environ.get('SAMPLE_EMBEDDING_BACKEND') or SETTINGS.get('sample_embedding_backend', 'torch')
+    SAMPLE_EMBEDDING_ONNX_FILE = os.environ.get('SAMPLE_EMBEDDING_ONNX_FILE') or SETTINGS.get('sample_embedding_onnx_file', 'onnx/model_qint8_avx2.onnx')
+    # Load the embedding model and the sample index when the app starts, instead of on the first Sampling phase
+    SAMPLE_RETRIEVAL_WARMUP = str(os.environ.get('SAMPLE_RETRIEVAL_WARMUP') or SETTINGS.get('sample_retrieval_warmup', True)).lower() not in ('0', 'false', 'no')
+    # Samples fit a song's tempo within this relative BPM difference (directly, at half or at double time);
+    # the Sampling phase retrieves this many candidates per sample it keeps, to filter them on key and tempo
+    SAMPLE_BPM_TOLERANCE = float(os.environ.get('SAMPLE_BPM_TOLERANCE') or SETTINGS.get('sample_bpm_tolerance', 0.04))
+    SAMPLE_COMPATIBILITY_CANDIDATES = int(os.environ.get('SAMPLE_COMPATIBILITY_CANDIDATES') or SETTINGS.get('sample_compatibility_candidates', 10))
+    # Files longer than this (in seconds) are analysed block by block with constant memory (0 = never)
+    STREAM_THRESHOLD_SECONDS = float(os.environ.get('STREAM_THRESHOLD_SECONDS') or SETTINGS.get('stream_threshold_seconds', 60))
+
+    # On-disk cache of LLM responses for the phases that opt in ("cache": true in MusicCreationPhaseConfig.json),
+    # reused when the chain of the same song is retried or restarted; entries expire after LLM_CACHE_TTL_HOURS and
+    # the least recently used go when it exceeds LLM_CACHE_MAX_MB
+    LLM_CACHE = str(os.environ.get('LLM_CACHE') or SETTINGS.get('llm_cache', True)).lower() not in ('0', 'false', 'no')
+    LLM_CACHE_DIR = os.environ.get('LLM_CACHE_DIR') or SETTINGS.get('llm_cache_dir', os.path.join(PROJECT_ROOT, 'Cache', 'llm_responses'))
+    LLM_CACHE_TTL_HOURS = float(os.environ.get('LLM_CACHE_TTL_HOURS') or SETTINGS.get('llm_cache_ttl_hours', 24))
+    LLM_CACHE_MAX_MB = float(os.environ.get('LLM_CACHE_MAX_MB') or SETTINGS.get('llm_cache_max_mb', 100))
+
+    # Chain phases run at the same time when they do not depend on each other's outcome (1 = one by one, in chain order;
+    # above 1 the song is the same, but the log lines and conversations of concurrent phases interleave)
+    PHASE_WORKERS = int(os.environ.get('PHASE_WORKERS') or SETTINGS.get('phase_workers', 1))
+    # Stream LLM responses and forward the text to the UI as it arrives (Socket.IO 'llm_response', /api/llm_stream)
+    LLM_STREAMING = str(os.environ.get('LLM_STREAMING') or SETTINGS.get('llm_streaming', True)).lower() not in ('0', 'false', 'no')
+    # LLM provider clients are shared by the process (see llmClients): connections kept alive per provider,
+    # seconds an idle connection stays open, timeouts of a request and retries of failed requests
+    LLM_POOL_CONNECTIONS = int(os.environ.get('LLM_POOL_CONNECTIONS') or SETTINGS.get('llm_pool_connections', 20))
+    LLM_POOL_KEEPALIVE_SECONDS = float(os.environ.get('LLM_POOL_KEEPALIVE_SECONDS') or SETTINGS.get('llm_pool_keepalive_seconds', 60))
+    LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get('LLM_CONNECT_TIMEOUT_SECONDS') or SETTINGS.get('llm_connect_timeout_seconds', 10))
+    LLM_READ_TIMEOUT_SECONDS = float(os.environ.get('LLM_READ_TIMEOUT_SECONDS') or SETTINGS.get('llm_read_timeout_seconds', 600))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES') or SETTINGS.get('llm_max_retries', 2))
+
     API_KEYS = {
         'openai': os.environ.get('OPENAI_API_KEY') or SETTINGS.get('OPENAI_API_KEY'),
         'anthropic': os.environ.get('ANTHROPIC_API_KEY') or SETTINGS.get('ANTHROPIC_API_KEY'),
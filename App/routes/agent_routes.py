@@ -1,12 +1,16 @@
-from flask import Blueprint, request, jsonify, current_app, render_template
+from flask import Blueprint, request, jsonify, current_app, render_template, Response
 import os
 import json
 import logging
 import sys
+import uuid
 from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
+from queue import Queue, Empty
 from App.services.agent import GPTAgent
 from App.services.song import Song
+from App.services import responseCache
+from App.services.llmStream import responses as llm_responses
+from App.config import Config
 
 agent_bp = Blueprint('agent', __name__)
 logger = logging.getLogger()
@@ -79,9 +83,9 @@ def wait_for_input():
     logger.info(f"Received user input: {user_input}")
     return user_input
 
-def initialize_agent(song_name, agent_type, input_callback, selected_model, api_provider):
+def initialize_agent(song_name, agent_type, input_callback, selected_model, api_provider, song_id=None):
     logger.info(f"Initializing agent {agent_type} for song: {song_name}")
-    song = Song(name=song_name, logger=logger)
+    song = Song(name=song_name, logger=logger, song_id=song_id)
     agent = GPTAgent(
         selected_model=selected_model,
         logger=logger,
@@ -125,6 +129,34 @@ def save_agent_config(agent_type):
     save_config(agent_type, new_config)
     return jsonify({"message": "Configuration saved successfully"})
 
+@agent_bp.route('/llm_stream', methods=['GET'])
+def llm_stream():
+    """Server-sent events with the text of the LLM responses as it is generated (start, delta and end events)."""
+    events = Queue()
+    callback = llm_responses.subscribe(events.put)
+
+    def generate():
+        try:
+            while True:
+                try:
+                    yield f"data: {json.dumps(events.get(timeout=15))}\n\n"
+                except Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            llm_responses.unsubscribe(callback)
+
+    return Response(generate(), mimetype='text/event-stream')
+
+@agent_bp.route('/llm_cache/stats', methods=['GET'])
+def llm_cache_stats():
+    """Hits, misses, evictions and size of the LLM response cache of this process."""
+    return jsonify(dict(responseCache.get_cache().stats(), enabled=Config.LLM_CACHE))
+
+@agent_bp.route('/llm_cache', methods=['DELETE'])
+def clear_llm_cache():
+    responseCache.get_cache().clear()
+    return jsonify({"message": "Response cache cleared"})
+
 @agent_bp.route('/artists/config', methods=['GET'])
 def get_artists_config():
     agent_config_path = find_agent_config_dir()
@@ -154,6 +186,8 @@ def create():
         duration = data.get('duration')
         additional_information = data.get('additional_information')
         song_name = data.get('song_name', 'Untitled')
+        # A new song gets a new id; retrying or restarting a song passes back the song_id of its first run
+        song_id = data.get('song_id') or uuid.uuid4().hex
         agent_type = data.get('agentType', 'mITyJohn')
         selected_model = data['selected_model']
         api_provider = data['api_provider']
@@ -169,7 +203,7 @@ def create():
         def run_agent():
             input_callback = create_input_callback()
             logger.info("Starting agent execution")
-            agent = initialize_agent(song_name, agent_type, input_callback, selected_model, api_provider)
+            agent = initialize_agent(song_name, agent_type, input_callback, selected_model, api_provider, song_id)
             agent.input_callback = input_callback
             logger.info("Starting agent execution with callback: " )
             result = agent.execute_composition_chain(genre, duration, additional_information)
@@ -178,6 +212,6 @@ def create():
             # Optionally emit socketio event if available
 
         run_agent()
-        return jsonify({"message": "Agent started"})
+        return jsonify({"message": "Agent started", "song_id": song_id})
 
     return render_template('index.html')
@@ -13,6 +13,9 @@ sys.path.append(root_dir)
 
 from App.services.agent import GPTAgent
 from App.services.song import Song
+from App.services import sampleDatabase
+from App.services import sampleCompatibility
+from App.config import Config
 
 @chat_bp.route('/chat', methods=['POST'])
 def handle_chat():
@@ -36,19 +39,21 @@ def handle_chat():
 
     selected_files = data.get('selectedFiles', [])
 
-    samples_metadata_path = os.path.join(root_dir, 'Samples', 'sample_metadata.json')
-    with open(samples_metadata_path, 'r') as f:
-        sample_metadata = json.load(f)
+    # Look the selected files up in the sample database, which only reads their own entries
+    database = sampleDatabase.open_database(os.path.join(root_dir, 'Samples'))
+    filenames = [item.get('Filename', '') for item in selected_files]
+    found = database.lookup(filenames) if database is not None else [None] * len(filenames)
 
-    # Create a lookup dictionary for fast access by filename
-    metadata_lookup = {item['Filename']: item for item in sample_metadata}
+    # The song's tempo (use_bpm) and key, if the code or the message state them, tell which samples fit the song
+    key, bpm = sampleCompatibility.target_from_text(f"{sonic_pi_code} {data.get('message', '')}")
 
     # For each selected file, get its full metadata
     selected_metadata = []
-    for item in selected_files:
-        filename = item.get('Filename', '')
-        if filename in metadata_lookup:
-            selected_metadata.append(metadata_lookup[filename])
+    for filename, metadata in zip(filenames, found):
+        if metadata is not None:
+            if key is not None or bpm is not None:
+                metadata["Fits Song"] = sampleCompatibility.is_compatible(metadata, key, bpm, Config.SAMPLE_BPM_TOLERANCE)
+            selected_metadata.append(metadata)
         else:
             # Optionally, handle missing metadata
             selected_metadata.append({'Filename': filename, 'Error': 'Metadata not found'})
@@ -71,6 +76,8 @@ def handle_chat():
 
     song = Song(name=songName, logger=logger)
 
+    # A new agent per message, so concurrent messages never share song data; the provider client it uses is
+    # shared and keeps its connections warm (see llmClients)
     agent = GPTAgent(
         selected_model=selected_model,
         logger=logger,
@@ -1,10 +1,19 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, Response
 import os
 import json
 import logging
 import sys
+import queue
 from concurrent.futures import ThreadPoolExecutor
-from App.services.SampleMedataListing import process_directory
+from werkzeug.utils import secure_filename
+from App.services.SampleMedataListing import process_directory, SUPPORTED_FORMATS
+from App.services import yamnetWorker
+from App.services import sampleDatabase
+from App.services import sampleFeatureStore
+from App.services import sampleIngest
+from App.services import samplePeaks
+from App.services import sampleSearch
+from App.services.sampleProgress import progress as indexing_progress
 
 sample_bp = Blueprint('sample', __name__)
 logger = logging.getLogger()
@@ -13,7 +22,6 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 root_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
 sys.path.append(root_dir)
 
-progress_file = os.path.join(root_dir, 'progress.json')
 executor = ThreadPoolExecutor(max_workers=1)
 UPLOAD_DIRECTORY = os.path.join(root_dir, 'Samples', 'Uploaded')
 if not os.path.exists(UPLOAD_DIRECTORY):
@@ -22,12 +30,26 @@ if not os.path.exists(UPLOAD_DIRECTORY):
 # Run sample metadata listing
 default_samples_dir = os.path.join(root_dir, 'Samples')
 
+# Page size of /sample/search
+SEARCH_PER_PAGE = 50
+SEARCH_MAX_PER_PAGE = 500
+
 @sample_bp.route('/run_sample_metadata_listing', methods=['POST'])
 def run_sample_metadata_listing_endpoint():
     logger.info("run_sample_metadata_listing API called")
     try:
         input_directory = default_samples_dir
-        executor.submit(process_directory, input_directory)
+        # Only new or changed samples are analysed, unless a full rescan is requested
+        full_rescan = bool((request.get_json(silent=True) or {}).get('full_rescan', False))
+        # The run is reported as started before it is picked up by the executor; a request made while a run
+        # is in progress is refused rather than resetting its counters
+        if not indexing_progress.start():
+            return jsonify({"status": "running", "message": "A sample metadata listing is already running"}), 409
+        try:
+            executor.submit(process_directory, input_directory, full_rescan=full_rescan, started=True)
+        except Exception as e:
+            indexing_progress.finish(error=str(e))
+            raise
         return jsonify({"status": "accepted"}), 202
     except Exception as e:
         logger.error(f"Error running sample metadata listing: {e}")
@@ -35,21 +57,66 @@ def run_sample_metadata_listing_endpoint():
 
 @sample_bp.route('/sample_metadata_progress', methods=['GET'])
 def sample_metadata_progress():
+    return jsonify(indexing_progress.snapshot())
+
+@sample_bp.route('/sample_metadata_progress/stream', methods=['GET'])
+def sample_metadata_progress_stream():
+    """Server-sent events with a progress snapshot on every update, until the listing run ends."""
+    updates = queue.Queue()
+    callback = indexing_progress.subscribe(updates.put)
+
+    def generate():
+        try:
+            snapshot = indexing_progress.snapshot()
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            while snapshot["running"]:
+                try:
+                    snapshot = updates.get(timeout=15)
+                    yield f"data: {json.dumps(snapshot)}\n\n"
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            indexing_progress.unsubscribe(callback)
+
+    return Response(generate(), mimetype='text/event-stream')
+
+@sample_bp.route('/yamnet_worker', methods=['GET'])
+def yamnet_worker_status():
+    return jsonify(yamnetWorker.get_client().status())
+
+@sample_bp.route('/yamnet_worker/restart', methods=['POST'])
+def restart_yamnet_worker():
     try:
-        with open(progress_file, 'r') as f:
-            data = json.load(f)
-            progress = data.get("progress", 0)
-        return jsonify({"progress": progress})
+        yamnetWorker.get_client().restart()
+        return jsonify({"status": "restarted"})
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        logger.error(f"Error restarting YAMNet worker: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 @sample_bp.route('/sample_metadata', methods=['GET'])
 def get_sample_metadata():
+    # e.g. ?bpm_min=118&bpm_max=126&key=A minor&energy=high energy&tag=Drum machine
+    if any(arg in request.args for arg in ('bpm_min', 'bpm_max', 'key', 'energy', 'brightness', 'tag')):
+        return filter_sample_metadata()
+    try:
+        database = sampleDatabase.open_database(default_samples_dir)
+        if database is None:
+            return jsonify({"error": "No sample metadata, run the sample metadata listing first"}), 500
+        return jsonify(database.records())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+def filter_sample_metadata():
+    """Samples matching the filters of the request, evaluated on the columns of the feature store."""
     try:
-        sample_metadata_path = os.path.join(root_dir, 'Samples', 'sample_metadata.json')
-        with open(sample_metadata_path, 'r', encoding='utf-8') as f:
-            sample_metadata = json.load(f)
-        return jsonify(sample_metadata)
+        return jsonify(sampleFeatureStore.query_records(
+            default_samples_dir,
+            bpm=(request.args.get('bpm_min', type=float), request.args.get('bpm_max', type=float)),
+            key=request.args.get('key'),
+            energy=request.args.get('energy'),
+            brightness=request.args.get('brightness'),
+            tags=request.args.getlist('tag'),
+        ))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -64,15 +131,52 @@ def get_sample(filename):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@sample_bp.route('/sample/<path:filename>/peaks', methods=['GET'])
+def get_sample_peaks(filename):
+    """Waveform overview of a sample: ?width=<pixels> picks the zoom level, ?level=<n> selects one directly.
+
+    Returns the audiowaveform .dat format (see samplePeaks), or JSON with ?format=json.
+    """
+    try:
+        sample_path = os.path.join(root_dir, 'Samples', filename)
+        if not sample_path.endswith(SUPPORTED_FORMATS) or not os.path.exists(sample_path):
+            return jsonify({"error": "File not found"}), 404
+        sr, samples_per_peak, peaks = samplePeaks.load_peaks(
+            sample_path, width=request.args.get('width', type=int), level=request.args.get('level', type=int))
+        if request.args.get('format') == 'json':
+            return jsonify({"sample_rate": sr, "samples_per_peak": samples_per_peak, "length": len(peaks),
+                            "data": peaks.ravel().tolist()})
+        response = Response(samplePeaks.to_dat(sr, samples_per_peak, peaks), mimetype='application/octet-stream')
+        response.cache_control.no_cache = True  # revalidated with the ETag, which changes with the sample
+        response.set_etag(f"{os.path.getmtime(sample_path)}-{samples_per_peak}")
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @sample_bp.route('/sample/search', methods=['GET'])
 def search_samples():
-    query = request.args.get('query', '').lower()
-    samples_dir = os.path.join(root_dir, 'Samples')
-    filepath = os.path.join(samples_dir, f'sample_metadata.json')
-    with open(filepath, 'r') as f:
-        data = json.load(f)
-    results = [item for item in data if query.lower() in json.dumps(item).lower()]
-    return jsonify(results)
+    # e.g. ?query=warm pad&bpm_min=90&bpm_max=110&duration_max=8&key=A minor&track_type=Instrumental&page=2&per_page=20
+    # Returns the samples of the page, best match first; X-Total-Count holds the number of matches
+    try:
+        per_page = min(max(request.args.get('per_page', SEARCH_PER_PAGE, type=int), 1), SEARCH_MAX_PER_PAGE)
+        page = max(request.args.get('page', 1, type=int), 1)
+        total, results = sampleSearch.search(
+            default_samples_dir,
+            request.args.get('query', ''),
+            offset=(page - 1) * per_page,
+            limit=per_page,
+            bpm=(request.args.get('bpm_min', type=float), request.args.get('bpm_max', type=float)),
+            duration=(request.args.get('duration_min', type=float), request.args.get('duration_max', type=float)),
+            key=request.args.get('key'),
+            track_type=request.args.get('track_type'),
+        )
+        response = jsonify(results)
+        response.headers['X-Total-Count'] = str(total)
+        response.headers['X-Page'] = str(page)
+        response.headers['X-Per-Page'] = str(per_page)
+        return response
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 @sample_bp.route('/upload_samples', methods=['POST'])
 def upload_samples():
@@ -80,7 +184,20 @@ def upload_samples():
         return jsonify({"error": "No files part in the request"}), 400
 
     files = request.files.getlist('files')
+    saved = []
     for file in files:
-        file.save(os.path.join(UPLOAD_DIRECTORY, file.filename))
+        file_path = os.path.join(UPLOAD_DIRECTORY, secure_filename(file.filename))
+        file.save(file_path)
+        if file_path.endswith(SUPPORTED_FORMATS):
+            saved.append(file_path)
+
+    # Analyse and index the new samples in the background; poll /api/upload_samples/<job_id> for the outcome
+    job = sampleIngest.get_queue(default_samples_dir).submit(saved)
+    return jsonify({"status": "success", "job_id": job.id}), 202
 
-    return jsonify({"status": "success"}), 200
+@sample_bp.route('/upload_samples/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    job = sampleIngest.get_queue(default_samples_dir).get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
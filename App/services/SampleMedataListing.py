@@ -2,116 +2,163 @@ import os
 import json
 import csv
 import librosa
-import tensorflow as tf
 import numpy as np
-import faiss
 import logging
 import time
-from sentence_transformers import SentenceTransformer
+import math
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from App.config import Config
+from App.services.sampleManifest import SampleManifest
+from App.services import yamnetWorker
+from App.services import sampleIndex
+from App.services import sampleRetrieval
+from App.services import sampleDatabase
+from App.services import sampleFeatureStore
+from App.services import sampleProgress
+from App.services import samplePeaks
+from App.services import sampleFingerprint
+from App.services import audioFeatures
+from App.services.yamnetWorker import YAMNET_SAMPLE_RATE
 
 # Configure logging
 log_file = os.path.join(os.path.dirname(__file__), 'app.log')
 logging.basicConfig(level=logging.INFO, handlers=[logging.FileHandler(log_file, 'a', 'utf-8')])
 logger = logging.getLogger(__name__)
 
-progress_file = os.path.join(os.path.dirname(__file__), 'progress.json')
+SUPPORTED_FORMATS = ('.mp3', '.wav', '.flac')
+FINGERPRINT_CHUNK_SIZE = 16
+# Folders written inside the library that hold no samples: the waveform peaks (next to the samples of every
+# subfolder) and the feature store
+GENERATED_DIRECTORIES = {samplePeaks.PEAKS_DIRECTORY, sampleFeatureStore.STORE_DIRECTORY}
 
-def update_progress(progress):
-    with open(progress_file, 'w') as f:
-        json.dump({"progress": progress}, f)
+_file_done_queue = None
 
-# Load YAMNet model and class names
-model_path = os.path.join(os.path.dirname(__file__), "..", "inc", "yamnet-tensorflow2-yamnet-v1")
-yamnet_model = tf.saved_model.load(model_path)  # Load the model from the specified directory
-yamnet_classes = []
-with open("inc/yamnet-tensorflow2-yamnet-v1/assets/yamnet_class_map.csv", "r") as f:
-    yamnet_classes = [line.strip() for line in f.readlines()]
+def _init_worker(file_done_queue=None):
+    """Process pool initializer: every analysis worker owns its own YAMNet instance.
 
-def preprocess_audio(file_path):
-    """Preprocess the audio for YAMNet: mono and 16kHz sampling rate."""
+    When YAMNet cannot be loaded the worker still analyses its files, tagging them "Error" like the serial path
+    does when the YAMNet worker is unavailable, instead of breaking the pool.
+    """
+    global _file_done_queue
+    _file_done_queue = file_done_queue
     try:
-        y, sr = librosa.load(file_path, sr=16000, mono=True)  # Resample to 16kHz
-        return tf.convert_to_tensor(y, dtype=tf.float32)
+        yamnetWorker.use_local_engine()
     except Exception as e:
-        raise ValueError(f"Error preprocessing audio file {file_path}: {e}")
+        logger.error(f"Could not load YAMNet in analysis worker {os.getpid()}: {e}")
 
-def classify_sound(file_path):
-    """Classify audio sound using YAMNet and clean up tags."""
-    try:
-        waveform = preprocess_audio(file_path)
+def _analyse_batch(file_paths, pooling):
+    """Pool worker task: analyse a batch, reporting every analysed file to the parent as it goes."""
+    timings = {}
+    on_file = _file_done_queue.put if _file_done_queue is not None else None
+    return process_audio_batch(file_paths, pooling, timings, on_file), timings
 
-        # Get prediction scores
-        scores, embeddings, spectrogram = yamnet_model(waveform)
+def add_timing(timings, stage, started):
+    """Add the time elapsed since `started` (a perf_counter value) to timings[stage]."""
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
 
-        # Get the top 5 classes with highest scores
-        top_5_indices = tf.argsort(scores[0], direction="DESCENDING")[:5].numpy()
-        top_5_classes = [
-            (yamnet_classes[i].split(",")[-1].strip().replace('"', ''), float(scores[0][i].numpy()))
-            for i in top_5_indices
-        ]
+def decode_audio(file_path):
+    """Decode an audio file once, as a mono buffer at its native sampling rate."""
+    return librosa.load(file_path, sr=None)
 
-        return top_5_classes
-    except Exception as e:
-        return [("Error", 0.0)]
+def yamnet_waveform(y, sr):
+    """16kHz mono view of an already decoded buffer, as expected by YAMNet."""
+    if sr != YAMNET_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=YAMNET_SAMPLE_RATE)
+    return np.asarray(y, dtype=np.float32)
 
-def detect_key(y, sr):
-    """Detect the musical key (e.g., C major, A minor) of the audio."""
+def preprocess_audio(file_path):
+    """Preprocess the audio for YAMNet: mono and 16kHz sampling rate."""
     try:
-        # Calculate chroma features
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr, n_chroma=12, hop_length=512)
-        chroma_mean = chroma.mean(axis=1)
-
-        # Skip if chroma_mean has all zeros
-        if np.max(chroma_mean) == 0:
-            return "Unknown"
-
-        # Normalize chroma features
-        chroma_mean /= np.max(chroma_mean)
-
-        # Major and Minor templates
-        major_template = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
-        minor_template = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
-
-        # Correlate with templates
-        major_scores = [np.correlate(chroma_mean, np.roll(major_template, i))[0] for i in range(12)]
-        minor_scores = [np.correlate(chroma_mean, np.roll(minor_template, i))[0] for i in range(12)]
+        y, sr = decode_audio(file_path)
+        return yamnet_waveform(y, sr)
+    except Exception as e:
+        raise ValueError(f"Error preprocessing audio file {file_path}: {e}")
 
-        # Determine best match
-        best_major = np.argmax(major_scores)
-        best_minor = np.argmax(minor_scores)
+def classify_waveforms(waveforms, pooling="mean"):
+    """Classify many 16kHz mono waveforms with batched YAMNet inference (see yamnetWorker).
 
-        if major_scores[best_major] > minor_scores[best_minor]:
-            mode = "major"
-            key_index = best_major
-        else:
-            mode = "minor"
-            key_index = best_minor
-
-        # Key names
-        key_names = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-        return f"{key_names[key_index]} {mode}"
+    Scores are pooled ("mean" or "max") over all frames of a clip, so the top 5 classes describe
+    the whole sample rather than its first second.
+    """
+    waveforms = list(waveforms)
+    if not waveforms:
+        return []
+    try:
+        return yamnetWorker.classify_waveforms(waveforms, pooling)
     except Exception as e:
-        print(f"Error detecting key: {e}")
-        return "Unknown"
-
-def process_audio(file_path):
-    """Extract key, BPM, duration, vibe, track type, and detailed description from an audio file."""
+        logger.error(f"YAMNet classification failed: {e}")
+        return [[("Error", 0.0)] for _ in waveforms]
+
+def classify_sound(waveform, pooling="mean"):
+    """Classify a 16kHz mono waveform (see yamnet_waveform) using YAMNet and clean up tags."""
+    return classify_waveforms([waveform], pooling)[0]
+
+def should_stream(file_path):
+    """Long files are measured block by block (see audioFeatures.stream_measure) to bound memory."""
+    threshold = Config.STREAM_THRESHOLD_SECONDS
+    if threshold <= 0:
+        return False
     try:
-        y, sr = librosa.load(file_path, sr=None)
-        duration = librosa.get_duration(y=y, sr=sr)
-
-        # Skip very short audio files
-        if duration < 0.8:
-            return {"Filename": file_path.replace("\\", "/"), "Error": "Audio too short to analyze"}
+        return librosa.get_duration(path=file_path) > threshold
+    except Exception:
+        return False  # let the regular decode report the problem
 
-        n_fft = min(1024, len(y))
+def cache_peaks(file_path, peaks, sr):
+    """Store the waveform peaks collected by a samplePeaks.PeakBuilder."""
+    try:
+        samplePeaks.save_peaks(file_path, peaks.levels(), sr)
+    except Exception as e:
+        logger.warning(f"Could not cache the peaks of {file_path}: {e}")  # previews are computed on request
 
-        # Extract BPM and ensure it's a scalar
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        if isinstance(tempo, np.ndarray):  # Check if tempo is an array
-            tempo = tempo[0] if tempo.size > 0 else 0
-        tempo = float(tempo)
+def extract_features(file_path, timings=None):
+    """Decode an audio file and compute its key, BPM, duration, brightness, energy and dynamics.
 
+    Returns (features, waveform) where waveform is the 16kHz view for YAMNet; when the file
+    cannot be analysed, features is an error entry and waveform is None. Seconds spent decoding
+    and measuring are added to the "decode" and "features" entries of `timings`. The waveform
+    peaks of the file are cached on the way (see samplePeaks) and, with SAMPLE_DEDUP, its fingerprint
+    is taken from the same decoded signal (features["fingerprint"], see sampleFingerprint).
+    """
+    try:
+        started = time.perf_counter()
+        if should_stream(file_path):
+            sr = librosa.get_samplerate(file_path)
+            peaks = samplePeaks.PeakBuilder()
+            fingerprint = sampleFingerprint.FingerprintBuilder(sr) if Config.SAMPLE_DEDUP else None
+            measured, duration, waveform = audioFeatures.stream_measure(file_path, peaks=peaks, fingerprint=fingerprint)
+            cache_peaks(file_path, peaks, sr)
+            add_timing(timings, "features", started)  # blocks are decoded while they are measured
+            started = time.perf_counter()
+            fingerprint = fingerprint.fingerprint(duration) if fingerprint is not None else None
+            add_timing(timings, "fingerprint", started)
+        else:
+            y, sr = decode_audio(file_path)
+            duration = librosa.get_duration(y=y, sr=sr)
+            add_timing(timings, "decode", started)
+
+            # Skip very short audio files
+            if duration < 0.8:
+                return {"Filename": file_path.replace("\\", "/"), "Error": "Audio too short to analyze"}, None
+
+            started = time.perf_counter()
+            peaks = samplePeaks.PeakBuilder()
+            peaks.add(y)
+            cache_peaks(file_path, peaks, sr)
+            measured = audioFeatures.measure_audio(y, sr)
+            # YAMNet works on a resampled view of the same buffer, the file is not decoded twice
+            waveform = yamnet_waveform(y, sr)
+            add_timing(timings, "features", started)
+            started = time.perf_counter()
+            fingerprint = None
+            if Config.SAMPLE_DEDUP:
+                # The fingerprint is taken at the YAMNet sampling rate, from the same view
+                fingerprint = sampleFingerprint.fingerprint(waveform[:sampleFingerprint.FINGERPRINT_MAX_LENGTH], duration)
+            add_timing(timings, "fingerprint", started)
+
+        tempo = measured["tempo"]
         tempo_category = (
             "Relaxed" if tempo < 90 else
             "Moderate" if 90 <= tempo < 120 else
@@ -119,11 +166,10 @@ def process_audio(file_path):
         )
 
         # Spectral features
-        spectral = librosa.feature.spectral_centroid(y=y, sr=sr, n_fft=n_fft)
-        brightness = "bright" if spectral.mean() > 2000 else "warm"
+        brightness = "bright" if measured["centroid"] > 2000 else "warm"
 
         # RMS Energy
-        rms = librosa.feature.rms(y=y, frame_length=n_fft).mean()
+        rms = measured["rms"]
 
         # Adjust the energy threshold dynamically or lower it
         energy_threshold = 0.005  # Lowered threshold for low-energy files
@@ -133,12 +179,36 @@ def process_audio(file_path):
         else:
             energy = "high energy" if rms > 0.05 else "low energy"
 
-        max_amplitude = np.max(np.abs(y))
-        dynamic_range = "intense and punchy" if max_amplitude > 0.8 else "soft and smooth"
-
-        key = detect_key(y, sr)
-
-        top_5_classes = classify_sound(file_path)
+        dynamic_range = "intense and punchy" if measured["max_amplitude"] > 0.8 else "soft and smooth"
+
+        features = {
+            "duration": duration,
+            "tempo": tempo,
+            "tempo_category": tempo_category,
+            "brightness": brightness,
+            "energy": energy,
+            "dynamic_range": dynamic_range,
+            "key": measured["key"],
+            "fingerprint": fingerprint,
+        }
+        return features, waveform
+    except Exception as e:
+        return {"Filename": file_path.replace("\\", "/"), "Error": str(e)}, None
+
+def sample_filename(file_path):
+    """Filename of a sample in the metadata: its parent folder and file name."""
+    return f"{os.path.basename(os.path.dirname(file_path))}/{os.path.basename(file_path)}"
+
+def describe_sample(file_path, features, top_5_classes):
+    """Build the metadata entry (vibe, tags, track type, description) of an analysed sample."""
+    duration = features["duration"]
+    tempo = features["tempo"]
+    tempo_category = features["tempo_category"]
+    brightness = features["brightness"]
+    energy = features["energy"]
+    dynamic_range = features["dynamic_range"]
+    key = features["key"]
+    try:
         classification_tags = [cls[0] for cls in top_5_classes]
 
         # Expanded instrumental categories
@@ -168,10 +238,8 @@ def process_audio(file_path):
         tags = [tempo_category, brightness, energy, dynamic_range, key] + classification_tags
         tags = [tag for tag in tags if tag != "Unknown"]
 
-        parent_folder = os.path.basename(os.path.dirname(file_path))
-        filename = os.path.basename(file_path)
         result = {
-            "Filename": f"{parent_folder}/{filename}",
+            "Filename": sample_filename(file_path),
             "Duration": round(duration, 2),
             "BPM": round(tempo, 2),
             "Key": key,
@@ -187,32 +255,223 @@ def process_audio(file_path):
     except Exception as e:
         return {"Filename": file_path.replace("\\", "/"), "Error": str(e)}
 
-def process_subfolder(subfolder_path):
-    """Process all audio files in a subfolder and save metadata to JSON and CSV files."""
+def process_audio_batch(file_paths, pooling="mean", timings=None, on_file=None):
+    """Analyse several audio files, classifying all of them with batched YAMNet inference.
+
+    on_file(file_path) is called as soon as the features of a file are extracted; time spent per stage
+    is added to `timings` (see extract_features, plus "yamnet"). The fingerprint of a file, when one was
+    taken, is returned in the "Fingerprint" field of its entry, see take_fingerprints.
+    """
+    extracted = []
+    for file_path in file_paths:
+        extracted.append(extract_features(file_path, timings))
+        if on_file:
+            on_file(file_path)
+    waveforms = [waveform for _, waveform in extracted if waveform is not None]
+    started = time.perf_counter()
+    classes = iter(classify_waveforms(waveforms, pooling))
+    add_timing(timings, "yamnet", started)
+
+    results = []
+    for file_path, (features, waveform) in zip(file_paths, extracted):
+        if waveform is None:
+            results.append(features)
+        else:
+            result = describe_sample(file_path, features, next(classes))
+            if features["fingerprint"] is not None:
+                result["Fingerprint"] = features["fingerprint"]
+            results.append(result)
+    return results
+
+def take_fingerprints(file_paths, results):
+    """Remove the fingerprints from the analysed entries of file_paths; returns file path -> fingerprint."""
+    return {file_path: result.pop("Fingerprint") for file_path, result in zip(file_paths, results) if "Fingerprint" in result}
+
+def process_audio(file_path):
+    """Extract key, BPM, duration, vibe, track type, and detailed description from an audio file."""
+    result = process_audio_batch([file_path])[0]
+    result.pop("Fingerprint", None)
+    return result
+
+def sample_folders(dirs):
+    """Sort the folders os.walk found, in place, and leave the generated ones out of the walk."""
+    dirs[:] = sorted(name for name in dirs if name not in GENERATED_DIRECTORIES)
+
+def list_audio_files(subfolder_path):
+    """Return the supported audio files below a subfolder, in a stable (sorted) order."""
+    file_paths = []
+    for root, dirs, files in os.walk(subfolder_path):
+        sample_folders(dirs)
+        for file in sorted(files):
+            if file.endswith(SUPPORTED_FORMATS):  # Supported formats
+                file_paths.append(os.path.join(root, file))
+    return file_paths
+
+def collect_subfolder_metadata(subfolder_path, analysed=None):
+    """Metadata of all valid audio files in a subfolder.
+
+    When `analysed` (file path -> metadata) is given, files are looked up there instead of being analysed again.
+    """
     metadata_list = []
 
-    for root, _, files in os.walk(subfolder_path):
-        for file in files:
-            if file.endswith(('.mp3', '.wav', '.flac')):  # Supported formats
-                file_path = os.path.join(root, file)
-                print(f"Processing file: {file_path}")  # Debug log
-                metadata = process_audio(file_path)
-                if "Error" not in metadata:
-                    metadata_list.append(metadata)
-                else:
-                    print(f"Error processing file {file_path}: {metadata['Error']}")
+    for file_path in list_audio_files(subfolder_path):
+        if analysed is not None and file_path in analysed:
+            metadata = analysed[file_path]
+        else:
+            logger.info(f"Processing file: {file_path}")
+            metadata = process_audio(file_path)
+        if "Duplicate Of" in metadata:
+            continue  # listed once, under the sample it duplicates
+        if "Error" not in metadata:
+            metadata_list.append(metadata)
+        else:
+            logger.warning(f"Error processing file {file_path}: {metadata['Error']}")
 
-    if not metadata_list:
-        print(f"No valid audio files found in the subfolder: {subfolder_path}")
-        return None
+    return metadata_list
 
+def subfolder_json_path(subfolder_path):
     subfolder_name = os.path.basename(subfolder_path)
-    json_output = os.path.join(subfolder_path, f"{subfolder_name}_metadata.json")
-    csv_output = os.path.join(subfolder_path, f"{subfolder_name}_metadata.csv")
+    return os.path.join(subfolder_path, f"{subfolder_name}_metadata.json")
+
+def process_subfolder(subfolder_path, analysed=None):
+    """Process all audio files in a subfolder and save metadata to JSON and CSV files."""
+    metadata_list = collect_subfolder_metadata(subfolder_path, analysed)
+
+    if not metadata_list:
+        logger.info(f"No valid audio files found in the subfolder: {subfolder_path}")
+        return None
 
+    json_output = subfolder_json_path(subfolder_path)
     save_to_json(metadata_list, json_output)
     return json_output
 
+def resolve_workers(workers=None):
+    """Number of analysis processes to use: explicit value, else Config.SAMPLE_WORKERS (0 = all cores)."""
+    if workers is None:
+        workers = Config.SAMPLE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+def analyse_files(file_paths, workers=None, on_progress=None, batch_size=None, on_file=None, on_timings=None):
+    """Run process_audio_batch over file_paths, serially or on a process pool.
+
+    Files are handed out in batches of up to `batch_size` (default Config.SAMPLE_BATCH_SIZE), so every
+    YAMNet call classifies a whole batch. Results are returned in the order of file_paths, whatever
+    order the workers finish in. on_progress(done, total) is called after every analysed batch,
+    on_file(file_path) once per file as soon as its features are extracted, and on_timings(timings)
+    with the seconds spent per stage of every batch.
+    """
+    total = len(file_paths)
+    workers = min(resolve_workers(workers), total)
+    batch_size = batch_size or Config.SAMPLE_BATCH_SIZE
+    if workers > 1:
+        # Smaller batches when there are too few files to keep every worker busy
+        batch_size = max(1, min(batch_size, math.ceil(total / workers)))
+    batches = [(start, file_paths[start:start + batch_size]) for start in range(0, total, batch_size)]
+    results = [None] * total
+    done = 0
+
+    if workers <= 1:
+        logger.info(f"Analysing {total} files in batches of {batch_size}")
+        for start, batch in batches:
+            timings = {}
+            results[start:start + len(batch)] = process_audio_batch(batch, Config.YAMNET_POOLING, timings, on_file)
+            done += len(batch)
+            if on_timings:
+                on_timings(timings)
+            if on_progress:
+                on_progress(done, total)
+        return results
+
+    logger.info(f"Analysing {total} files on {workers} worker processes in batches of {batch_size}")
+    # TensorFlow is not fork-safe, so workers are always spawned fresh
+    context = multiprocessing.get_context("spawn")
+    file_done_queue = context.Queue()
+    reported = set()
+
+    def report_files(file_paths):
+        for file_path in file_paths:
+            if file_path not in reported:
+                reported.add(file_path)
+                if on_file:
+                    on_file(file_path)
+
+    def drain_file_done_queue():
+        file_paths = []
+        while not file_done_queue.empty():
+            file_paths.append(file_done_queue.get())
+        report_files(file_paths)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(file_done_queue,)) as pool:
+        futures = {pool.submit(_analyse_batch, batch, Config.YAMNET_POOLING): (start, batch) for start, batch in batches}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            drain_file_done_queue()
+            for future in finished:
+                start, batch = futures[future]
+                try:
+                    results[start:start + len(batch)], timings = future.result()
+                    if on_timings:
+                        on_timings(timings)
+                except Exception as e:
+                    results[start:start + len(batch)] = [
+                        {"Filename": file_path.replace("\\", "/"), "Error": str(e)} for file_path in batch
+                    ]
+                report_files(batch)  # files whose notification is still in flight, or of a failed batch
+                done += len(batch)
+                if on_progress:
+                    on_progress(done, total)
+    return results
+
+def fingerprint_files(file_paths, workers=None):
+    """Fingerprints (see sampleFingerprint.fingerprint_file) of file_paths, on a process pool when there are many."""
+    workers = min(resolve_workers(workers), math.ceil(len(file_paths) / FINGERPRINT_CHUNK_SIZE))
+    if workers <= 1:
+        return [sampleFingerprint.fingerprint_file(file_path) for file_path in file_paths]
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        return list(pool.map(sampleFingerprint.fingerprint_file, file_paths, chunksize=FINGERPRINT_CHUNK_SIZE))
+
+def fingerprint_missing(manifest, file_paths, workers=None):
+    """Compute and store in the manifest the fingerprints of the files of file_paths that were never fingerprinted."""
+    missing = [file_path for file_path in file_paths if manifest.fingerprint(file_path) is None]
+    if missing:
+        logger.info(f"Fingerprinting {len(missing)} files")
+    for file_path, record in zip(missing, fingerprint_files(missing, workers)):
+        manifest.set_fingerprint(file_path, record)
+
+def find_duplicates(manifest, file_paths, analysed):
+    """Entries of the files of file_paths that are exact or near duplicates of another one (see sampleFingerprint).
+
+    Files that have metadata in `analysed` are kept as originals first, so a listed sample is never replaced by a
+    copy of it; the other files follow in order. Duplicate entries name their original under
+    "Duplicate Of", and are left out of the metadata listing and the sample index.
+    """
+    index = sampleFingerprint.FingerprintIndex(Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+    has_metadata = lambda file_path: file_path in analysed and "Duplicate Of" not in analysed[file_path]
+    duplicates = {}
+    for file_path in sorted(file_paths, key=lambda file_path: not has_metadata(file_path)):
+        record = manifest.fingerprint(file_path)
+        original = index.match(record)
+        if original is None:
+            index.add(file_path, record)
+        else:
+            duplicates[file_path] = {"Filename": sample_filename(file_path), "Duplicate Of": sample_filename(original)}
+    return duplicates
+
+def save_duplicates(input_directory, manifest):
+    """Write sample_duplicates.json: the Filename of every original sample with the Filenames of its duplicates."""
+    duplicates = {}
+    for entry in manifest.entries.values():
+        metadata = entry.get("metadata") or {}
+        if "Duplicate Of" in metadata:
+            duplicates.setdefault(metadata["Duplicate Of"], []).append(metadata["Filename"])
+    with open(os.path.join(input_directory, "sample_duplicates.json"), "w", encoding="utf-8") as f:
+        json.dump(duplicates, f, indent=4)
+
 def save_to_json(metadata_list, output_file):
     """Save metadata to a JSON file."""
     if not metadata_list:
@@ -222,44 +481,131 @@ def save_to_json(metadata_list, output_file):
         json.dump(metadata_list, json_file, indent=4)
     logger.info(f"Metadata saved to JSON: {output_file}")
 
-def process_directory(input_directory):
-    """Process each subfolder in the directory and create a summary JSON file."""
+# Held while the library files (manifest, sample database, metadata JSON, index) are rewritten, see sampleIngest
+library_lock = threading.Lock()
+
+def process_directory(input_directory, workers=None, full_rescan=False, started=False):
+    """Index the sample library (see index_directory), reporting progress on sampleProgress.progress.
+
+    `started` is set by a caller that already reported the run as started (see sample_routes). Otherwise the
+    run is refused, and False returned, while another one is in progress.
+    """
+    progress = sampleProgress.progress
+    if not started and not progress.start():
+        logger.warning("A sample metadata listing is already running, not starting another one")
+        return False
+    try:
+        with library_lock:
+            index_directory(input_directory, workers, full_rescan, progress)
+    except Exception as e:
+        logger.error(f"Sample metadata listing failed: {e}")
+        progress.finish(error=str(e))
+        raise
+    progress.finish()
+    return True
+
+def index_directory(input_directory, workers=None, full_rescan=False, progress=None):
+    """Process each subfolder in the directory and create a summary JSON file.
+
+    Only files that are new or changed since the previous run (see SampleManifest) are analysed,
+    on `workers` processes (see resolve_workers). Entries of deleted files are dropped and only the
+    subfolder JSON files that are affected are rewritten. `full_rescan` ignores the manifest.
+    The sample database (see sampleDatabase) and the sample index (see sampleIndex) hold one row per
+    entry of sample_metadata.json.
+    """
     logger.info(f"Processing directory: {input_directory}")
-    update_progress(0)
+    progress = progress or sampleProgress.IndexingProgress()
     summary = []
-
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embeddings = []
     metadata = []
 
-    total_subfolders = len(next(os.walk(input_directory))[1])
-    processed_subfolders = 0
+    metadata_file = os.path.join(input_directory, "sample_metadata.json")
 
+    subfolder_paths = []
     for root, dirs, _ in os.walk(input_directory):
+        sample_folders(dirs)
         for subfolder in dirs:
-            subfolder_path = os.path.join(root, subfolder)
+            subfolder_paths.append(os.path.join(root, subfolder))
+
+    file_paths = list(dict.fromkeys(
+        file_path for subfolder_path in subfolder_paths for file_path in list_audio_files(subfolder_path)
+    ))
+
+    manifest = SampleManifest(input_directory)
+    if full_rescan:
+        manifest.entries = {}
+
+    analysed = {}
+    for file_path in file_paths:
+        cached = manifest.cached_metadata(file_path)
+        if cached is not None:
+            analysed[file_path] = cached
+    removed = manifest.prune(file_paths)
+    for key in removed:
+        samplePeaks.remove_peaks(os.path.join(input_directory, key))
+
+    # New and changed files are fingerprinted by their analysis, from the signal it decodes (see extract_features);
+    # unchanged files still listed as duplicates keep that entry as long as their sample is unchanged
+    listed = dict(analysed)
+    still_duplicates = {}
+    if Config.SAMPLE_DEDUP:
+        progress.set_stage("fingerprinting")
+        timings = {}
+        started = time.perf_counter()
+        fingerprint_missing(manifest, list(listed), workers)  # files analysed before deduplication was enabled
+        still_duplicates = find_duplicates(manifest, list(listed), listed)
+        add_timing(timings, "fingerprint", started)
+        progress.add_timings(timings)
+    # Files that were collapsed into a sample which has since changed or been removed are analysed again
+    to_analyse = [
+        file_path for file_path in file_paths
+        if file_path not in analysed or ("Duplicate Of" in analysed[file_path] and file_path not in still_duplicates)
+    ]
+    logger.info(f"{len(to_analyse)} new or changed files, {len(analysed)} unchanged, {len(removed)} removed")
+
+    file_sizes = {file_path: os.path.getsize(file_path) for file_path in to_analyse}
+    progress.start_analysis(list(file_sizes.values()))
+    results = analyse_files(to_analyse, workers,
+                            on_file=lambda file_path: progress.file_done(file_sizes[file_path]),
+                            on_timings=progress.add_timings)
+    progress.set_stage("writing")
+    fingerprints = take_fingerprints(to_analyse, results)
+    for file_path, result in zip(to_analyse, results):
+        analysed[file_path] = result
+        manifest.update(file_path, result)
+        if file_path in fingerprints:
+            manifest.set_fingerprint(file_path, fingerprints[file_path])
+
+    # New samples that duplicate a listed sample (or each other) are collapsed into it once they are fingerprinted
+    duplicates = find_duplicates(manifest, file_paths, listed) if Config.SAMPLE_DEDUP else {}
+    changed_duplicates = [file_path for file_path, entry in duplicates.items() if analysed.get(file_path) != entry]
+    for file_path in changed_duplicates:
+        analysed[file_path] = duplicates[file_path]
+        manifest.update(file_path, duplicates[file_path])
+    logger.info(f"{len(duplicates)} duplicates")
+    manifest.save()
+    save_duplicates(input_directory, manifest)
+
+    changed_keys = {manifest.key(file_path) for file_path in to_analyse + changed_duplicates} | set(removed)
+
+    for subfolder_path in subfolder_paths:
+        subfolder = os.path.basename(subfolder_path)
+        json_output = subfolder_json_path(subfolder_path)
+        prefix = manifest.key(subfolder_path) + "/"
+        dirty = not os.path.exists(json_output) or any(key.startswith(prefix) for key in changed_keys)
+
+        metadata_list = collect_subfolder_metadata(subfolder_path, analysed)
+        if dirty:
             logger.info(f"Processing subfolder: {subfolder_path}")
-            json_output = process_subfolder(subfolder_path)
-            if json_output:
-                summary.append({
-                    "subfolder": subfolder,
-                    "file_location": json_output.replace("\\", "/")
-                })
-                with open(json_output, 'r', encoding='utf-8') as f:
-                    json_content = json.load(f)
-
-                for item in json_content:
-                    metadata.append(item)
-                processed_subfolders += 1
-                progress = (processed_subfolders / total_subfolders) * 90
-                update_progress(progress)
-                print(f"Progress: {progress:.2f}%")
-
-    print("Progress: 90.00%")
-
-    final_json_content = json.dumps(metadata)  # Serialize the entire metadata array
-    embedding = model.encode(final_json_content)  # Encode the final JSON string
-    embeddings.append(embedding)  # Append the embedding
+            if metadata_list:
+                save_to_json(metadata_list, json_output)
+            elif os.path.exists(json_output):
+                os.remove(json_output)  # every sample of this subfolder was removed
+        if metadata_list:
+            summary.append({
+                "subfolder": subfolder,
+                "file_location": json_output.replace("\\", "/")
+            })
+            metadata.extend(metadata_list)
 
     try:
         summary_json = os.path.join(input_directory, "summary_samples.json")
@@ -273,21 +619,25 @@ def process_directory(input_directory):
                 json.dump([], json_file, indent=4)
         logger.info(f"Created empty summary JSON: {summary_json}")
 
-    # Convert embeddings to a NumPy array
-    embedding_array = np.array(embeddings).astype("float32")
-
-    # Create a FAISS index
-    dimension = embedding_array.shape[1]  # Embedding size
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embedding_array)
+    if (not changed_keys and os.path.exists(metadata_file) and os.path.exists(sampleDatabase.database_path(input_directory))
+            and sampleIndex.is_current(input_directory, len(metadata))):
+        logger.info("Sample library unchanged, keeping the existing index")
+        logger.info("Processing complete")
+        return
 
-    # Save the index and metadata
-    faiss.write_index(index, os.path.join(input_directory, "sample_index.faiss"))
-    with open(os.path.join(input_directory, "sample_metadata.json"), "w") as f:
+    # The database is committed first: the index swapped in carries the generation its ids are rows of.
+    # One vector per sample; only new or changed samples are encoded
+    generation = sampleDatabase.write_library(input_directory, metadata)
+    progress.set_stage("embedding")
+    timings = {}
+    started = time.perf_counter()
+    sampleRetrieval.swap_index(input_directory, sampleIndex.update_index(input_directory, metadata), generation)
+    add_timing(timings, "embed", started)
+    progress.add_timings(timings)
+    with open(metadata_file, "w") as f:
         json.dump(metadata, f)
 
     logger.info("Processing complete")
-    update_progress(100)
 
 # Main script
 if __name__ == "__main__":
@@ -2,27 +2,27 @@
 This file contains the GPTAgent class that interacts with the OpenAI or Anthropic API to generate song lyrics.
 '''
 
-from openai import OpenAI
-from openai import AzureOpenAI
-from anthropic import Anthropic, HUMAN_PROMPT, AI_PROMPT
 from .audiorecorder import AudioRecorder
 from .songCreationData import SongCreationData
 from .sonicPi import SonicPi
 from pythonosc import udp_client, dispatcher as osc_dispatcher, osc_server
-import tiktoken
 import json
 import os
-import requests
 import imghdr
 import re
 import threading
 import time
 import asyncio
 import datetime
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
 from App.config import Config
+from . import sampleRetrieval
+from . import sampleDatabase
+from . import sampleCompatibility
+from . import tokenAccounting
+from . import responseCache
+from . import llmClients
+from . import llmStream
+from . import phaseScheduler
 
 class GPTAgent:
 
@@ -36,11 +36,13 @@ class GPTAgent:
         self.api_provider = api_provider
         self.input_callback = None
         self.conversation_history = []
+        self.phase_context = threading.local()  # phase of the running thread, as phases may run concurrently
+        self.log_lock = threading.Lock()
         provider_config = Config.MODEL_CONFIG.get(api_provider, {})
         model_config = provider_config.get(selected_model, {})
         self.max_context_length = model_config.get("content_length", 4096000)
 
-    def log_request_response(self, provider, request_data, response_data, cost, token_count, char_count):
+    def log_request_response(self, provider, request_data, response_data, cost, token_count, char_count, usage=None):
         songs_dir = os.path.join(Config.PROJECT_ROOT, 'Songs')
         if not os.path.exists(songs_dir):
             os.makedirs(songs_dir)
@@ -50,23 +52,26 @@ class GPTAgent:
 
         log_file = os.path.join(song_log_directory, 'api_requests.log')
 
-        with open(log_file, 'a') as f:
+        with self.log_lock, open(log_file, 'a') as f:
             f.write(f"Timestamp: {datetime.datetime.now()}\n")
             f.write(f"Provider: {provider}\n")
             f.write(f"Request Data: {json.dumps(request_data, indent=2)}\n")
             f.write(f"Response Data: {json.dumps(response_data, indent=2)}\n")
             f.write(f"Cost: {cost}\n")
             f.write(f"Token Count: {token_count}\n")
+            if usage is not None:
+                source = "reported" if usage["reported"] else "estimated"
+                f.write(f"Prompt Tokens: {usage['prompt_tokens']} ({source}, estimate {usage['estimated_prompt_tokens']})\n")
+                f.write(f"Completion Tokens: {usage['completion_tokens']}\n")
             f.write(f"Character Count: {char_count}\n")
             f.write("\n" + "-"*80 + "\n\n")
 
-    def count_tokens(self, content, model):
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("o200k_base")
-        tokens = encoding.encode(content)
-        return len(tokens)
+    def estimate_prompt_tokens(self, system_content, messages, model):
+        """Estimated prompt tokens of system_content plus messages, as the provider will receive them."""
+        if self.api_provider == 'anthropic':
+            return tokenAccounting.estimate_prompt(self.api_provider, model, messages, system=system_content)
+        return tokenAccounting.estimate_prompt(self.api_provider, model,
+                                               [{"role": "system", "content": system_content}] + messages)
 
     def check_token_limit(self, system_content, phase_prompt, model):
         provider_config = Config.MODEL_CONFIG.get(self.api_provider, {})
@@ -76,13 +81,7 @@ class GPTAgent:
             print(f"Model {model} not recognized for provider {self.api_provider}")
             return False
 
-        combined_content = system_content + phase_prompt
-        max_content_length = model_config.get("content_length")
-        if len(combined_content) > max_content_length:
-            print(f"Combined content length exceeds the maximum allowed length of {max_content_length} characters.")
-            return False
-
-        token_count = self.count_tokens(combined_content, model)
+        token_count = self.estimate_prompt_tokens(system_content, [{"role": "user", "content": phase_prompt}], model)
         max_tokens = model_config.get("tokens")
         if token_count <= max_tokens:
             print(f"Combined content is within the token limit for {model}. Token count: {token_count}, max is {max_tokens}")
@@ -112,6 +111,7 @@ class GPTAgent:
 
     def execute_phase(self, client, phase, song_creation_data, artist_config, phase_config):
         print("\nExecuting phase ["+phase+"]")
+        self.phase_context.phase = phase
         self.logger.info(f"Executing phase: [{phase}]")
 
         task_type = ''
@@ -185,6 +185,10 @@ class GPTAgent:
     #
     #     return response_text
 
+    def stream_label(self, provider):
+        """What a streamed response is shown with in the UI."""
+        return {"song": self.song.name, "phase": getattr(self.phase_context, "phase", None), "provider": provider, "model": self.selected_model}
+
     def handle_anthropic_request(self, client, system_content, conversation_history):
         provider_config = Config.MODEL_CONFIG.get(self.api_provider, {})
         model_config = provider_config.get(self.selected_model, {})
@@ -197,30 +201,43 @@ class GPTAgent:
             "max_tokens": max_tokens
         }
 
-        completion = client.messages.create(**request_data)
-        response_text = completion.content[0].text
+        if Config.LLM_STREAMING:
+            response_text, reported_usage = llmStream.stream_anthropic(client, self.stream_label('anthropic'),
+                                                                       **request_data)
+        else:
+            completion = client.messages.create(**request_data)
+            response_text = completion.content[0].text
+            reported_usage = getattr(completion, "usage", None)
 
         conversation_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in conversation_history])
-        token_count = self.count_tokens(system_content + conversation_str, self.selected_model)
+        usage = tokenAccounting.reconcile('anthropic', self.selected_model, conversation_history, response_text,
+                                          reported_usage, system=system_content)
         char_count = len(system_content + conversation_str)
-        cost = self.calculate_cost(token_count)
-        self.log_request_response('anthropic', request_data, completion.content[0].text, cost, token_count, char_count)
+        cost = self.calculate_cost(usage["total_tokens"])
+        self.log_request_response('anthropic', request_data, response_text, cost, usage["total_tokens"],
+                                  char_count, usage)
 
         return response_text
 
     def handle_openai_request(self, client, system_content, phase_prompt, openai_messages):
-        completion = client.chat.completions.create(
-            model=self.selected_model,
-            messages=openai_messages
-        )
-        response_text = completion.choices[0].message.content
+        if Config.LLM_STREAMING:
+            response_text, reported_usage = llmStream.stream_openai(
+                client, self.stream_label('openai'), model=self.selected_model, messages=openai_messages)
+        else:
+            completion = client.chat.completions.create(
+                model=self.selected_model,
+                messages=openai_messages
+            )
+            response_text = completion.choices[0].message.content
+            reported_usage = getattr(completion, "usage", None)
 
-        # shouldn't we pass openai_messages here?
-        token_count = self.count_tokens(system_content + phase_prompt, self.selected_model)
+        usage = tokenAccounting.reconcile('openai', self.selected_model, openai_messages, response_text,
+                                          reported_usage)
         char_count = len(system_content + phase_prompt)
-        cost = self.calculate_cost(token_count)
+        cost = self.calculate_cost(usage["total_tokens"])
 
-        self.log_request_response('openai', openai_messages, completion.choices[0].message.content, cost, token_count, char_count)
+        self.log_request_response('openai', openai_messages, response_text, cost,
+                                  usage["total_tokens"], char_count, usage)
         return response_text
 
     def handle_azure_openai_request(self, client, system_content, phase_prompt, openai_messages):
@@ -231,19 +248,28 @@ class GPTAgent:
         if not deployment_name:
             raise ValueError(f"Deployment name not configured for model {self.selected_model}")
 
-        completion = client.chat.completions.create(
-            model=self.selected_model,
-            deployment_name=deployment_name,
-            messages=openai_messages
-        )
-        response_text = completion.choices[0].message.content
+        if Config.LLM_STREAMING:
+            # Usage in streams depends on the Azure API version, without it the tokens are estimated
+            response_text, reported_usage = llmStream.stream_openai(
+                client, self.stream_label('azure'), include_usage=False,
+                model=self.selected_model, deployment_name=deployment_name, messages=openai_messages)
+        else:
+            completion = client.chat.completions.create(
+                model=self.selected_model,
+                deployment_name=deployment_name,
+                messages=openai_messages
+            )
+            response_text = completion.choices[0].message.content
+            reported_usage = getattr(completion, "usage", None)
 
         conversation_str = "\n".join([f"{msg['role']}: {msg['content']}" for msg in openai_messages])
-        token_count = self.count_tokens(system_content + conversation_str, self.selected_model)
+        usage = tokenAccounting.reconcile('azure', self.selected_model, openai_messages, response_text,
+                                          reported_usage)
         char_count = len(system_content + conversation_str)
-        cost = self.calculate_cost(token_count)
+        cost = self.calculate_cost(usage["total_tokens"])
 
-        self.log_request_response('azure', openai_messages, completion.choices[0].message.content, cost, token_count, char_count)
+        self.log_request_response('azure', openai_messages, response_text, cost,
+                                  usage["total_tokens"], char_count, usage)
         return response_text
 
     def local_discussion(self, client, phase, song_creation_data, artist_config, phase_config):
@@ -267,35 +293,49 @@ class GPTAgent:
         )
 
         project_root = Config.PROJECT_ROOT
-        # Correct the path to the FAISS index file
-        faiss_index_path = os.path.join(project_root, 'Samples', 'sample_index.faiss')
-        metadata_path = os.path.join(project_root, 'Samples', 'sample_metadata.json')
-
-        # Load the FAISS index and metadata
-        index = faiss.read_index(faiss_index_path)
-        with open(metadata_path, "r") as f:
-            metadata = json.load(f)
+        samples_dir = os.path.join(project_root, 'Samples')
 
-        # Initialize the model for generating embeddings
-        model = SentenceTransformer('all-MiniLM-L6-v2')
+        # The embedding model and the sample index are kept loaded for the whole process (see sampleRetrieval);
+        # sample metadata is read from the sample database, only for the retrieved rows
+        retriever = sampleRetrieval.get_retriever(samples_dir)
+        database = sampleDatabase.open_database(samples_dir)
 
-        # Generate an embedding for the query
         query = f"We are creating a new song with the following details: - Theme: {song_creation_data.theme}. " \
                 f"- Melody: {song_creation_data.melody}. " \
                 f"- Rhythm: {song_creation_data.rhythm}. " \
                 f"- Song Description: {song_creation_data.song_description}. " \
                 "Please suggest suitable samples with tags matching the mood, progression, and instrumentation described above."
-        query_embedding = model.encode(query)  # Generate embedding locally
-        query_embedding = np.array([query_embedding]).astype("float32")
 
-        # Search for the nearest neighbors
+        # Search for the nearest neighbors (one vector per sample, ids are rows of the database generation the
+        # index carries; an index that matches no generation gives no samples rather than the wrong ones)
         k = artist_config.get("samples_max", 5)  # Number of results to retrieve (reduced because of token limit)
         self.logger.info(f"Number of samples that will be retrieved: {k}")
-        distances, indices = index.search(query_embedding, k)
+        loaded = retriever.get_index()
+        generation = loaded.generation if loaded is not None else None
+        if loaded is not None and generation is None:
+            self.logger.info("Sample index does not match the sample metadata, please re-run the sample metadata listing")
+
+        # Keep the samples that fit the key and tempo mentioned in the concept, if any, out of a wider candidate set
+        key, bpm = sampleCompatibility.target_from_text(
+            f"{song_creation_data.melody} {song_creation_data.rhythm} {song_creation_data.song_description}")
+        compatible = None
+        if generation is not None and (key is not None or bpm is not None):
+            table = sampleCompatibility.get_table(samples_dir)
+            if table is not None and table.generation == generation:
+                compatible = set(table.compatible(key, bpm, Config.SAMPLE_BPM_TOLERANCE).tolist())
+                self.logger.info(f"Target key {key}, BPM {bpm}: {len(compatible)} compatible samples")
 
         results = []
-        for i in range(k):
-            results.append(metadata[indices[0][i]])
+        if generation is not None and database is not None:
+            candidates = retriever.search(query, k * Config.SAMPLE_COMPATIBILITY_CANDIDATES if compatible else k, loaded)
+            candidates = [i for i, _ in candidates]
+            rows = [i for i in candidates if i in compatible][:k] if compatible else []
+            if not rows:
+                rows = candidates[:k]
+            results = database.records(rows, generation=generation)
+            if results is None:
+                self.logger.info("Sample library changed during the sample retrieval, no samples are suggested")
+                results = []
 
         song_creation_data.samples = json.dumps(results, separators=(',', ':'))
 
@@ -328,16 +368,28 @@ class GPTAgent:
                 system_instructions = "\n".join(assistant["system_instruction"])
                 system_content = system_instructions
 
+        # Phases that opted in reuse the accepted response of an identical earlier request for the same song, so
+        # a retried or restarted run does not pay again; only the first attempt reads the cache, so a retry of the
+        # phase always asks the model again
+        cache = responseCache.get_cache() if responseCache.phase_uses_cache(phase_config[phase]) else None
+        cache_key = responseCache.request_key(self.song.song_id, self.api_provider, self.selected_model, system_content,
+                                              [{"role": "user", "content": phase_prompt}]) if cache else None
+        from_cache = False
+
         retry_count = 0
         max_retries = 3
         while retry_count < max_retries:
             try:
-
-                if self.api_provider == 'openai':
-                    openai_messages = [
-                        {"role": "system", "content": system_content},
-                        {"role": "user", "content": phase_prompt}
-                    ]
+                cached_text = cache.get(cache_key) if cache and retry_count == 0 else None
+                from_cache = cached_text is not None
+                openai_messages = [
+                    {"role": "system", "content": system_content},
+                    {"role": "user", "content": phase_prompt}
+                ]
+                if from_cache:
+                    self.logger.info(f"Response of phase {phase} taken from the response cache")
+                    response_text = cached_text
+                elif self.api_provider == 'openai':
                     if self.check_token_limit(system_content, phase_prompt, self.selected_model):
                         response_text = self.handle_openai_request(client, system_content, phase_prompt, openai_messages)
                 elif self.api_provider == 'azure': #Azure
@@ -345,7 +397,8 @@ class GPTAgent:
                         response_text = self.handle_azure_openai_request(client, system_content, phase_prompt, openai_messages)
                 elif self.api_provider == 'anthropic':  # Anthropic
                     if self.check_token_limit(system_content, phase_prompt, self.selected_model):
-                        response_text = self.handle_anthropic_request(client, system_content, phase_prompt)
+                        response_text = self.handle_anthropic_request(
+                            client, system_content, [{"role": "user", "content": phase_prompt}])
 
                 phase_prompt_single_line = phase_prompt.replace('\n', ' ')
                 self.logger.info(f"[Questioner]({user_role_name}):[[{phase_prompt_single_line}]]")
@@ -367,7 +420,7 @@ class GPTAgent:
                         + self.song_creation_data.sonicpi_code
                     )
                     self.stop_review_and_modify = True
-                elif 'sonicpi_code' in response_data:
+                elif 'sonicpi_code' in response_data and phaseScheduler.may_write(phase_config[phase], 'sonicpi_code'):
                     if isinstance(response_data['sonicpi_code'], list):
                         code_to_retrieve = '\n'.join(response_data['sonicpi_code'])
                     elif isinstance(response_data['sonicpi_code'], str):
@@ -383,7 +436,9 @@ class GPTAgent:
                     song_creation_data.set_parameter("sonicpi_code", fixed_code)
                     self.song.create_song_file(song_creation_data)
                 else:
-                    song_creation_data.update_parameters_from_response(response_data)
+                    # A phase only sets the parameters of its declared outcome (see phaseScheduler)
+                    song_creation_data.update_parameters_from_response(
+                        phaseScheduler.declared_response(phase_config[phase], response_data))
 
                 if phase_config[phase].get("codeValidation", False):
                     if self.validate_and_execute_code(song_creation_data, artist_config, response_text):
@@ -397,10 +452,14 @@ class GPTAgent:
                 self.logger.info(f"Failed to parse the response as JSON: {e}")
                 if self.handle_json_decode_error(response_text, song_creation_data, phase_config[phase], artist_config):
                     break
+                if from_cache:
+                    cache.discard(cache_key)
                 retry_count += 1
 
         if retry_count >= max_retries:
             self.logger.info("Maximum number of retries reached, unable to parse JSON")
+        elif cache and not from_cache and response_text:
+            cache.put(cache_key, response_text, self.api_provider, self.selected_model)
 
     def fix_sonic_pi_notes(self, code):
         if not isinstance(code, str):  # Extra safeguard
@@ -424,7 +483,7 @@ class GPTAgent:
 
     def handle_json_decode_error(self, response_text, song_creation_data, phase_config, artist_config):
         marker = '"sonicpi_code": "'
-        start = response_text.find(marker)
+        start = response_text.find(marker) if phaseScheduler.may_write(phase_config, 'sonicpi_code') else -1
         if start != -1:
             start += len(marker)
             end = response_text.find('"', start)
@@ -449,12 +508,7 @@ class GPTAgent:
         with open(os.path.join(project_root, 'AgentConfig', self.agentType, 'ArtistConfig.json')) as file:
             artist_config = json.load(file)
 
-        if self.api_provider == 'openai':
-            client = OpenAI(api_key=self.get_api_key())
-        elif self.api_provider =='azure':
-            client = AzureOpenAI(api_key=self.get_api_key(), azure_endpoint=Config.get_azure_endpoint(), api_version=Config.get_azure_api_version())
-        else:
-            client = Anthropic(api_key=self.get_api_key())
+        client = llmClients.get_client(self.api_provider, self.get_api_key())
 
         song_description = f"I want to compose a brand new song. I like the "+genre+" genre. If I would describe the song, I would say: "+additional_information
 
@@ -463,30 +517,42 @@ class GPTAgent:
 
         self.logger.info(f"Parameter used [DURATION]:[{duration}], [GENRE]:[{genre}], [DESCRIPTION]:[{additional_information}]")
 
-        # Iterate over phases
-        for phase_info in compose_chain_config["chain"]:
-            phase = phase_info["phase"]
-
-            if phase_info["phaseType"] == "ComposedPhase":
-                # Iterating through cycles
-                for cycle_num in range(phase_info["cycleNum"]):
+        # Phases run as soon as the phases they depend on (see phaseScheduler) are done, up to PHASE_WORKERS
+        # at a time; with 1 worker they run one by one in chain order
+        chain = compose_chain_config["chain"]
+        dependencies = phaseScheduler.build_dependencies(chain, phase_config)
+        self.logger.info(f"Phase dependencies: {phaseScheduler.describe(chain, dependencies)}")
+        phaseScheduler.run_steps(
+            chain, dependencies,
+            lambda phase_info: self.execute_chain_step(client, phase_info, artist_config, phase_config),
+            Config.PHASE_WORKERS)
+
+        if Config.LLM_CACHE:
+            self.logger.info(f"Response cache: {responseCache.get_cache().stats()}")
+
+    def execute_chain_step(self, client, phase_info, artist_config, phase_config):
+        phase = phase_info["phase"]
+
+        if phase_info["phaseType"] == "ComposedPhase":
+            # Iterating through cycles
+            for cycle_num in range(phase_info["cycleNum"]):
+                if self.stop_review_and_modify:
+                    break
+                self.logger.info(f"Executing cycle {cycle_num + 1} of {phase_info['cycleNum']} for ComposedPhase: {phase}; Boolean stop_review_and_modify " + str(self.stop_review_and_modify) )
+                for sub_phase_info in phase_info["Composition"]:
+                    sub_phase = sub_phase_info["phase"]
                     if self.stop_review_and_modify:
+                        self.logger.info("Skip " + sub_phase)
                         break
-                    self.logger.info(f"Executing cycle {cycle_num + 1} of {phase_info['cycleNum']} for ComposedPhase: {phase}; Boolean stop_review_and_modify " + str(self.stop_review_and_modify) )
-                    for sub_phase_info in phase_info["Composition"]:
-                        sub_phase = sub_phase_info["phase"]
-                        if self.stop_review_and_modify:
-                            self.logger.info("Skip " + sub_phase)
-                            break
-                        else:
-                            # self.logger.info("Starting subphase " + sub_phase)
-                            self.execute_phase(client, sub_phase, self.song_creation_data, artist_config, phase_config)
-            else:
-                self.execute_phase(client, phase, self.song_creation_data, artist_config, phase_config)
+                    else:
+                        # self.logger.info("Starting subphase " + sub_phase)
+                        self.execute_phase(client, sub_phase, self.song_creation_data, artist_config, phase_config)
+        else:
+            self.execute_phase(client, phase, self.song_creation_data, artist_config, phase_config)
 
     def generate_and_download_image(self, prompt, filename, songdir, phase_config, phase):
         if self.api_provider == 'openai':
-            client = OpenAI(api_key=self.get_api_key())
+            client = llmClients.get_client('openai', self.get_api_key())
         else:
             # Anthropic doesn't have an image generation API, so we'll need to use an alternative
             self.logger.info("Image generation not supported with Anthropic API.")
@@ -506,8 +572,7 @@ class GPTAgent:
 
         if songdir == "":
             songdir = os.path.join(Config.PROJECT_ROOT, 'Songs', filename)
-        if not os.path.exists(songdir):
-            os.makedirs(songdir)
+        os.makedirs(songdir, exist_ok=True)  # the song file step may be creating it at the same time
 
         assistant_role_name = phase_config[phase]["assistant_role_name"]
         user_role_name = phase_config[phase]["user_role_name"]
@@ -515,7 +580,7 @@ class GPTAgent:
         self.logger.info(f"[Assistant]({assistant_role_name}):[[Cover image generated {image_url} .]]")
 
         # Download the image
-        image_response = requests.get(image_url)
+        image_response = llmClients.download_session().get(image_url, timeout=Config.LLM_READ_TIMEOUT_SECONDS)
         if image_response.status_code == 200:
             # Detect image type
             image_type = imghdr.what(None, h=image_response.content)
@@ -565,6 +630,7 @@ class GPTAgent:
         return re.sub(pattern, repl, sonic_pi_code)
 
     def handle_chat_input(self, sonic_pi_code, user_comment):
+        self.phase_context.phase = "Chat"
         current_dir = os.path.dirname(os.path.abspath(__file__))
         root_dir = os.path.abspath(os.path.join(current_dir, '..', '..'))
         song_log_directory = os.path.join(root_dir, 'songs', self.song.name)
@@ -619,8 +685,9 @@ class GPTAgent:
 
         prompt = system_content + "\n\n" + conversation_history_str + "\n\n" + user_message["content"]
 
+        client = llmClients.get_client(self.api_provider, self.get_api_key())
+
         if self.api_provider == 'openai':
-            client = OpenAI(api_key=self.get_api_key())
             messages = [
                 {"role": "system", "content": system_content + "\n\n" + conversation_history_str},
                 user_message
@@ -629,18 +696,12 @@ class GPTAgent:
             response_text = self.handle_openai_request(client, system_content, prompt,messages)
 
         elif self.api_provider == 'azure':
-            client = AzureOpenAI(
-                api_key=self.get_api_key(),
-                azure_endpoint=Config.get_azure_endpoint()
-                # api_version=Config.get_azure_api_version()
-            )
             messages = [
                 {"role": "system", "content": system_content + "\n\n" + conversation_history_str},
                 user_message
             ]
             response_text = self.handle_azure_openai_request(client, system_content, prompt,messages)
         elif self.api_provider == 'anthropic':
-            client = Anthropic(api_key=self.get_api_key())
             self.logger.info(f"Sending request to Anthropic: {prompt}")
             response_text = self.handle_anthropic_request(client, system_content, conversation_history)
         else:
@@ -0,0 +1,207 @@
+'''
+This file contains the audio descriptors used by the sample metadata listing: tempo, spectral centroid,
+RMS energy, peak amplitude and musical key.
+
+All spectral descriptors are derived from a single magnitude STFT per buffer (frame_features): the onset
+envelope used for the tempo comes from its mel projection, the centroid from the spectrogram itself and the
+chroma used for the key from its interpolated spectral peaks.
+
+Short samples are measured on a fully decoded buffer (measure_audio). Long files are read in fixed-size
+blocks (stream_measure) and the descriptors are accumulated block by block, so the memory used does not
+grow with the length of the file.
+'''
+import math
+import logging
+import numpy as np
+import librosa
+from App.services.yamnetWorker import YAMNET_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+KEY_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+MAJOR_TEMPLATE = np.array([1, 0, 1, 0, 1, 1, 0, 1, 0, 1, 0, 1])
+MINOR_TEMPLATE = np.array([1, 0, 1, 1, 0, 1, 0, 1, 1, 0, 1, 0])
+# Row i < 12 is the minor key on KEY_NAMES[i], row 12 + i the major one. Minor rows come first so that
+# argmax settles a tie between the best major and best minor key in favour of the minor key.
+KEY_TEMPLATES = np.stack([np.roll(MINOR_TEMPLATE, i) for i in range(12)] +
+                         [np.roll(MAJOR_TEMPLATE, i) for i in range(12)]).astype(float)
+
+N_FFT = 2048
+HOP_LENGTH = 512
+RMS_FRAME_LENGTH = 1024
+CHROMA_FMIN = 100  # range of the spectral peaks that vote for a pitch class
+CHROMA_FMAX = 5000
+CHROMA_PEAK_THRESHOLD = 0.05  # peaks quieter than this fraction of the loudest bin of their frame are ignored
+STREAM_FRAME_LENGTH = N_FFT
+STREAM_BLOCK_SECONDS = 30
+STREAM_YAMNET_SECONDS = 60  # 16kHz audio kept per streamed file for YAMNet, spread over the whole file
+TEMPO_AC_SECONDS = 8.0  # autocorrelation window used by librosa's tempo estimation
+
+
+def key_from_chroma(chroma_mean):
+    """Musical key (e.g., C major, A minor) best matching a mean chroma vector."""
+    # Skip if chroma_mean has all zeros
+    if np.max(chroma_mean) == 0:
+        return "Unknown"
+
+    # Normalize chroma features
+    chroma_mean = chroma_mean / np.max(chroma_mean)
+
+    # One correlation per key: 12 minor and 12 major templates at once
+    scores = KEY_TEMPLATES @ chroma_mean
+    best = int(np.argmax(scores))
+    mode = "minor" if best < 12 else "major"
+    key_index = best % 12
+
+    return f"{KEY_NAMES[key_index]} {mode}"
+
+
+def detect_key(y, sr):
+    """Detect the musical key (e.g., C major, A minor) of the audio."""
+    try:
+        return key_from_chroma(frame_features(y, sr)["chroma"].mean(axis=1))
+    except Exception as e:
+        logger.warning(f"Error detecting key: {e}")
+        return "Unknown"
+
+
+def peak_chroma(spectrogram, sr):
+    """Chroma (12 x frames) from the spectral peaks of a magnitude STFT.
+
+    Peak frequencies are refined by parabolic interpolation, which resolves pitch classes well below the
+    bin spacing of the STFT, and corrected for the tuning of the peaks; each peak adds its power to its
+    pitch class.
+    """
+    pitches, magnitudes = librosa.piptrack(S=spectrogram, sr=sr, n_fft=N_FFT, fmin=CHROMA_FMIN, fmax=CHROMA_FMAX,
+                                           threshold=CHROMA_PEAK_THRESHOLD)
+    bins, frames = np.nonzero(pitches)
+    frame_count = spectrogram.shape[1]
+    if len(bins) == 0:
+        return np.zeros((12, frame_count))
+
+    frequencies = pitches[bins, frames]
+    tuning = librosa.pitch_tuning(frequencies)
+    pitch_classes = np.round(12 * np.log2(frequencies / 440.0) + 9 - tuning).astype(int) % 12  # A is class 9
+    chroma = np.bincount(pitch_classes * frame_count + frames, weights=magnitudes[bins, frames] ** 2,
+                         minlength=12 * frame_count)
+    return chroma.reshape(12, frame_count)
+
+
+def frame_features(y, sr, center=True):
+    """Frame-level onset strength, spectral centroid, RMS and chroma of y, from one STFT.
+
+    With center=False, frame t covers y[t * HOP_LENGTH:t * HOP_LENGTH + N_FFT], which is what block-wise
+    accumulation needs; every array then has one column per such frame.
+    """
+    if len(y) < N_FFT:
+        y = np.pad(y, (0, N_FFT - len(y)))
+    spectrogram = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH, center=center))
+
+    mel = librosa.feature.melspectrogram(S=spectrogram ** 2, sr=sr)
+    onset = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr, hop_length=HOP_LENGTH, center=center)
+    frames = spectrogram.shape[1]
+
+    return {
+        "onset": onset[:frames],
+        "centroid": librosa.feature.spectral_centroid(S=spectrogram, sr=sr, n_fft=N_FFT)[0],
+        # RMS is taken on the samples: it is a single cheap pass and is not biased by the STFT window
+        "rms": librosa.feature.rms(y=y, frame_length=RMS_FRAME_LENGTH, hop_length=HOP_LENGTH, center=center)[0, :frames],
+        "chroma": peak_chroma(spectrogram, sr),
+    }
+
+
+def scalar_tempo(tempo):
+    if isinstance(tempo, np.ndarray):  # Check if tempo is an array
+        tempo = tempo[0] if tempo.size > 0 else 0
+    return float(tempo)
+
+
+def onset_tempo(onset, sr):
+    """Tempo in BPM of an onset envelope, estimated as librosa's beat tracker does (0 without onsets)."""
+    if not onset.any():
+        return 0.0
+    return scalar_tempo(librosa.feature.tempo(onset_envelope=onset, sr=sr, hop_length=HOP_LENGTH))
+
+
+def measure_audio(y, sr):
+    """Tempo, spectral centroid, RMS energy, peak amplitude and key of a decoded mono buffer."""
+    frames = frame_features(y, sr)
+
+    return {
+        "tempo": onset_tempo(frames["onset"], sr),
+        "centroid": float(frames["centroid"].mean()),
+        "rms": float(frames["rms"].mean()),
+        "max_amplitude": float(np.max(np.abs(y))),
+        "key": key_from_chroma(frames["chroma"].mean(axis=1)),
+    }
+
+
+def stream_measure(file_path, block_seconds=STREAM_BLOCK_SECONDS, yamnet_seconds=STREAM_YAMNET_SECONDS, peaks=None,
+                   fingerprint=None):
+    """Measure a long file block by block, like measure_audio, with constant memory.
+
+    Frame-level descriptors (centroid, RMS, chroma and the tempogram of the onset strength) are summed
+    per block and averaged at the end; the tempo is estimated from the mean tempogram, as librosa's
+    beat tracker does for a whole buffer. YAMNet gets evenly spaced excerpts totalling at most
+    yamnet_seconds of 16kHz audio. Every sample of the file is also fed to `peaks` (a samplePeaks.PeakBuilder)
+    and `fingerprint` (a sampleFingerprint.FingerprintBuilder) when they are given.
+
+    Returns (measured, duration, waveform).
+    """
+    sr = librosa.get_samplerate(file_path)
+    duration = librosa.get_duration(path=file_path)
+    block_length = max(1, int(block_seconds * sr / HOP_LENGTH))  # in frames
+    block_count = max(1, math.ceil(duration / block_seconds))
+    excerpt_seconds = max(1.0, min(block_seconds, yamnet_seconds / block_count))
+    excerpt_stride = max(1, math.ceil(block_count * excerpt_seconds / yamnet_seconds))
+
+    tempogram_window = int(librosa.time_to_frames(TEMPO_AC_SECONDS, sr=sr, hop_length=HOP_LENGTH))
+    tempogram_sum = np.zeros(tempogram_window)
+    tempogram_count = 0
+    centroid_sum = rms_sum = 0.0
+    frame_count = 0
+    chroma_sum = np.zeros(12)
+    max_amplitude = 0.0
+    excerpts = []
+
+    blocks = librosa.stream(file_path, block_length=block_length, frame_length=STREAM_FRAME_LENGTH,
+                            hop_length=HOP_LENGTH, mono=True, dtype=np.float32)
+    for block_index, y in enumerate(blocks):
+        if peaks is not None:
+            peaks.add(y[:block_length * HOP_LENGTH])  # the part that does not overlap the next block
+        if fingerprint is not None:
+            fingerprint.add(y[:block_length * HOP_LENGTH])
+        if len(y) < STREAM_FRAME_LENGTH:
+            y = np.pad(y, (0, STREAM_FRAME_LENGTH - len(y)))
+        max_amplitude = max(max_amplitude, float(np.max(np.abs(y))))
+
+        # Consecutive blocks overlap by STREAM_FRAME_LENGTH - HOP_LENGTH samples, so with center=False
+        # every frame of the file is computed exactly once
+        frames = frame_features(y, sr, center=False)
+        tempogram = librosa.feature.tempogram(onset_envelope=frames["onset"], sr=sr, hop_length=HOP_LENGTH,
+                                              win_length=tempogram_window)
+        tempogram_sum += tempogram.sum(axis=1)
+        tempogram_count += tempogram.shape[1]
+
+        centroid_sum += float(frames["centroid"].sum())
+        rms_sum += float(frames["rms"].sum())
+        chroma_sum += frames["chroma"].sum(axis=1)
+        frame_count += len(frames["rms"])
+
+        if block_index % excerpt_stride == 0:
+            excerpt = y[:int(excerpt_seconds * sr)]
+            if sr != YAMNET_SAMPLE_RATE:
+                excerpt = librosa.resample(excerpt, orig_sr=sr, target_sr=YAMNET_SAMPLE_RATE)
+            excerpts.append(np.asarray(excerpt, dtype=np.float32))
+
+    mean_tempogram = (tempogram_sum / max(tempogram_count, 1))[:, np.newaxis]
+    tempo = librosa.feature.tempo(tg=mean_tempogram, sr=sr, hop_length=HOP_LENGTH)
+    measured = {
+        "tempo": scalar_tempo(tempo),
+        "centroid": centroid_sum / max(frame_count, 1),
+        "rms": rms_sum / max(frame_count, 1),
+        "max_amplitude": max_amplitude,
+        "key": key_from_chroma(chroma_sum / max(frame_count, 1)),
+    }
+    return measured, duration, np.concatenate(excerpts)
@@ -0,0 +1,96 @@
+'''
+This file contains the registry of LLM provider clients shared by the whole process.
+
+Building an OpenAI, AzureOpenAI or Anthropic client per call opens a new connection pool every time, so every
+request pays for new TCP and TLS handshakes. get_client returns one client per provider and credentials
+instead, built on an httpx client whose connections are kept alive between requests, songs and chat messages.
+The clients are thread-safe and shared by every GPTAgent. Pool size and timeouts come from the LLM_POOL_* and
+LLM_*_TIMEOUT_SECONDS settings.
+'''
+import atexit
+import hashlib
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI, AzureOpenAI
+from anthropic import Anthropic
+from App.config import Config
+
+_clients = {}
+_clients_lock = threading.Lock()
+_download_session = None
+
+
+def http_client():
+    """A new httpx client with the configured connection pool and timeouts, for one provider client."""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=Config.LLM_POOL_CONNECTIONS,
+                            max_keepalive_connections=Config.LLM_POOL_CONNECTIONS,
+                            keepalive_expiry=Config.LLM_POOL_KEEPALIVE_SECONDS),
+        timeout=httpx.Timeout(Config.LLM_READ_TIMEOUT_SECONDS, connect=Config.LLM_CONNECT_TIMEOUT_SECONDS),
+    )
+
+
+def client_key(provider, api_key, endpoint=None, api_version=None):
+    """Registry key of a client; the API key is only kept as a hash."""
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    return provider, key_hash, endpoint, api_version
+
+
+def create_client(provider, api_key, endpoint=None, api_version=None):
+    if provider == 'openai':
+        return OpenAI(api_key=api_key, http_client=http_client(), max_retries=Config.LLM_MAX_RETRIES)
+    if provider == 'azure':
+        return AzureOpenAI(api_key=api_key, azure_endpoint=endpoint, api_version=api_version,
+                           http_client=http_client(), max_retries=Config.LLM_MAX_RETRIES)
+    if provider == 'anthropic':
+        return Anthropic(api_key=api_key, http_client=http_client(), max_retries=Config.LLM_MAX_RETRIES)
+    raise ValueError(f"Unsupported provider: {provider}")
+
+
+def get_client(provider, api_key=None):
+    """The shared client of provider, for api_key (the configured key by default)."""
+    api_key = api_key or Config.get_api_key(provider)
+    endpoint = api_version = None
+    if provider == 'azure':
+        endpoint, api_version = Config.get_azure_endpoint(), Config.get_azure_api_version()
+    key = client_key(provider, api_key, endpoint, api_version)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = create_client(provider, api_key, endpoint, api_version)
+            _clients[key] = client
+        return client
+
+
+def download_session():
+    """Shared requests session for downloads (e.g. generated cover art), with the same pool size."""
+    global _download_session
+    with _clients_lock:
+        if _download_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=Config.LLM_POOL_CONNECTIONS,
+                                  pool_maxsize=Config.LLM_POOL_CONNECTIONS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _download_session = session
+        return _download_session
+
+
+def close_all():
+    """Close every shared client and its connections; the next get_client builds new ones."""
+    global _download_session
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        if _download_session is not None:
+            _download_session.close()
+            _download_session = None
+
+
+atexit.register(close_all)
@@ -0,0 +1,137 @@
+'''
+This file contains the in-process channel of the LLM responses being generated.
+
+With streaming enabled (LLM_STREAMING) the provider requests are made as streams: the text is forwarded to the
+subscribers (the Socket.IO connection, server-sent event streams) as it arrives, and assembled into the same
+final text the phases parse. The UI then shows a response from its first token instead of its last.
+
+Every response is published as a "start" event, "delta" events with the new text (small deltas are coalesced
+to at most one event every `min_interval` seconds) and an "end" event with the time to the first token.
+'''
+import time
+import logging
+import itertools
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseStream:
+    """Publishes the text of the LLM responses in progress to its subscribers."""
+
+    def __init__(self, min_interval=0.05):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.ids = itertools.count(1)
+        self.active = {}
+
+    def subscribe(self, callback):
+        """Call callback(event) on every published event; returns callback for unsubscribe."""
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def start(self, song=None, phase=None, provider=None, model=None):
+        """Announce a new response; returns its stream id."""
+        stream_id = next(self.ids)
+        now = time.time()
+        with self.lock:
+            self.active[stream_id] = {"started": now, "first_token": None, "pending": [], "chars": 0,
+                                      "last_published": 0.0}
+        self.publish({"id": stream_id, "event": "start", "song": song, "phase": phase, "provider": provider,
+                      "model": model})
+        return stream_id
+
+    def delta(self, stream_id, text):
+        now = time.time()
+        with self.lock:
+            state = self.active.get(stream_id)
+            if state is None or not text:
+                return
+            if state["first_token"] is None:
+                state["first_token"] = now
+            state["pending"].append(text)
+            state["chars"] += len(text)
+            if now - state["last_published"] < self.min_interval:
+                return
+            event = self.take_pending(stream_id, state, now)
+        self.publish(event)
+
+    def take_pending(self, stream_id, state, now):
+        text = "".join(state["pending"])
+        state["pending"] = []
+        state["last_published"] = now
+        return {"id": stream_id, "event": "delta", "delta": text, "chars": state["chars"]}
+
+    def finish(self, stream_id, error=None):
+        now = time.time()
+        with self.lock:
+            state = self.active.pop(stream_id, None)
+            if state is None:
+                return
+            pending = self.take_pending(stream_id, state, now) if state["pending"] else None
+        if pending is not None:
+            self.publish(pending)
+        first_token = state["first_token"]
+        self.publish({"id": stream_id, "event": "end", "chars": state["chars"], "error": error,
+                      "first_token_seconds": round(first_token - state["started"], 3) if first_token else None,
+                      "elapsed_seconds": round(now - state["started"], 3)})
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning(f"Response stream subscriber failed: {e}")
+
+
+responses = ResponseStream()
+
+
+def stream_openai(client, label, include_usage=True, **request):
+    """Stream a chat completion of an OpenAI (or Azure OpenAI) client; returns (text, reported usage or None).
+
+    label: song, phase, provider and model shown with the response.
+    """
+    stream_id = responses.start(**label)
+    parts, usage = [], None
+    if include_usage:
+        request["stream_options"] = {"include_usage": True}
+    try:
+        for chunk in client.chat.completions.create(stream=True, **request):
+            if getattr(chunk, "usage", None) is not None:
+                usage = chunk.usage
+            if chunk.choices:
+                text = chunk.choices[0].delta.content
+                if text:
+                    parts.append(text)
+                    responses.delta(stream_id, text)
+    except Exception as e:
+        responses.finish(stream_id, error=str(e))
+        raise
+    responses.finish(stream_id)
+    return "".join(parts), usage
+
+
+def stream_anthropic(client, label, **request):
+    """Stream a message of an Anthropic client; returns (text, reported usage)."""
+    stream_id = responses.start(**label)
+    try:
+        with client.messages.stream(**request) as stream:
+            for text in stream.text_stream:
+                responses.delta(stream_id, text)
+            message = stream.get_final_message()
+    except Exception as e:
+        responses.finish(stream_id, error=str(e))
+        raise
+    responses.finish(stream_id)
+    text = "".join(block.text for block in message.content if getattr(block, "type", None) == "text")
+    return text, message.usage
@@ -0,0 +1,153 @@
+'''
+This file contains the scheduler of the composition chain (MusicCreationChainConfig.json).
+
+Every step of the chain (a phase, or a ComposedPhase with its cycles) reads and writes song parameters: chat
+phases declare them as their "input" and "outcome" in MusicCreationPhaseConfig.json, the other phase types
+access the fixed parameters and resources listed in TYPE_ACCESS. A phase that declares an outcome only writes
+those parameters, whatever else its response contains (see declared_response); one that declares none may write
+any parameter and runs alone. Any chat phase may also set the stop_review_and_modify flag.
+
+A step depends on every earlier step of the chain it conflicts with: one writes what the other reads or writes.
+With PHASE_WORKERS above 1, steps whose dependencies are done run concurrently on a bounded pool of threads;
+e.g. Cover Art only needs the song description and overlaps with the whole design and coding of the song. Since
+conflicting steps keep their chain order, every step sees the same parameters as when the chain runs one step
+at a time, and the song is the same; only the log lines of concurrent phases interleave.
+
+The song directory (Songs/<song name>) is created by whichever of the file and art steps runs first; both
+create it if it does not exist yet, so they share it without waiting for each other.
+
+A ComposedPhase runs as one step, cycles and stop_review_and_modify flag included; it also reads and writes
+the flag, so composed phases keep their order between them and with the chat phases around them.
+'''
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+ANYTHING = "*"  # reads or writes every parameter: the step runs alone, in chain order
+SONG_FILE = "song file"  # the Ruby song file and the song directory it sets
+SONIC_PI = "sonic pi"  # the Sonic Pi instance code is run on
+SONG_DIRECTORY = "song directory"  # Songs/<song name>, created by the first step that writes into it
+STOP_FLAG = "stop_review_and_modify"
+# Only ever set or created, the same way by every step, so two steps writing them do not conflict with each other
+MONOTONIC = {STOP_FLAG, SONG_DIRECTORY}
+
+# Parameters and resources accessed by the phase types that declare no input and outcome: (reads, writes)
+TYPE_ACCESS = {
+    "file": ({"sonicpi_code"}, {"sonicpi_code", SONG_FILE, SONG_DIRECTORY}),
+    "readme": ({"song_description", "theme", "melody", "rhythm", "lyrics", "structure", "segments",
+                "total_duration", "arrangements", SONG_FILE}, {"booklet"}),
+    "art": ({"song_description"}, {"cover art", SONG_DIRECTORY}),
+    "recording": ({SONG_FILE, "total_duration"}, {SONIC_PI, "recording"}),
+    "human_chat": ({"sonicpi_code", SONG_FILE}, {"sonicpi_code", SONG_FILE, SONIC_PI, "review"}),
+}
+
+
+def declared_outcome(settings):
+    """Parameters a phase may write, or None when it declares no outcome (it may write any)."""
+    outcome = settings.get("outcome") if isinstance(settings, dict) else None
+    return set(outcome.values()) if isinstance(outcome, dict) else None
+
+
+def declared_response(settings, response_data):
+    """The fields of a phase response the phase may write: those of its declared outcome."""
+    outcome = declared_outcome(settings)
+    if outcome is None:
+        return response_data
+    return {key: value for key, value in response_data.items() if key in outcome}
+
+
+def may_write(settings, parameter):
+    outcome = declared_outcome(settings)
+    return outcome is None or parameter in outcome
+
+
+def phase_access(phase, phase_config):
+    """(reads, writes) of one phase."""
+    settings = phase_config.get(phase)
+    if settings is None:
+        return {ANYTHING}, {ANYTHING}
+    task_type = settings.get("type")
+    if task_type in ("chat", "local_chat"):
+        reads = set(settings.get("input", {}).values())
+        writes = declared_outcome(settings)
+        writes = {ANYTHING} if writes is None else writes
+        if task_type == "chat":
+            writes.add(STOP_FLAG)
+        if "sonicpi_code" in writes:
+            writes.add(SONG_FILE)  # the song file is rewritten with the new code
+        if settings.get("codeValidation", False):
+            reads.add(SONG_FILE)
+            writes.update({SONG_FILE, SONIC_PI})
+        return reads, writes
+    if task_type in TYPE_ACCESS:
+        reads, writes = TYPE_ACCESS[task_type]
+        return set(reads), set(writes)
+    return {ANYTHING}, {ANYTHING}
+
+
+def step_access(step, phase_config):
+    """(reads, writes) of a chain step; a ComposedPhase accesses what all its phases do, and the stop flag."""
+    if step["phaseType"] != "ComposedPhase":
+        return phase_access(step["phase"], phase_config)
+    reads, writes = {STOP_FLAG}, {STOP_FLAG}
+    for sub_step in step["Composition"]:
+        sub_reads, sub_writes = phase_access(sub_step["phase"], phase_config)
+        reads |= sub_reads
+        writes |= sub_writes
+    return reads, writes
+
+
+def overlap(a, b):
+    return bool(a) and bool(b) and (ANYTHING in a or ANYTHING in b or not a.isdisjoint(b))
+
+
+def conflict(earlier, later):
+    """Whether a step has to wait for an earlier one, given the (reads, writes) of both."""
+    (earlier_reads, earlier_writes), (reads, writes) = earlier, later
+    return (overlap(earlier_writes, reads) or overlap(earlier_reads, writes)
+            or overlap(earlier_writes - MONOTONIC, writes - MONOTONIC))
+
+
+def build_dependencies(steps, phase_config):
+    """For every step, the indices of the earlier steps it has to wait for."""
+    access = [step_access(step, phase_config) for step in steps]
+    dependencies = []
+    for later in range(len(steps)):
+        dependencies.append({earlier for earlier in range(later) if conflict(access[earlier], access[later])})
+    return dependencies
+
+
+def describe(steps, dependencies):
+    return "; ".join(f"{step['phase']} after {', '.join(steps[i]['phase'] for i in sorted(deps)) or 'nothing'}"
+                     for step, deps in zip(steps, dependencies))
+
+
+def run_steps(steps, dependencies, run_step, workers):
+    """Run run_step(step) for every step once its dependencies are done, up to workers at a time.
+
+    With one worker the steps run one by one in chain order. When a step fails no further steps are started;
+    the running ones finish and the error is raised.
+    """
+    if workers <= 1:
+        for step in steps:
+            run_step(step)
+        return
+
+    waiting = {index: set(deps) for index, deps in enumerate(dependencies)}
+    running = {}
+    error = None
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phase") as pool:
+        while waiting or running:
+            if error is None:
+                for index in sorted(index for index, deps in waiting.items() if not deps):
+                    del waiting[index]
+                    running[pool.submit(run_step, steps[index])] = index
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                if future.exception() is not None and error is None:
+                    error = future.exception()
+                for deps in waiting.values():
+                    deps.discard(index)
+    if error is not None:
+        raise error
@@ -0,0 +1,176 @@
+'''
+This file contains the on-disk cache of LLM responses used by the composition chain.
+
+A response is stored under the hash of its request: provider, model, system content and messages, and the run
+it belongs to (the id of the song, see Song.song_id, not its name, which two songs may share). Retrying or
+restarting the chain of a song with the same artist config, phase prompts and inputs then finds the responses
+of the phases that opted in (`"cache": true` in MusicCreationPhaseConfig.json) instead of paying for them
+again; a new song always gets new responses.
+
+Every entry is a small JSON file, named after its key and written atomically, so a crashed run never leaves a
+half-written entry behind. Entries expire LLM_CACHE_TTL_HOURS after they were stored; the modification time of
+a file is when it was stored. When the cache grows beyond its size bound the least recently used entries go
+first (use is tracked in memory; entries loaded from disk count as last used when they were stored).
+'''
+import os
+import json
+import time
+import hashlib
+import threading
+from App.config import Config
+
+KEY_VERSION = 2
+
+
+def request_key(run, provider, model, system_content, messages):
+    """Content address of a request of a run: the same run, provider, model, system content and messages give
+    the same key."""
+    request = {"version": KEY_VERSION, "run": run, "provider": provider, "model": model,
+               "system": system_content or "", "messages": messages}
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of response texts on disk, with a time to live."""
+
+    def __init__(self, directory, max_bytes, ttl_seconds):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = None  # key -> (last use, size), read from the directory on first use
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "stores": 0, "expired": 0, "evictions": 0}
+
+    def entry_file(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load_entries(self):
+        """Index the entries on disk by the time they were stored and size, dropping those that expired."""
+        self.entries = {}
+        self.total_bytes = 0
+        expired_before = time.time() - self.ttl_seconds
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime < expired_before:
+                    self.remove_file(path)
+                    continue
+                self.entries[name[:-5]] = (stat.st_mtime, stat.st_size)
+                self.total_bytes += stat.st_size
+
+    def ensure_loaded(self):
+        if self.entries is None:
+            self.load_entries()
+
+    @staticmethod
+    def remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def forget(self, key):
+        _, size = self.entries.pop(key, (0, 0))
+        self.total_bytes -= size
+        self.remove_file(self.entry_file(key))
+
+    def get(self, key):
+        """The cached response text of key, or None when it is missing or expired."""
+        with self.lock:
+            self.ensure_loaded()
+            path = self.entry_file(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                if key in self.entries:
+                    self.forget(key)
+                self.counts["misses"] += 1
+                return None
+            now = time.time()
+            if now - entry.get("created", 0) > self.ttl_seconds:
+                self.forget(key)
+                self.counts["expired"] += 1
+                self.counts["misses"] += 1
+                return None
+            self.entries[key] = (now, self.entries.get(key, (now, os.path.getsize(path)))[1])
+            self.counts["hits"] += 1
+            return entry["response"]
+
+    def put(self, key, response_text, provider=None, model=None):
+        with self.lock:
+            self.ensure_loaded()
+            path = self.entry_file(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_file = f"{path}.{threading.get_ident()}.tmp"
+            created = time.time()
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "provider": provider, "model": model,
+                           "response": response_text}, f, ensure_ascii=False)
+            os.utime(tmp_file, (created, created))
+            os.replace(tmp_file, path)
+            if key in self.entries:
+                self.total_bytes -= self.entries[key][1]
+            size = os.path.getsize(path)
+            self.entries[key] = (created, size)
+            self.total_bytes += size
+            self.counts["stores"] += 1
+            self.evict()
+
+    def discard(self, key):
+        """Remove an entry, e.g. a cached response the phase could not use."""
+        with self.lock:
+            self.ensure_loaded()
+            self.forget(key)
+
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key, _ in sorted(self.entries.items(), key=lambda item: item[1][0]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.forget(key)
+            self.counts["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.ensure_loaded()
+            for key in list(self.entries):
+                self.forget(key)
+
+    def stats(self):
+        with self.lock:
+            self.ensure_loaded()
+            lookups = self.counts["hits"] + self.counts["misses"]
+            return dict(self.counts,
+                        hit_rate=round(self.counts["hits"] / lookups, 4) if lookups else None,
+                        entries=len(self.entries),
+                        bytes=self.total_bytes,
+                        max_bytes=self.max_bytes,
+                        ttl_seconds=self.ttl_seconds)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The response cache of the process, configured by the LLM_CACHE_* settings."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(Config.LLM_CACHE_DIR, int(Config.LLM_CACHE_MAX_MB * 1024 * 1024),
+                                   Config.LLM_CACHE_TTL_HOURS * 3600)
+        return _cache
+
+
+def phase_uses_cache(phase_settings):
+    """Whether a phase opted in to the response cache, and the cache is enabled."""
+    return Config.LLM_CACHE and phase_settings.get("cache", False)
@@ -0,0 +1,173 @@
+'''
+This file contains the harmonic and tempo compatibility tables of the sample library.
+
+A sample fits a song when its key is a neighbour of the song's key on the Camelot wheel (the same key, the
+relative major or minor, or a fifth up or down) and its tempo matches the song's, directly or at half or
+double time, within SAMPLE_BPM_TOLERANCE. The samples are grouped into cells by Camelot code and by tempo
+bucket (the BPM folded into one octave, FOLD_LOW to 2 * FOLD_LOW, in whole BPM), from the BPM and key columns
+of the feature store, once per generation of the store (see sampleFeatureStore). The samples that fit a
+target key and BPM are read from the few neighbouring cells, so a lookup does not depend on the size of the
+library.
+'''
+import re
+import logging
+import threading
+import numpy as np
+from App.config import Config
+from App.services import sampleFeatureStore
+from App.services.audioFeatures import KEY_NAMES
+from App.services.sampleFeatureStore import KEY_LABELS, UNKNOWN
+
+logger = logging.getLogger(__name__)
+
+FOLD_LOW = 60
+TEMPO_RATIOS = (0.5, 1.0, 2.0)
+
+KEY_NOTE = r"([A-G])(#|b|♯|♭| sharp| flat)?"
+KEY_MODE = r"[ -]?((?i:major|minor))"
+# A key is only read where the text names one ("in A minor", "in the key of Bb", "key: F# major", "E minor key"),
+# so prose such as "A major influence" is not taken for a key; a key without a mode is major
+KEY_PATTERNS = [
+    re.compile(rf"\b(?i:in(?:\s+the\s+key\s+of)?)\s+{KEY_NOTE}{KEY_MODE}\b"),
+    re.compile(rf"\b(?i:key)(?:\s+(?i:of)\s+|\s*[:=]\s*|\s+){KEY_NOTE}(?:{KEY_MODE})?\b"),
+    re.compile(rf"\b{KEY_NOTE}{KEY_MODE}\s+(?i:key)\b"),
+]
+BPM_PATTERN = re.compile(r"(?i:use_bpm\s+(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:bpm|beats per minute))")
+
+
+def camelot(key_label):
+    """Camelot code of a key label ("A minor" -> "8A"), None for an unknown key."""
+    if key_label not in KEY_LABELS:
+        return None
+    index = KEY_LABELS.index(key_label)
+    minor = index < 12
+    major_pitch = (index + 3) % 12 if minor else index - 12  # a minor key is on the wheel with its relative major
+    return f"{(7 * major_pitch + 7) % 12 + 1}{'A' if minor else 'B'}"
+
+
+CAMELOT_CODES = [camelot(label) for label in KEY_LABELS]
+
+
+def neighbour_codes(code):
+    number, letter = int(code[:-1]), code[-1]
+    return {code, f"{number % 12 + 1}{letter}", f"{(number - 2) % 12 + 1}{letter}",
+            f"{number}{'B' if letter == 'A' else 'A'}"}
+
+
+# Keys (as indices of KEY_LABELS) that mix with each key
+KEY_NEIGHBOURS = [[j for j, other in enumerate(CAMELOT_CODES) if other in neighbour_codes(code)]
+                  for code in CAMELOT_CODES]
+
+
+def compatible_keys(key_label):
+    """Labels of the keys that mix with key_label (empty for an unknown key)."""
+    if key_label not in KEY_LABELS:
+        return []
+    return [KEY_LABELS[j] for j in KEY_NEIGHBOURS[KEY_LABELS.index(key_label)]]
+
+
+def fold_tempo(bpm):
+    """BPM halved or doubled into [FOLD_LOW, 2 * FOLD_LOW)."""
+    return bpm * 2.0 ** -np.floor(np.log2(bpm / FOLD_LOW))
+
+
+def compatible_tempo(bpm, target, tolerance=None):
+    """Whether bpm matches target directly or at half or double time, within tolerance (relative, default
+    SAMPLE_BPM_TOLERANCE); False when either is unknown."""
+    if not (bpm and target and bpm > 0 and target > 0):
+        return False
+    tolerance = Config.SAMPLE_BPM_TOLERANCE if tolerance is None else tolerance
+    return any(abs(bpm * ratio - target) <= tolerance * target for ratio in TEMPO_RATIOS)
+
+
+def is_compatible(item, key=None, bpm=None, tolerance=None):
+    """Whether a metadata entry fits a target key and BPM (either may be None for any)."""
+    if key is not None and item.get("Key") not in compatible_keys(key):
+        return False
+    return bpm is None or compatible_tempo(item.get("BPM"), bpm, tolerance)
+
+
+def target_from_text(text):
+    """(key label, BPM) mentioned in a song description or Sonic Pi code, e.g. "in Bb minor at 92 BPM" or
+    "use_bpm 120"; either is None when the text does not mention it."""
+    key = None
+    matches = [match for match in (pattern.search(text) for pattern in KEY_PATTERNS) if match]
+    if matches:
+        letter, accidental, mode = min(matches, key=lambda match: match.start()).groups()
+        pitch = KEY_NAMES.index(letter)
+        if accidental in ("#", "♯", " sharp"):
+            pitch += 1
+        elif accidental in ("b", "♭", " flat"):
+            pitch -= 1
+        key = f"{KEY_NAMES[pitch % 12]} {(mode or 'major').lower()}"
+    match = BPM_PATTERN.search(text)
+    bpm = float(match.group(1) or match.group(2)) if match else None
+    return key, bpm
+
+
+class CompatibilityTable:
+    """Rows of one generation of the feature store, grouped by Camelot code and tempo bucket."""
+
+    def __init__(self, store):
+        self.store = store
+        self.generation = store.generation
+        self.bpm = bpm = np.asarray(store.bpm, dtype=np.float64)
+        keys = np.asarray(store.key, dtype=np.int64)
+        known = (bpm > 0) & (keys != UNKNOWN)  # NaN BPM compares False
+        rows = np.flatnonzero(known)
+        buckets = np.minimum(np.floor(fold_tempo(bpm[rows])).astype(np.int64) - FOLD_LOW, FOLD_LOW - 1)
+        cells = keys[rows] * FOLD_LOW + buckets
+        order = np.argsort(cells, kind="stable")
+        cells, rows = cells[order], rows[order]
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]]) if len(cells) else np.zeros(0, dtype=np.int64)
+        self.cells = {int(cells[start]): rows[start:end] for start, end in zip(starts, np.r_[starts[1:], len(rows)])}
+
+    def tempo_buckets(self, bpm, tolerance):
+        if bpm is None:
+            return range(FOLD_LOW)
+        folded = fold_tempo(bpm)
+        low, high = folded * (1 - tolerance), folded * (1 + tolerance)
+        ranges = [(max(low, FOLD_LOW), min(high, 2 * FOLD_LOW))]
+        if low < FOLD_LOW:  # the tolerance wraps around the octave
+            ranges.append((2 * low, 2 * FOLD_LOW))
+        if high >= 2 * FOLD_LOW:
+            ranges.append((FOLD_LOW, high / 2))
+        return sorted({bucket for start, end in ranges
+                       for bucket in range(int(start) - FOLD_LOW, min(int(end), 2 * FOLD_LOW - 1) - FOLD_LOW + 1)})
+
+    def compatible(self, key=None, bpm=None, tolerance=None):
+        """Rows of the samples that fit a target key label and BPM (either may be None for any), in listing order.
+        Samples without a detected key or tempo are not in the table and never match.
+        """
+        tolerance = Config.SAMPLE_BPM_TOLERANCE if tolerance is None else tolerance
+        if key is not None and key not in KEY_LABELS:
+            return np.zeros(0, dtype=np.int64)
+        keys = KEY_NEIGHBOURS[KEY_LABELS.index(key)] if key is not None else range(len(KEY_LABELS))
+        buckets = self.tempo_buckets(bpm, tolerance)
+        cells = [k * FOLD_LOW + bucket for k in keys for bucket in buckets]
+        found = [self.cells[cell] for cell in cells if cell in self.cells]
+        rows = np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+        if bpm is not None and len(rows):
+            # Folding also joins tempos a factor 4 or more apart; keep direct, half and double time only
+            sample_bpm = self.bpm[rows]
+            rows = rows[np.logical_or.reduce([np.abs(sample_bpm * ratio - bpm) <= tolerance * bpm
+                                              for ratio in TEMPO_RATIOS])]
+        return np.sort(rows)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def get_table(input_directory):
+    """Compatibility table of the current feature store of input_directory (None without sample metadata)."""
+    store = sampleFeatureStore.open_store(input_directory)
+    if store is None:
+        return None
+    with _tables_lock:
+        table = _tables.get(input_directory)
+        if table is None or table.store is not store:
+            table = CompatibilityTable(store)
+            _tables[input_directory] = table
+            logger.info(f"Sample compatibility table built: {len(store)} samples in {len(table.cells)} cells")
+        return table
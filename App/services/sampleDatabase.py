@@ -0,0 +1,218 @@
+'''
+This file contains the SQLite database of the sample metadata (Samples/sample_metadata.db).
+
+The database holds one row per entry of the sample listing, at the same position (so positions are also the
+ids of the sample index), with the BPM, duration and key in indexed columns and the tags in an indexed table
+of their own. A listing run or an upload writes it in one transaction and only touches the entries that
+were added, changed, moved or removed. It is the source of truth of the sample metadata: the search index and
+the feature store (see sampleFeatureStore), whose columns the filters of /api/sample_metadata and the
+compatibility lookups run on, are built from it once per generation (a counter every write increments). The
+per-subfolder JSON files, summary_samples.json and sample_metadata.json are still written, as exports.
+
+The database runs in WAL mode, so readers keep reading the last committed state while the library is being
+written. Every thread reads through its own connection. A lookup built from one generation reads the entries
+of its rows with records(rows, generation), which finds nothing once a newer generation has been written.
+'''
+import os
+import json
+import random
+import sqlite3
+import logging
+import threading
+from contextlib import closing, contextmanager
+
+logger = logging.getLogger(__name__)
+
+DATABASE_FILE = 'sample_metadata.db'
+BUSY_TIMEOUT_MS = 5000
+READ_ATTEMPTS = 3  # times a lookup is rebuilt when the library is written between the lookup and its reads
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL UNIQUE,
+    bpm REAL,
+    duration REAL,
+    key TEXT,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_position ON samples (position);
+CREATE INDEX IF NOT EXISTS samples_key ON samples (key);
+CREATE INDEX IF NOT EXISTS samples_bpm ON samples (bpm);
+CREATE TABLE IF NOT EXISTS sample_tags (
+    tag TEXT NOT NULL,
+    sample INTEGER NOT NULL,
+    PRIMARY KEY (tag, sample)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sample_tags_sample ON sample_tags (sample);
+CREATE TABLE IF NOT EXISTS library (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    generation INTEGER NOT NULL
+);
+"""
+
+
+def database_path(input_directory):
+    return os.path.join(input_directory, DATABASE_FILE)
+
+
+def connect(path):
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def sample_columns(item):
+    return item.get("BPM"), item.get("Duration"), item.get("Key")
+
+
+def write_library(input_directory, metadata):
+    """Make the database hold metadata (the entries of sample_metadata.json, in order), in one transaction.
+
+    Returns the generation written.
+    """
+    with closing(connect(database_path(input_directory))) as connection:
+        connection.executescript(SCHEMA)
+        with connection:
+            existing = {filename: (sample_id, position, text) for sample_id, position, filename, text
+                        in connection.execute("SELECT id, position, filename, metadata FROM samples")}
+            listed = set()
+            written = 0
+            for position, item in enumerate(metadata):
+                filename = item["Filename"]
+                listed.add(filename)
+                text = json.dumps(item, ensure_ascii=False)
+                current = existing.get(filename)
+                if current is not None and current[2] == text:
+                    if current[1] != position:
+                        connection.execute("UPDATE samples SET position = ? WHERE id = ?", (position, current[0]))
+                    continue
+                if current is None:
+                    sample_id = connection.execute(
+                        "INSERT INTO samples (position, filename, bpm, duration, key, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                        (position, filename, *sample_columns(item), text)).lastrowid
+                else:
+                    sample_id = current[0]
+                    connection.execute(
+                        "UPDATE samples SET position = ?, bpm = ?, duration = ?, key = ?, metadata = ? WHERE id = ?",
+                        (position, *sample_columns(item), text, sample_id))
+                    connection.execute("DELETE FROM sample_tags WHERE sample = ?", (sample_id,))
+                connection.executemany("INSERT OR IGNORE INTO sample_tags (tag, sample) VALUES (?, ?)",
+                                       [(tag, sample_id) for tag in item.get("Tags", [])])
+                written += 1
+            removed = [(sample_id,) for filename, (sample_id, _, _) in existing.items() if filename not in listed]
+            connection.executemany("DELETE FROM sample_tags WHERE sample = ?", removed)
+            connection.executemany("DELETE FROM samples WHERE id = ?", removed)
+            # A new database starts at a random generation, so it never repeats those of a database it replaces
+            connection.execute("INSERT INTO library (id, generation) VALUES (0, ?) "
+                               "ON CONFLICT (id) DO UPDATE SET generation = generation + 1",
+                               (random.randrange(1, 2 ** 48),))
+            generation = connection.execute("SELECT generation FROM library WHERE id = 0").fetchone()[0]
+    logger.info(f"Sample database written: {len(metadata)} samples, {written} added or changed, {len(removed)} removed")
+    return generation
+
+
+class SampleDatabase:
+    """Read access to the sample database, through one connection per thread."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = connect(self.path)
+            connection.execute("PRAGMA query_only = ON")
+            self.local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    @contextmanager
+    def transaction(self):
+        """Run the reads of the block on one state of the database (nested blocks join the outer one)."""
+        connection = self.connection
+        if connection.in_transaction:
+            yield connection
+            return
+        connection.execute("BEGIN")
+        try:
+            yield connection
+        finally:
+            connection.execute("COMMIT")
+
+    def generation(self):
+        """Generation of the library (incremented by every write); lookups built from the records are rebuilt
+        when it changes."""
+        try:
+            found = self.connection.execute("SELECT generation FROM library WHERE id = 0").fetchone()
+        except sqlite3.OperationalError:
+            return 0  # written before the counter existed, the next write adds it
+        return found[0] if found else 0
+
+    def snapshot(self):
+        """(generation, every metadata entry) of one state of the database."""
+        with self.transaction():
+            return self.generation(), self.records()
+
+    def state(self):
+        """(generation, number of samples) of one state of the database."""
+        with self.transaction():
+            return self.generation(), len(self)
+
+    def records(self, rows=None, generation=None):
+        """Metadata entries at the positions rows (all samples when rows is None).
+
+        With a generation, returns None when the database is no longer at that generation, since the rows
+        would then point at other entries.
+        """
+        with self.transaction() as connection:
+            if generation is not None and self.generation() != generation:
+                return None
+            if rows is None:
+                return [json.loads(text) for text, in connection.execute("SELECT metadata FROM samples ORDER BY position")]
+            found = {}
+            statement = "SELECT position, metadata FROM samples WHERE position = ?"
+            for row in rows:
+                for position, text in connection.execute(statement, (int(row),)):
+                    found[position] = json.loads(text)
+        return [found[int(row)] for row in rows if int(row) in found]
+
+    def lookup(self, filenames):
+        """Metadata entries of the given filenames ("Subfolder/file.wav"); unknown filenames map to None."""
+        results = []
+        for filename in filenames:
+            found = self.connection.execute("SELECT metadata FROM samples WHERE filename = ?", (filename,)).fetchone()
+            results.append(json.loads(found[0]) if found else None)
+        return results
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def open_database(input_directory):
+    """Sample database of input_directory.
+
+    A library indexed before the database existed is imported from sample_metadata.json once.
+    Returns None when there is no sample metadata at all.
+    """
+    path = database_path(input_directory)
+    with _databases_lock:
+        database = _databases.get(path)
+        if database is not None and os.path.exists(path):
+            return database
+        if not os.path.exists(path):
+            metadata_file = os.path.join(input_directory, "sample_metadata.json")
+            if not os.path.exists(metadata_file):
+                return None
+            with open(metadata_file, "r", encoding="utf-8") as f:
+                write_library(input_directory, json.load(f))
+        database = SampleDatabase(path)
+        _databases[path] = database
+        return database
@@ -0,0 +1,203 @@
+'''
+This file contains the columnar feature store of the sample library.
+
+The store is a columnar copy of one generation of the sample database (see sampleDatabase), which stays the
+source of truth: one row per sample, at its position in the listing (so rows are also the ids of the sample
+index). Numeric descriptors are NumPy columns that are memory-mapped when the store is opened: BPM, duration,
+key, energy, brightness and a bitset of tags, with a string table of the filenames and tag names. Filters such
+as "118-126 BPM in A minor with high energy" are evaluated as NumPy masks over those columns; only the entries
+of the matching rows are read back, from the database at the generation of the store.
+
+The store is written on first use after the database has moved to a new generation, into a directory named
+after that generation, and CURRENT then points to it; a reader that has the previous generation mapped keeps
+a consistent view.
+'''
+import os
+import json
+import uuid
+import shutil
+import logging
+import threading
+import numpy as np
+from App.services import sampleDatabase
+from App.services.audioFeatures import KEY_NAMES
+
+logger = logging.getLogger(__name__)
+
+STORE_DIRECTORY = 'sample_features'
+CURRENT_FILE = 'CURRENT'
+STORE_VERSION = 2
+
+KEY_LABELS = [f"{name} minor" for name in KEY_NAMES] + [f"{name} major" for name in KEY_NAMES]
+ENERGY_LEVELS = ["very low energy", "low energy", "high energy"]
+BRIGHTNESS_LEVELS = ["warm", "bright"]
+UNKNOWN = -1
+
+
+def level_index(levels, value):
+    return levels.index(value) if value in levels else UNKNOWN
+
+
+def load_column(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:  # an empty library has empty columns, which cannot be mapped
+        return np.load(path)
+
+
+def tag_level(tags, levels):
+    """Index in levels of the first tag that is one of them (energy and brightness are stored as tags)."""
+    for tag in tags:
+        if tag in levels:
+            return levels.index(tag)
+    return UNKNOWN
+
+
+def tag_bitsets(tag_lists, vocabulary):
+    """uint64 matrix with one row per sample and bit j set when the sample has vocabulary[j]."""
+    positions = {tag: j for j, tag in enumerate(vocabulary)}
+    bitsets = np.zeros((len(tag_lists), max(1, -(-len(vocabulary) // 64))), dtype=np.uint64)
+    for row, tags in enumerate(tag_lists):
+        for tag in tags:
+            j = positions[tag]
+            bitsets[row, j // 64] |= np.uint64(1) << np.uint64(j % 64)
+    return bitsets
+
+
+def write_store(input_directory, records, generation):
+    """Write the store of records (the entries of one generation of the sample database, in order)."""
+    store_root = os.path.join(input_directory, STORE_DIRECTORY)
+    path = os.path.join(store_root, str(generation))
+    staging = os.path.join(store_root, f"{generation}.{uuid.uuid4().hex}.tmp")
+    os.makedirs(staging)
+
+    tag_lists = [item.get("Tags", []) for item in records]
+    vocabulary = sorted({tag for tags in tag_lists for tag in tags})
+    columns = {
+        "bpm": np.array([item.get("BPM", np.nan) for item in records], dtype=np.float32),
+        "duration": np.array([item.get("Duration", np.nan) for item in records], dtype=np.float32),
+        "key": np.array([level_index(KEY_LABELS, item.get("Key")) for item in records], dtype=np.int8),
+        "energy": np.array([tag_level(tags, ENERGY_LEVELS) for tags in tag_lists], dtype=np.int8),
+        "brightness": np.array([tag_level(tags, BRIGHTNESS_LEVELS) for tags in tag_lists], dtype=np.int8),
+        "tags": tag_bitsets(tag_lists, vocabulary),
+    }
+    for name, column in columns.items():
+        np.save(os.path.join(staging, f"{name}.npy"), column)
+    with open(os.path.join(staging, "strings.json"), "w", encoding="utf-8") as f:
+        json.dump({"filenames": [item.get("Filename", "") for item in records], "tags": vocabulary}, f)
+    try:
+        os.rename(staging, path)
+    except OSError:  # another process wrote the same generation first
+        shutil.rmtree(staging, ignore_errors=True)
+
+    current_file = os.path.join(store_root, CURRENT_FILE)
+    with open(f"{current_file}.{uuid.uuid4().hex}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": STORE_VERSION, "generation": generation, "count": len(records)}, f)
+    os.replace(f.name, current_file)
+    logger.info(f"Sample feature store written: {len(records)} samples, {len(vocabulary)} tags")
+
+    # Older generations may still be mapped by a reader (and cannot be removed on Windows); try again next time
+    for name in os.listdir(store_root):
+        if name not in (str(generation), CURRENT_FILE) and not name.endswith(".tmp"):
+            shutil.rmtree(os.path.join(store_root, name), ignore_errors=True)
+    return SampleFeatureStore(input_directory, path, generation)
+
+
+class SampleFeatureStore:
+    """Read-only view of one generation of the store."""
+
+    def __init__(self, input_directory, path, generation):
+        self.input_directory = input_directory
+        self.path = path
+        self.generation = generation
+        for name in ("bpm", "duration", "key", "energy", "brightness", "tags"):
+            setattr(self, name, load_column(os.path.join(path, f"{name}.npy")))
+        with open(os.path.join(path, "strings.json"), "r", encoding="utf-8") as f:
+            strings = json.load(f)
+        self.filenames = strings["filenames"]
+        self.tag_names = strings["tags"]
+        self.tag_positions = {tag: j for j, tag in enumerate(self.tag_names)}
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def tag_mask(self, tag):
+        """Boolean mask of the samples having tag (all False for a tag no sample has)."""
+        j = self.tag_positions.get(tag)
+        if j is None:
+            return np.zeros(len(self), dtype=bool)
+        return ((self.tags[:, j // 64] >> np.uint64(j % 64)) & np.uint64(1)) == 1
+
+    def query(self, bpm=None, duration=None, key=None, energy=None, brightness=None, tags=None, any_tags=None):
+        """Rows matching every given filter, in listing order.
+
+        bpm and duration are (low, high) ranges, either bound may be None; key, energy and brightness are
+        labels as they appear in the metadata ("A minor", "high energy", "bright"). Samples must have all
+        of tags and at least one of any_tags.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, bounds in ((self.bpm, bpm), (self.duration, duration)):
+            low, high = bounds if bounds is not None else (None, None)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+        for column, levels, value in ((self.key, KEY_LABELS, key), (self.energy, ENERGY_LEVELS, energy),
+                                      (self.brightness, BRIGHTNESS_LEVELS, brightness)):
+            if value is not None:
+                mask &= (column == level_index(levels, value)) if value in levels else False
+        for tag in tags or []:
+            mask &= self.tag_mask(tag)
+        if any_tags:
+            mask &= np.logical_or.reduce([self.tag_mask(tag) for tag in any_tags])
+        return np.flatnonzero(mask)
+
+    def records(self, rows=None):
+        """Metadata entries of rows (all samples when rows is None), read from the sample database; None when
+        the database has moved on from the generation of the store."""
+        database = sampleDatabase.open_database(self.input_directory)
+        return database.records(rows, generation=self.generation)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def open_store(input_directory):
+    """Store of the current generation of the sample database of input_directory, written when the database
+    has moved to a new generation. Returns None when there is no sample metadata at all.
+    """
+    database = sampleDatabase.open_database(input_directory)
+    if database is None:
+        return None
+    generation = database.generation()
+    with _stores_lock:
+        store = _stores.get(input_directory)
+        if store is not None and store.generation == generation:
+            return store
+
+        store_root = os.path.join(input_directory, STORE_DIRECTORY)
+        try:
+            with open(os.path.join(store_root, CURRENT_FILE), "r", encoding="utf-8") as f:
+                current = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            current = {}
+        if current.get("version") == STORE_VERSION and current.get("generation") == generation:
+            store = SampleFeatureStore(input_directory, os.path.join(store_root, str(generation)), generation)
+        else:
+            generation, records = database.snapshot()
+            store = write_store(input_directory, records, generation)
+        _stores[input_directory] = store
+        return store
+
+
+def query_records(input_directory, **filters):
+    """Metadata entries of the samples matching filters (see SampleFeatureStore.query), in listing order."""
+    for _ in range(sampleDatabase.READ_ATTEMPTS):
+        store = open_store(input_directory)
+        if store is None:
+            return []
+        records = store.records(store.query(**filters))
+        if records is not None:
+            return records
+    raise RuntimeError("The sample library kept changing during the query")
@@ -0,0 +1,151 @@
+'''
+This file contains the spectral fingerprints used to find duplicate samples in the library.
+
+A fingerprint is a 415-bit hash of a sample, taken from its 16kHz mono signal after leading and trailing
+silence is trimmed (the waveform the analysis already decoded, see SampleMedataListing.extract_features), so
+it does not depend on the file format, sampling rate, channel count or level:
+- the signs of the curvature across 24 mel bands of the average spectrum of 16 equal time slices
+- whether the loudness rises from one to the next of 64 equal time slices
+
+Re-exports of a sample differ in at most a few percent of the bits, different samples in far more. Near
+duplicates are found in sub-linear time with locality-sensitive hashing: the bits are cut into bands of 16
+and only samples sharing at least one band with the query are compared bit by bit (and by duration).
+'''
+import logging
+import numpy as np
+import librosa
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_SAMPLE_RATE = 16000
+FINGERPRINT_MAX_SECONDS = 60  # longer files are fingerprinted on their beginning (and told apart by duration)
+FINGERPRINT_MAX_LENGTH = FINGERPRINT_SAMPLE_RATE * FINGERPRINT_MAX_SECONDS
+TRIM_DB = 50
+N_FFT = 1024
+HOP_LENGTH = 128
+N_BANDS = 24
+FMIN = 60
+FMAX = 7000
+SPECTRUM_SLICES = 16
+LOUDNESS_SLICES = 64
+LOUDNESS_STEP_DB = 0.5  # smaller loudness changes count as flat, they flip with resampling noise
+FLOOR_DB = 60
+BAND_BITS = 16
+DURATION_TOLERANCE = 0.005  # relative
+DURATION_TOLERANCE_SECONDS = 0.02
+
+
+def fingerprint(waveform, duration):
+    """Fingerprint of a 16kHz mono waveform, as a dict with the hash ("bits", hex) and the trimmed length
+    ("span") in seconds; duration is the length of the whole file. "bits" is None when the sample is too
+    short or silent to be fingerprinted.
+    """
+    record = {"bits": None, "span": 0.0, "duration": round(float(duration), 3)}
+    threshold = np.abs(waveform).max(initial=0.0) * 10 ** (-TRIM_DB / 20)
+    audible = np.flatnonzero(np.abs(waveform) > threshold)
+    if threshold == 0 or len(audible) == 0:
+        return record
+    y = waveform[audible[0]:audible[-1] + 1]  # trimmed to the sample, so copies with more padding line up
+    record["span"] = round(len(y) / FINGERPRINT_SAMPLE_RATE, 3)
+
+    mel = librosa.feature.melspectrogram(y=y, sr=FINGERPRINT_SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH,
+                                         n_mels=N_BANDS, fmin=FMIN, fmax=FMAX)
+    if mel.shape[1] < LOUDNESS_SLICES:
+        return record
+
+    spectrum = np.stack([mel[:, frames].mean(axis=1)
+                         for frames in np.array_split(np.arange(mel.shape[1]), SPECTRUM_SLICES)], axis=1)
+    spectrum = librosa.power_to_db(spectrum, ref=np.max, top_db=FLOOR_DB)
+    curvature = spectrum[:-2] + spectrum[2:] - 2 * spectrum[1:-1] > 0
+
+    loudness = mel.sum(axis=0)
+    loudness = np.array([loudness[frames].mean()
+                         for frames in np.array_split(np.arange(len(loudness)), LOUDNESS_SLICES)])
+    loudness = librosa.power_to_db(loudness, ref=np.max, top_db=FLOOR_DB)
+    rises = loudness[1:] > loudness[:-1] + LOUDNESS_STEP_DB
+
+    record["bits"] = np.packbits(np.concatenate([curvature.ravel(), rises])).tobytes().hex()
+    return record
+
+
+class FingerprintBuilder:
+    """Fingerprint of a signal that is fed block by block (see audioFeatures.stream_measure): only its first
+    FINGERPRINT_MAX_SECONDS are kept, at the sampling rate of the file, and resampled once at the end.
+    """
+
+    def __init__(self, sr):
+        self.sr = sr
+        self.blocks = []
+        self.remaining = int(FINGERPRINT_MAX_SECONDS * sr)
+
+    def add(self, y):
+        if self.remaining > 0:
+            block = np.array(y[:self.remaining], dtype=np.float32)
+            self.blocks.append(block)
+            self.remaining -= len(block)
+
+    def fingerprint(self, duration):
+        y = np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.float32)
+        if self.sr != FINGERPRINT_SAMPLE_RATE and len(y):
+            y = librosa.resample(y, orig_sr=self.sr, target_sr=FINGERPRINT_SAMPLE_RATE)
+        return fingerprint(y, duration)
+
+
+def fingerprint_file(file_path):
+    """Fingerprint of an audio file (see fingerprint), for files that were analysed before deduplication was
+    enabled; a file that cannot be decoded gets no hash."""
+    try:
+        duration = librosa.get_duration(path=file_path)
+        y, _ = librosa.load(file_path, sr=FINGERPRINT_SAMPLE_RATE, duration=FINGERPRINT_MAX_SECONDS)
+        return fingerprint(y, duration)
+    except Exception as e:
+        logger.warning(f"Could not fingerprint {file_path}: {e}")
+        return {"bits": None, "span": 0.0, "duration": 0.0}
+
+
+def same_length(a, b, key):
+    return abs(a[key] - b[key]) <= max(DURATION_TOLERANCE_SECONDS, DURATION_TOLERANCE * max(a[key], b[key]))
+
+
+class FingerprintIndex:
+    """Fingerprints of the distinct samples seen so far, searchable for near duplicates."""
+
+    def __init__(self, max_bit_error=0.05):
+        self.max_bit_error = max_bit_error
+        self.buckets = defaultdict(list)
+        self.items = []
+
+    @staticmethod
+    def bands(bits):
+        band_length = 2 * (BAND_BITS // 8)  # hex digits
+        return [(i, bits[i:i + band_length]) for i in range(0, len(bits), band_length)]
+
+    def add(self, key, record):
+        if record is None or record.get("bits") is None:
+            return
+        bits = np.unpackbits(np.frombuffer(bytes.fromhex(record["bits"]), dtype=np.uint8))
+        position = len(self.items)
+        self.items.append((key, record, bits))
+        for band in self.bands(record["bits"]):
+            self.buckets[band].append(position)
+
+    def match(self, record):
+        """Key of the closest added sample that record duplicates, or None."""
+        if record is None or record.get("bits") is None:
+            return None
+        candidates = {position for band in self.bands(record["bits"]) for position in self.buckets.get(band, [])}
+        if not candidates:
+            return None
+        bits = np.unpackbits(np.frombuffer(bytes.fromhex(record["bits"]), dtype=np.uint8))
+        best, best_error = None, None
+        for position in sorted(candidates):
+            key, other, other_bits = self.items[position]
+            if not same_length(record, other, "span"):
+                continue
+            if max(record["duration"], other["duration"]) > FINGERPRINT_MAX_SECONDS and not same_length(record, other, "duration"):
+                continue  # only the beginning of long files is fingerprinted
+            error = np.count_nonzero(bits != other_bits) / len(bits)
+            if error <= self.max_bit_error and (best_error is None or error < best_error):
+                best, best_error = key, error
+        return best
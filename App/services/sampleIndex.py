@@ -0,0 +1,307 @@
+'''
+This file contains the per-sample vector index used to retrieve samples during the Sampling phase.
+
+Every sample gets its own embedding, built from its tags, vibe and description. Vector ids in the FAISS
+index are row numbers in sample_metadata.json. Embeddings are cached by the text they were computed from,
+so re-indexing only encodes new or changed samples. The embedding model is loaded once per process, see
+load_embedding_model; sampleRetrieval keeps the index loaded for queries. Config.SAMPLE_EMBEDDING_BACKEND
+runs the model in full precision on PyTorch or int8-quantised on ONNX Runtime (faster on CPU, see
+App/benchmarks/bench_embedding.py); switching re-embeds the library once.
+
+The index type follows the size of the library (Config.SAMPLE_INDEX_TYPE 'auto'): exact search for small
+libraries, an HNSW graph up to a few hundred thousand samples, and IVF-PQ beyond that: 4-bit PQ codes in
+inverted lists, trained on a sample of the embeddings, whose best candidates are re-ranked with 8-bit
+scalar-quantised vectors. Config.SAMPLE_INDEX_EF_SEARCH, Config.SAMPLE_INDEX_NPROBE and
+Config.SAMPLE_INDEX_REFINE trade recall for latency; see App/benchmarks/bench_index.py.
+'''
+import os
+import math
+import hashlib
+import logging
+import threading
+import numpy as np
+import faiss
+from App.config import Config
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKENDS = ("torch", "onnx-int8")
+INDEX_FILE = 'sample_index.faiss'
+EMBEDDING_CACHE_FILE = 'sample_embeddings.npz'
+ENCODE_BATCH_SIZE = 64
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+FLAT_MAX_SAMPLES = 20000  # exact search stays within a few milliseconds up to here
+HNSW_MAX_SAMPLES = 200000  # beyond this, full vectors plus the graph take too much memory
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+IVF_TRAIN_POINTS_PER_LIST = 64
+PQ_DIMENSIONS = 4  # per 4-bit PQ code (fast-scan)
+PQ_MIN_TRAIN_POINTS = 10000
+
+
+_models = {}
+_model_lock = threading.Lock()
+_encode_lock = threading.Lock()
+
+
+def embedding_backend(backend=None):
+    """Runtime of the embedding model: backend (default Config.SAMPLE_EMBEDDING_BACKEND), 'torch' for the
+    full-precision PyTorch model or 'onnx-int8' for its int8-quantised ONNX export on ONNX Runtime.
+    """
+    backend = (backend or Config.SAMPLE_EMBEDDING_BACKEND).lower()
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    return backend
+
+
+def embedding_model_id(backend=None):
+    """Identifies the vectors of a backend in the embedding cache; quantised vectors are not mixed with others."""
+    if embedding_backend(backend) == "torch":
+        return EMBEDDING_MODEL
+    return f"{EMBEDDING_MODEL}/{Config.SAMPLE_EMBEDDING_ONNX_FILE}"
+
+
+def load_embedding_model(backend=None):
+    """The embedding model, loaded once per process and backend and shared by the listing, the ingest queue
+    and retrieval. Every backend has the encode interface of SentenceTransformer.
+    """
+    backend = embedding_backend(backend)
+    with _model_lock:
+        if backend not in _models:
+            from sentence_transformers import SentenceTransformer
+            if backend == "onnx-int8":
+                # Needs sentence-transformers[onnx]; the model repository ships the quantised exports
+                _models[backend] = SentenceTransformer(EMBEDDING_MODEL, backend="onnx",
+                                                       model_kwargs={"file_name": Config.SAMPLE_EMBEDDING_ONNX_FILE})
+            else:
+                _models[backend] = SentenceTransformer(EMBEDDING_MODEL)
+            logger.info(f"Embedding model {embedding_model_id(backend)} loaded ({backend})")
+        return _models[backend]
+
+
+def sample_text(item):
+    """Text that is embedded for a sample: its tags, vibe and description."""
+    parts = [
+        ", ".join(item.get("Tags", [])),
+        item.get("Track Type", ""),
+        item.get("Vibe", ""),
+        item.get("Description", ""),
+    ]
+    return ". ".join(part for part in parts if part)
+
+
+def text_hash(text):
+    return hashlib.sha1(f"{embedding_model_id()}\n{text}".encode("utf-8")).hexdigest()
+
+
+def encode_texts(model, texts, batch_size=ENCODE_BATCH_SIZE):
+    """Encode texts in batches as L2-normalised float32 vectors, so inner product is cosine similarity.
+
+    The model is shared between threads; it encodes one batch at a time, so a query is never held up by more
+    than one batch of a re-index.
+    """
+    batches = []
+    for start in range(0, len(texts), batch_size):
+        with _encode_lock:
+            batches.append(model.encode(texts[start:start + batch_size], batch_size=batch_size,
+                                        convert_to_numpy=True, normalize_embeddings=True))
+    embeddings = np.concatenate(batches) if batches else np.zeros((0, 0))
+    return np.asarray(embeddings, dtype="float32").reshape(len(texts), -1)
+
+
+def encode_query(model, query):
+    return encode_texts(model, [query])
+
+
+def load_embedding_cache(input_directory):
+    try:
+        with np.load(os.path.join(input_directory, EMBEDDING_CACHE_FILE)) as cache:
+            return dict(zip(cache["hashes"].tolist(), cache["vectors"]))
+    except (FileNotFoundError, KeyError, ValueError):
+        return {}
+
+
+def save_embedding_cache(input_directory, cache, hashes):
+    """Store the vectors of cache for hashes only, so vectors of removed or changed samples are dropped."""
+    hashes = [h for h in dict.fromkeys(hashes) if h in cache]
+    vectors = np.stack([cache[h] for h in hashes]).astype("float32") if hashes else np.zeros((0, 0), dtype="float32")
+    cache_file = os.path.join(input_directory, EMBEDDING_CACHE_FILE)
+    tmp_file = cache_file + ".tmp.npz"
+    np.savez(tmp_file, hashes=np.array(hashes, dtype=str), vectors=vectors)
+    os.replace(tmp_file, cache_file)
+
+
+def embed_samples(input_directory, metadata, model=None):
+    """Embedding matrix of metadata (one row per sample), encoding only samples missing from the cache."""
+    cache = load_embedding_cache(input_directory)
+    hashes = [text_hash(sample_text(item)) for item in metadata]
+    missing = [i for i, h in enumerate(hashes) if h not in cache]
+    logger.info(f"Embedding {len(missing)} of {len(metadata)} samples ({len(metadata) - len(missing)} cached)")
+
+    if missing:
+        model = model or load_embedding_model()
+        encoded = encode_texts(model, [sample_text(metadata[i]) for i in missing])
+        for i, vector in zip(missing, encoded):
+            cache[hashes[i]] = vector
+
+    save_embedding_cache(input_directory, cache, hashes)
+    if not metadata:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([cache[h] for h in hashes]).astype("float32")
+
+
+def choose_index_type(sample_count, index_type=None):
+    """Index type for a library of sample_count samples: index_type (default Config.SAMPLE_INDEX_TYPE), with
+    'auto' picking flat, HNSW or IVF-PQ by size.
+    """
+    index_type = (index_type or Config.SAMPLE_INDEX_TYPE).lower()
+    if index_type == "auto":
+        if sample_count <= FLAT_MAX_SAMPLES:
+            return "flat"
+        return "hnsw" if sample_count <= HNSW_MAX_SAMPLES else "ivfpq"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown sample index type: {index_type}")
+    return index_type
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, (faiss.IndexIVF, faiss.IndexRefine)):
+        return "ivfpq"
+    return "flat"
+
+
+def ivf_list_count(sample_count):
+    return max(1, min(int(4 * math.sqrt(sample_count)), sample_count // IVF_TRAIN_POINTS_PER_LIST))
+
+
+def pq_subquantizers(dimension):
+    """Number of PQ codes per vector: an even number (as fast-scan needs) covering about PQ_DIMENSIONS each."""
+    return next(m for m in range(max(2, dimension // PQ_DIMENSIONS), 0, -1) if dimension % m == 0 and m % 2 == 0)
+
+
+def build_index(embeddings, index_type=None):
+    """Inner-product index of the embeddings (see choose_index_type); vector id i is row i of the sample metadata."""
+    sample_count, dimension = embeddings.shape
+    index_type = choose_index_type(sample_count, index_type)
+    if index_type == "ivfpq" and sample_count < PQ_MIN_TRAIN_POINTS:
+        logger.warning(f"Too few samples ({sample_count}) to train an IVF-PQ index, using a flat index")
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    else:
+        lists = ivf_list_count(sample_count)
+        index = faiss.index_factory(dimension, f"IVF{lists},PQ{pq_subquantizers(dimension)}x4fs,Refine(SQ8)",
+                                    faiss.METRIC_INNER_PRODUCT)
+        # Centroids and codebooks are trained on a random sample, not on the whole library
+        train_count = min(sample_count, max(IVF_TRAIN_POINTS_PER_LIST * lists, PQ_MIN_TRAIN_POINTS))
+        rows = np.random.default_rng(0).choice(sample_count, train_count, replace=False)
+        index.train(embeddings[np.sort(rows)])
+    index.add(embeddings)
+    logger.info(f"Built a {index_type} index of {sample_count} samples")
+    return index
+
+
+def set_search_parameters(index, k=1, nprobe=None, ef_search=None, refine=None):
+    """Apply the recall/latency knobs of the index: IVF lists visited per query (nprobe) and candidates
+    re-ranked per result (refine), or the size of the HNSW candidate list (efSearch, at least k).
+    Defaults come from Config.
+    """
+    if isinstance(index, faiss.IndexRefine):
+        index.k_factor = refine or Config.SAMPLE_INDEX_REFINE
+        faiss.extract_index_ivf(index).nprobe = nprobe or Config.SAMPLE_INDEX_NPROBE
+    elif isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe or Config.SAMPLE_INDEX_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = max(ef_search or Config.SAMPLE_INDEX_EF_SEARCH, k)
+
+
+def write_index(input_directory, index):
+    """Write the index through a temporary file, so readers never load a partly written index."""
+    index_file = os.path.join(input_directory, INDEX_FILE)
+    faiss.write_index(index, index_file + ".tmp")
+    os.replace(index_file + ".tmp", index_file)
+
+
+def remove_index(input_directory):
+    try:
+        os.remove(os.path.join(input_directory, INDEX_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def update_index(input_directory, metadata, model=None):
+    """Embed every sample of metadata and write the sample index next to it.
+
+    An empty library has no index: the index file of an earlier library is removed and None is returned.
+    """
+    embeddings = embed_samples(input_directory, metadata, model)
+    if len(embeddings) == 0:
+        logger.info("No samples to index")
+        remove_index(input_directory)
+        return None
+    index = build_index(embeddings)
+    write_index(input_directory, index)
+    return index
+
+
+def append_to_index(input_directory, metadata, start, model=None):
+    """Add the samples metadata[start:] to the stored index, which holds the vectors of metadata[:start].
+
+    Only the new samples are embedded and the existing vectors are kept as they are. When the stored index
+    does not hold exactly `start` vectors, the whole index is rebuilt with update_index instead.
+    """
+    try:
+        index = faiss.read_index(os.path.join(input_directory, INDEX_FILE))
+    except RuntimeError:
+        index = None
+    if index is None or index.ntotal != start:
+        return update_index(input_directory, metadata, model)
+    if index_type_of(index) != choose_index_type(len(metadata)):
+        return update_index(input_directory, metadata, model)  # the library outgrew its index type
+
+    new_items = metadata[start:]
+    if not new_items:
+        return index
+    cache = load_embedding_cache(input_directory)
+    all_hashes = [text_hash(sample_text(item)) for item in metadata]
+    hashes = all_hashes[start:]
+    missing = [i for i, h in enumerate(hashes) if h not in cache]
+    if missing:
+        model = model or load_embedding_model()
+        encoded = encode_texts(model, [sample_text(new_items[i]) for i in missing])
+        for i, vector in zip(missing, encoded):
+            cache[hashes[i]] = vector
+
+    index.add(np.stack([cache[h] for h in hashes]).astype("float32"))
+    write_index(input_directory, index)
+    save_embedding_cache(input_directory, cache, all_hashes)
+    logger.info(f"Added {len(new_items)} samples to the index ({len(missing)} embedded)")
+    return index
+
+
+def is_current(input_directory, sample_count):
+    """True when the stored index holds exactly one vector per sample (an empty library has no index)."""
+    if not os.path.exists(os.path.join(input_directory, INDEX_FILE)):
+        return sample_count == 0
+    try:
+        return faiss.read_index(os.path.join(input_directory, INDEX_FILE)).ntotal == sample_count
+    except RuntimeError:
+        return False
+
+
+def search(index, query_embedding, k, nprobe=None, ef_search=None, refine=None):
+    """Return (metadata row, score) pairs of the k nearest samples, best first."""
+    k = min(k, index.ntotal)
+    if k <= 0:
+        return []
+    set_search_parameters(index, k, nprobe, ef_search, refine)
+    scores, ids = index.search(query_embedding, k)
+    return [(int(i), float(score)) for i, score in zip(ids[0], scores[0]) if i >= 0]
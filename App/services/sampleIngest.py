@@ -0,0 +1,228 @@
+'''
+This file contains the ingest queue that adds uploaded samples to the library in the background.
+
+Every upload becomes a job: its files are analysed (see SampleMedataListing.analyse_files) and then merged
+into the manifest, the sample database and its JSON exports and the sample index, without scanning or
+re-embedding the rest of the library. Uploads that duplicate a sample of the library (or each other) are
+not added, see SampleMedataListing.find_duplicates; they are fingerprinted by their analysis. At most
+`max_workers` jobs run at a time; the merge step is serialised with full listing runs through
+SampleMedataListing.library_lock.
+'''
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from App.config import Config
+from App.services import SampleMedataListing
+from App.services import sampleIndex
+from App.services import sampleRetrieval
+from App.services import sampleDatabase
+from App.services.sampleManifest import SampleManifest
+
+logger = logging.getLogger(__name__)
+
+MAX_FINISHED_JOBS = 100  # finished jobs kept for status queries
+
+
+class IngestJob:
+    def __init__(self, file_paths):
+        self.id = uuid.uuid4().hex
+        self.file_paths = list(file_paths)
+        self.status = "queued"
+        self.added = []
+        self.duplicates = {}
+        self.errors = {}
+        self.created = time.time()
+        self.finished = None
+        self.error = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "files": [os.path.basename(file_path) for file_path in self.file_paths],
+            "added": self.added,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+def merge_into_library(input_directory, analysed):
+    """Merge analysed files (file path -> metadata entry) into the library files and the index.
+
+    Entries replace those with the same Filename and are appended otherwise; appended entries are added to
+    the sample index as they are, a replaced entry makes the index be rebuilt from cached embeddings.
+    Duplicate entries are only recorded in the manifest (and drop a listed entry of the same Filename).
+    Returns the Filenames that were added or updated.
+    """
+    metadata_file = os.path.join(input_directory, "sample_metadata.json")
+    database = sampleDatabase.open_database(input_directory)
+    metadata = database.records() if database is not None else []
+    indexed_count = len(metadata)
+    rows = {item["Filename"]: row for row, item in enumerate(metadata)}
+
+    manifest = SampleManifest(input_directory)
+    replaced = False
+    merged = []
+    dropped = set()
+    for file_path, entry in analysed.items():
+        if not os.path.exists(file_path):
+            continue  # removed since it was uploaded
+        manifest.update(file_path, entry)
+        if "Duplicate Of" in entry and entry["Filename"] in rows:
+            dropped.add(entry["Filename"])  # an uploaded file replaced a listed sample with a duplicate
+        if "Error" in entry or "Duplicate Of" in entry:
+            continue
+        if entry["Filename"] in rows:
+            metadata[rows[entry["Filename"]]] = entry
+            replaced = True
+        else:
+            rows[entry["Filename"]] = len(metadata)
+            metadata.append(entry)
+        merged.append(entry["Filename"])
+    manifest.save()
+    SampleMedataListing.save_duplicates(input_directory, manifest)
+    if dropped:
+        metadata = [item for item in metadata if item["Filename"] not in dropped]
+        replaced = True
+
+    # Subfolder metadata and library summary, as the full listing writes them
+    for subfolder_path in sorted({os.path.dirname(file_path) for file_path in analysed}):
+        entries = manifest_lookup(manifest, subfolder_path).values()
+        metadata_list = [entry for entry in entries if entry and "Error" not in entry and "Duplicate Of" not in entry]
+        if metadata_list:
+            SampleMedataListing.save_to_json(metadata_list, SampleMedataListing.subfolder_json_path(subfolder_path))
+            add_to_summary(input_directory, subfolder_path)
+
+    if merged or dropped:
+        # The database is committed first: the index swapped in carries the generation its ids are rows of
+        generation = sampleDatabase.write_library(input_directory, metadata)
+        if replaced:
+            index = sampleIndex.update_index(input_directory, metadata)
+        else:
+            index = sampleIndex.append_to_index(input_directory, metadata, indexed_count)
+        sampleRetrieval.swap_index(input_directory, index, generation)
+        with open(metadata_file + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(metadata_file + ".tmp", metadata_file)
+    return merged
+
+
+def find_library_duplicates(input_directory, fingerprints):
+    """Duplicate entries of the uploaded files (file path -> fingerprint) that duplicate a sample of the
+    library or another upload; the fingerprints are stored in the manifest.
+    """
+    manifest = SampleManifest(input_directory)
+    for file_path, record in fingerprints.items():
+        manifest.set_fingerprint(file_path, record)
+    manifest.save()
+    library = {}
+    for key, entry in manifest.entries.items():
+        file_path = os.path.join(input_directory, key)
+        metadata = entry["metadata"]
+        if metadata and "Error" not in metadata and "Duplicate Of" not in metadata and os.path.exists(file_path):
+            library[file_path] = metadata
+    duplicates = SampleMedataListing.find_duplicates(manifest, list(library) + list(fingerprints), library)
+    return {file_path: duplicates[file_path] for file_path in fingerprints if file_path in duplicates}
+
+
+def manifest_lookup(manifest, subfolder_path):
+    """file path -> stored metadata of the files of a subfolder that the manifest knows about."""
+    return {
+        file_path: manifest.entries[manifest.key(file_path)]["metadata"]
+        for file_path in SampleMedataListing.list_audio_files(subfolder_path)
+        if manifest.key(file_path) in manifest.entries
+    }
+
+
+def add_to_summary(input_directory, subfolder_path):
+    summary_json = os.path.join(input_directory, "summary_samples.json")
+    try:
+        with open(summary_json, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        summary = []
+    subfolder = os.path.basename(subfolder_path)
+    if any(item.get("subfolder") == subfolder for item in summary):
+        return
+    summary.append({
+        "subfolder": subfolder,
+        "file_location": SampleMedataListing.subfolder_json_path(subfolder_path).replace("\\", "/")
+    })
+    with open(summary_json, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4)
+
+
+class IngestQueue:
+    """Background analysis and indexing of uploaded samples."""
+
+    def __init__(self, input_directory, max_workers=1):
+        self.input_directory = input_directory
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sample-ingest")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, file_paths):
+        """Queue the analysis of file_paths and return the job."""
+        job = IngestJob(file_paths)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._forget_finished_jobs()
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def _forget_finished_jobs(self):
+        finished = sorted((job for job in self.jobs.values() if job.finished), key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job.id]
+
+    def _run(self, job):
+        job.status = "analysing"
+        try:
+            file_paths = job.file_paths
+            # One process: the web server keeps its cores, and YAMNet runs in the shared inference worker
+            results = SampleMedataListing.analyse_files(file_paths, workers=1)
+            fingerprints = SampleMedataListing.take_fingerprints(file_paths, results)
+            analysed = dict(zip(file_paths, results))
+            job.errors = {
+                os.path.basename(file_path): entry["Error"] for file_path, entry in analysed.items() if "Error" in entry
+            }
+
+            duplicates = {}
+            if Config.SAMPLE_DEDUP:
+                with SampleMedataListing.library_lock:
+                    duplicates = find_library_duplicates(self.input_directory, fingerprints)
+            job.duplicates = {os.path.basename(file_path): entry["Duplicate Of"] for file_path, entry in duplicates.items()}
+            analysed.update(duplicates)
+            job.status = "indexing"
+            with SampleMedataListing.library_lock:
+                job.added = merge_into_library(self.input_directory, analysed)
+            job.status = "done"
+            logger.info(f"Ingest job {job.id}: {len(job.added)} samples added, {len(job.errors)} failed")
+        except Exception as e:
+            logger.error(f"Ingest job {job.id} failed: {e}")
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(input_directory):
+    with _queues_lock:
+        if input_directory not in _queues:
+            _queues[input_directory] = IngestQueue(input_directory, Config.SAMPLE_INGEST_WORKERS)
+        return _queues[input_directory]
@@ -0,0 +1,103 @@
+'''
+This file contains the SampleManifest class that remembers which sample files have been analysed,
+so the sample metadata listing only needs to re-analyse new or changed files.
+'''
+import os
+import json
+import hashlib
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(file_path):
+    """Content hash of a file, read in chunks so large samples are never fully loaded."""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SampleManifest:
+    def __init__(self, input_directory, file_name='sample_manifest.json'):
+        self.input_directory = input_directory
+        self.manifest_file = os.path.join(input_directory, file_name)
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """Load the manifest from disk; a missing or outdated manifest simply starts empty."""
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.entries = data.get("files", {})
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def save(self):
+        tmp_file = self.manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.entries}, f)
+        os.replace(tmp_file, self.manifest_file)
+
+    def key(self, file_path):
+        """Manifest key of a file: its path relative to the samples directory, with forward slashes."""
+        return os.path.relpath(file_path, self.input_directory).replace("\\", "/")
+
+    def cached_metadata(self, file_path):
+        """Return the stored metadata when the file is unchanged, otherwise None.
+
+        Size and mtime are compared first; the content hash is only computed when they differ,
+        so a touched-but-identical file is not analysed again.
+        """
+        entry = self.entries.get(self.key(file_path))
+        if entry is None or entry["metadata"] is None:
+            return None
+        stat = os.stat(file_path)
+        if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+            return entry["metadata"]
+        if entry["size"] == stat.st_size and entry["hash"] == file_hash(file_path):
+            entry["mtime"] = stat.st_mtime_ns
+            return entry["metadata"]
+        return None
+
+    def update(self, file_path, metadata):
+        stat = os.stat(file_path)
+        fingerprint = self.fingerprint(file_path)
+        self.entries[self.key(file_path)] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": file_hash(file_path),
+            "metadata": metadata,
+        }
+        if fingerprint is not None:
+            self.entries[self.key(file_path)]["fingerprint"] = fingerprint
+
+    def fingerprint(self, file_path):
+        """Stored fingerprint (see sampleFingerprint) of an unchanged file, otherwise None."""
+        entry = self.entries.get(self.key(file_path))
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return None
+        return entry.get("fingerprint")
+
+    def set_fingerprint(self, file_path, fingerprint):
+        """Store the fingerprint of a file; a new or changed file gets an entry without metadata."""
+        entry = self.entries.get(self.key(file_path))
+        stat = os.stat(file_path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(file_path), "metadata": None}
+            self.entries[self.key(file_path)] = entry
+        entry["fingerprint"] = fingerprint
+
+    def prune(self, file_paths):
+        """Drop entries of files that no longer exist and return their keys."""
+        present = {self.key(file_path) for file_path in file_paths}
+        removed = [key for key in self.entries if key not in present]
+        for key in removed:
+            del self.entries[key]
+        return removed
@@ -0,0 +1,115 @@
+'''
+This file contains the waveform peak cache of the sample library.
+
+When a sample is analysed, a min/max pyramid of its waveform is stored in the `.peaks` folder next to it:
+level 0 holds the minimum and maximum of every SAMPLES_PER_PEAK samples as 16-bit integers, every next level
+merges pairs of peaks of the previous one, down to MIN_PEAKS peaks or fewer. The sample browser draws a
+waveform from the level that matches its width without downloading or decoding the audio.
+
+Levels are served in the audiowaveform .dat format (version 1, 16-bit): a header of five little-endian
+int32 values (version, flags, sample rate, samples per peak, number of peaks) followed by min/max pairs.
+'''
+import os
+import struct
+import logging
+import librosa
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PEAKS_DIRECTORY = '.peaks'
+SAMPLES_PER_PEAK = 256
+MIN_PEAKS = 64
+PEAK_SCALE = 32767
+DAT_VERSION = 1
+DAT_FLAGS = 0  # 16-bit peaks
+
+
+class PeakBuilder:
+    """Level 0 peaks of a signal that is fed block by block (see audioFeatures.stream_measure)."""
+
+    def __init__(self):
+        self.carry = np.zeros(0, dtype=np.float32)
+        self.mins = []
+        self.maxs = []
+
+    def add(self, y):
+        y = np.concatenate([self.carry, y]) if len(self.carry) else np.asarray(y, dtype=np.float32)
+        whole = len(y) // SAMPLES_PER_PEAK * SAMPLES_PER_PEAK
+        if whole:
+            frames = y[:whole].reshape(-1, SAMPLES_PER_PEAK)
+            self.mins.append(frames.min(axis=1))
+            self.maxs.append(frames.max(axis=1))
+        self.carry = y[whole:].copy()
+
+    def levels(self):
+        """The pyramid of peaks, finest level first, each level an (n, 2) int16 array of min/max pairs."""
+        mins = self.mins + ([np.array([self.carry.min()])] if len(self.carry) else [])
+        maxs = self.maxs + ([np.array([self.carry.max()])] if len(self.carry) else [])
+        if not mins:
+            return [np.zeros((0, 2), dtype=np.int16)]
+        peaks = np.stack([np.concatenate(mins), np.concatenate(maxs)], axis=1)
+        levels = [np.round(np.clip(peaks, -1, 1) * PEAK_SCALE).astype(np.int16)]
+        while len(levels[-1]) > MIN_PEAKS:
+            level = levels[-1]
+            if len(level) % 2:
+                level = np.concatenate([level, level[-1:]])
+            levels.append(np.stack([np.minimum(level[0::2, 0], level[1::2, 0]),
+                                    np.maximum(level[0::2, 1], level[1::2, 1])], axis=1))
+        return levels
+
+
+def compute_levels(y):
+    builder = PeakBuilder()
+    builder.add(y)
+    return builder.levels()
+
+
+def peaks_path(file_path):
+    return os.path.join(os.path.dirname(file_path), PEAKS_DIRECTORY, os.path.basename(file_path) + ".npz")
+
+
+def save_peaks(file_path, levels, sr):
+    path = peaks_path(file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {f"level_{i}": level for i, level in enumerate(levels)}
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, header=np.array([sr, SAMPLES_PER_PEAK], dtype=np.int64), **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def remove_peaks(file_path):
+    try:
+        os.remove(peaks_path(file_path))
+    except FileNotFoundError:
+        pass
+
+
+def load_peaks(file_path, width=None, level=None):
+    """(sample rate, samples per peak, peaks) of one level of the cached pyramid of file_path.
+
+    `level` selects a level by index (0 is the finest); otherwise the coarsest level with at least `width`
+    peaks is used (the finest when width is None or larger than every level). The cache is computed first
+    when it is missing or older than the sample.
+    """
+    path = peaks_path(file_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(file_path):
+        y, sr = librosa.load(file_path, sr=None)
+        save_peaks(file_path, compute_levels(y), sr)
+
+    with np.load(path) as cache:
+        sr, samples_per_peak = (int(value) for value in cache["header"])
+        count = len(cache.files) - 1
+        if level is None:
+            level = 0
+            if width:
+                sizes = [len(cache[f"level_{i}"]) for i in range(count)]
+                level = max([i for i, size in enumerate(sizes) if size >= width], default=0)
+        level = min(max(int(level), 0), count - 1)
+        return sr, samples_per_peak * 2 ** level, cache[f"level_{level}"]
+
+
+def to_dat(sr, samples_per_peak, peaks):
+    """Peaks in the audiowaveform .dat format."""
+    header = struct.pack("<5i", DAT_VERSION, DAT_FLAGS, sr, samples_per_peak, len(peaks))
+    return header + peaks.astype("<i2").tobytes()
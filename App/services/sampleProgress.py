@@ -0,0 +1,146 @@
+'''
+This file contains the in-process progress channel of the sample metadata listing.
+
+The listing reports every analysed file and the time spent per stage (fingerprint, decode, features, YAMNet,
+embed); subscribers (the Socket.IO connection, server-sent event streams) receive a snapshot with the
+progress, throughput and ETA whenever it changes, at most every `min_interval` seconds.
+'''
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("fingerprint", "decode", "features", "yamnet", "embed")
+ANALYSIS_SHARE = 90  # percentage of the progress bar covered by the analysis of the files
+
+
+class IndexingProgress:
+    """Progress of the current (or last) sample listing run."""
+
+    def __init__(self, min_interval=0.25):
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.last_published = 0.0
+        self.reset()
+
+    def reset(self):
+        self.running = False
+        self.stage = "idle"
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.started = None
+        self.analysis_started = None
+        self.finished = None
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.error = None
+
+    def subscribe(self, callback):
+        """Call callback(snapshot) on every published update; returns callback for unsubscribe."""
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def start(self):
+        """Start reporting a new run; returns False (and keeps the counters) while a run is already running."""
+        with self.lock:
+            if self.running:
+                return False
+            self.reset()
+            self.running = True
+            self.stage = "scanning"
+            self.started = time.time()
+        self.publish(force=True)
+        return True
+
+    def start_analysis(self, file_sizes):
+        """file_sizes: size in bytes of every file that is going to be analysed."""
+        with self.lock:
+            self.stage = "analysing"
+            self.files_total = len(file_sizes)
+            self.bytes_total = sum(file_sizes)
+            self.analysis_started = time.time()
+        self.publish(force=True)
+
+    def file_done(self, size):
+        with self.lock:
+            self.files_done += 1
+            self.bytes_done += size
+        self.publish()
+
+    def add_timings(self, timings):
+        """Add seconds spent per stage (summed over all analysis processes)."""
+        with self.lock:
+            for stage, seconds in timings.items():
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        self.publish()
+
+    def set_stage(self, stage):
+        with self.lock:
+            self.stage = stage
+        self.publish(force=True)
+
+    def finish(self, error=None):
+        with self.lock:
+            self.running = False
+            self.stage = "error" if error else "done"
+            self.error = error
+            self.finished = time.time()
+        self.publish(force=True)
+
+    def snapshot(self):
+        with self.lock:
+            now = self.finished or time.time()
+            analysis_seconds = now - self.analysis_started if self.analysis_started else 0.0
+            files_per_sec = self.files_done / analysis_seconds if analysis_seconds > 0 else 0.0
+            bytes_per_sec = self.bytes_done / analysis_seconds if analysis_seconds > 0 else 0.0
+            remaining = self.files_total - self.files_done
+            eta = remaining / files_per_sec if files_per_sec > 0 and self.running else None
+
+            if self.stage == "done":
+                progress = 100.0
+            elif self.files_total:
+                progress = ANALYSIS_SHARE * self.files_done / self.files_total
+            else:
+                progress = ANALYSIS_SHARE if self.stage in ("writing", "embedding") else 0.0
+
+            return {
+                "running": self.running,
+                "stage": self.stage,
+                "progress": round(progress, 2),
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "files_per_sec": round(files_per_sec, 3),
+                "bytes_per_sec": round(bytes_per_sec),
+                "eta_seconds": round(eta, 1) if eta is not None else None,
+                "elapsed_seconds": round(now - self.started, 2) if self.started else 0.0,
+                "stage_seconds": {stage: round(seconds, 3) for stage, seconds in self.stage_seconds.items()},
+                "error": self.error,
+            }
+
+    def publish(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_published < self.min_interval:
+                return
+            self.last_published = now
+            subscribers = list(self.subscribers)
+        snapshot = self.snapshot()
+        for callback in subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.warning(f"Progress subscriber failed: {e}")
+
+
+progress = IndexingProgress()
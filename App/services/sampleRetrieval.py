@@ -0,0 +1,128 @@
+'''
+This file contains the sample retrieval service used by the Sampling phase.
+
+One SampleRetriever per sample library keeps the sample index in memory and shares the embedding model of the
+process (see sampleIndex.load_embedding_model), both loaded on first use or by warm_up. A query then costs
+one embedding and one index search. When the library is re-indexed in this process the new index is swapped in
+as a whole (see swap_index); an index file replaced by another process is picked up on the next query.
+Queries from several threads are safe: the index reference is replaced atomically and the search knobs of an
+index are only changed under its lock.
+
+The ids of the index are rows of one generation of the sample database (see sampleDatabase), which every
+loaded index carries: the one the writer committed before swapping the index in, or for an index file the
+generation of the database when it was loaded, if their sizes match (None otherwise). Entries are read for
+the rows found with that generation, so a pair of index and database that do not match is never mixed up.
+'''
+import os
+import time
+import logging
+import threading
+import faiss
+from App.services import sampleIndex
+from App.services import sampleDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class LoadedIndex:
+    """A sample index with the file state it was loaded from and the database generation its ids are rows of."""
+
+    def __init__(self, index, stat, generation):
+        self.index = index
+        self.stat = stat
+        self.generation = generation
+        self.lock = threading.Lock()
+
+
+def index_stat(index_file):
+    try:
+        stat = os.stat(index_file)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class SampleRetriever:
+    """Shared embedding model and sample index of one sample library."""
+
+    def __init__(self, input_directory):
+        self.input_directory = input_directory
+        self.index_file = os.path.join(input_directory, sampleIndex.INDEX_FILE)
+        self.loaded = None
+        self.load_lock = threading.Lock()
+
+    def get_index(self):
+        """The current index (None when the library has not been indexed), reloaded when its file changed."""
+        loaded = self.loaded
+        stat = index_stat(self.index_file)
+        if loaded is not None and loaded.stat == stat:
+            return loaded
+        with self.load_lock:
+            loaded = self.loaded
+            if loaded is not None and loaded.stat == stat:
+                return loaded
+            if stat is None:
+                self.loaded = None
+                return None
+            started = time.perf_counter()
+            index = faiss.read_index(self.index_file)
+            database = sampleDatabase.open_database(self.input_directory)
+            generation, sample_count = database.state() if database is not None else (None, 0)
+            if index.ntotal != sample_count:
+                logger.info("Sample index does not match the sample metadata, please re-run the sample metadata listing")
+                generation = None
+            loaded = LoadedIndex(index, stat, generation)
+            self.loaded = loaded
+            logger.info(f"Sample index loaded: {index.ntotal} samples in {time.perf_counter() - started:.2f}s")
+            return loaded
+
+    def swap_index(self, index, generation):
+        """Serve index from now on; called once the database generation the index was built for is committed
+        and the index file written."""
+        with self.load_lock:
+            self.loaded = LoadedIndex(index, index_stat(self.index_file), generation) if index is not None else None
+
+    def sample_count(self):
+        loaded = self.get_index()
+        return loaded.index.ntotal if loaded is not None else 0
+
+    def search(self, query, k, loaded=None):
+        """(row, score) pairs of the k samples nearest to the query text, best first, in loaded (by default the
+        current index)."""
+        loaded = loaded or self.get_index()
+        if loaded is None:
+            return []
+        query_embedding = sampleIndex.encode_query(sampleIndex.load_embedding_model(), query)
+        with loaded.lock:
+            return sampleIndex.search(loaded.index, query_embedding, k)
+
+    def warm_up(self):
+        """Load the embedding model and the index and run one query, so the first real query is fast."""
+        started = time.perf_counter()
+        self.search("warm up", 1)
+        logger.info(f"Sample retrieval warmed up in {time.perf_counter() - started:.2f}s")
+
+
+_retrievers = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(input_directory):
+    with _retrievers_lock:
+        retriever = _retrievers.get(input_directory)
+        if retriever is None:
+            retriever = SampleRetriever(input_directory)
+            _retrievers[input_directory] = retriever
+        return retriever
+
+
+def swap_index(input_directory, index, generation):
+    get_retriever(input_directory).swap_index(index, generation)
+
+
+def warm_up(input_directory):
+    """Warm up the retriever of input_directory; failures are logged, the first query then loads lazily."""
+    try:
+        get_retriever(input_directory).warm_up()
+    except Exception as e:
+        logger.warning(f"Sample retrieval warm-up failed: {e}")
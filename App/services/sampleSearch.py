@@ -0,0 +1,153 @@
+'''
+This file contains the search engine behind /api/sample/search.
+
+It is built from the sample database (see sampleDatabase) and rebuilt only when a new generation of the
+database is written, i.e. when the library changes. Query words are looked up in an inverted index of the
+tags, description and filename of every sample (the last word also as a prefix, for search-as-you-type);
+every word must match. Samples are ranked by the IDF of the matched words, weighted by field. BPM and
+duration ranges are evaluated on NumPy columns, the key and track type on columns of label codes. The
+entries of the results are read back from the generation of the sample database the index was built from.
+'''
+import re
+import math
+import bisect
+import logging
+import threading
+import numpy as np
+from App.services import sampleDatabase
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {"tags": 3.0, "filename": 2.0, "description": 1.0}
+TOKEN_PATTERN = re.compile(r"[a-z0-9#]+")
+MAX_PREFIX_EXPANSIONS = 500
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def sample_fields(item):
+    return {
+        "tags": " ".join(item.get("Tags", [])),
+        "filename": item.get("Filename", ""),
+        "description": item.get("Description", ""),
+    }
+
+
+def label_column(records, field):
+    """(sorted labels, int16 code of every record) of a metadata field; a missing field is "Unknown"."""
+    labels = sorted({item.get(field, "Unknown") for item in records})
+    positions = {label: i for i, label in enumerate(labels)}
+    return labels, np.array([positions[item.get(field, "Unknown")] for item in records], dtype=np.int16)
+
+
+class SampleSearchIndex:
+    """Inverted index and filter columns of one generation of the sample database."""
+
+    def __init__(self, records, generation):
+        self.generation = generation
+        self.count = len(records)
+        self.bpm = np.array([item.get("BPM", np.nan) for item in records], dtype=np.float64)
+        self.duration = np.array([item.get("Duration", np.nan) for item in records], dtype=np.float64)
+        self.key_names, self.keys = label_column(records, "Key")
+        self.track_type_names, self.track_types = label_column(records, "Track Type")
+        postings = {field: {} for field in FIELD_WEIGHTS}
+        for row, item in enumerate(records):
+            for field, text in sample_fields(item).items():
+                for token in set(tokenize(text)):
+                    postings[field].setdefault(token, []).append(row)
+        self.postings = {
+            field: {token: np.array(rows, dtype=np.int32) for token, rows in tokens.items()}
+            for field, tokens in postings.items()
+        }
+        self.vocabulary = sorted({token for tokens in self.postings.values() for token in tokens})
+        self.idf = {}
+        for token in self.vocabulary:
+            rows = [self.postings[field][token] for field in FIELD_WEIGHTS if token in self.postings[field]]
+            self.idf[token] = math.log(1 + len(records) / len(np.unique(np.concatenate(rows))))
+
+    def expand(self, word, prefix):
+        """Indexed tokens matching a query word: the word itself, or every token it is a prefix of."""
+        if not prefix:
+            return [word] if word in self.idf else []
+        start = bisect.bisect_left(self.vocabulary, word)
+        end = bisect.bisect_left(self.vocabulary, word + "\uffff")
+        return self.vocabulary[start:min(end, start + MAX_PREFIX_EXPANSIONS)]
+
+    def search(self, query="", bpm=None, duration=None, key=None, track_type=None, offset=0, limit=50):
+        """Rows of the samples matching the query words and filters, best first, as (total, rows of the page).
+
+        bpm and duration are (low, high) ranges, either bound may be None (samples without a value never
+        match a range); key is an exact label as it appears in the metadata ("A minor"), track_type the start
+        of one in any case ("instrumental" for "Instrumentals Only").
+        """
+        mask = np.ones(self.count, dtype=bool)
+        for column, bounds in ((self.bpm, bpm), (self.duration, duration)):
+            low, high = bounds if bounds is not None else (None, None)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+        if key is not None:
+            if key not in self.key_names:
+                return 0, []
+            mask &= self.keys == self.key_names.index(key)
+        if track_type is not None:
+            matching = [i for i, name in enumerate(self.track_type_names) if name.lower().startswith(track_type.lower())]
+            if not matching:
+                return 0, []
+            mask &= np.isin(self.track_types, matching)
+
+        words = tokenize(query)
+        scores = np.zeros(self.count)
+        for i, word in enumerate(words):
+            # The word being typed (the last one, without trailing space) also matches as a prefix
+            tokens = self.expand(word, prefix=i == len(words) - 1 and not query[-1:].isspace())
+            matched = np.zeros(self.count, dtype=bool)
+            for token in tokens:
+                for field, weight in FIELD_WEIGHTS.items():
+                    rows = self.postings[field].get(token)
+                    if rows is not None:
+                        matched[rows] = True
+                        scores[rows] += weight * self.idf[token]
+            mask &= matched
+
+        rows = np.flatnonzero(mask)
+        if words:
+            rows = rows[np.argsort(-scores[rows], kind="stable")]
+        return len(rows), rows[offset:offset + limit].tolist()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_search_index(input_directory):
+    """Search index of the current generation of the sample database of input_directory (None without sample
+    metadata)."""
+    database = sampleDatabase.open_database(input_directory)
+    if database is None:
+        return None
+    generation = database.generation()
+    with _indexes_lock:
+        index = _indexes.get(input_directory)
+        if index is None or index.generation != generation:
+            generation, records = database.snapshot()
+            index = SampleSearchIndex(records, generation)
+            _indexes[input_directory] = index
+            logger.info(f"Sample search index built: {index.count} samples, {len(index.vocabulary)} words")
+        return index
+
+
+def search(input_directory, query="", offset=0, limit=50, **filters):
+    """(total, metadata entries of the page) of the samples matching query and filters (see SampleSearchIndex.search)."""
+    for _ in range(sampleDatabase.READ_ATTEMPTS):
+        index = get_search_index(input_directory)
+        if index is None:
+            return 0, []
+        total, rows = index.search(query, offset=offset, limit=limit, **filters)
+        records = sampleDatabase.open_database(input_directory).records(rows, generation=index.generation)
+        if records is not None:
+            return total, records
+    raise RuntimeError("The sample library kept changing during the search")
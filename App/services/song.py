@@ -3,13 +3,16 @@ This file contains the Song class that represents a song and handles the creatio
 '''
 import os
 import re
+import uuid
 
 from typing_extensions import final
 
 from .songCreationData import SongCreationData
 class Song:
-    def __init__(self, name, logger):
+    def __init__(self, name, logger, song_id=None):
         self.name = name
+        # Identity of the song, whatever its name; a retried or restarted run of the song passes it back
+        self.song_id = song_id or uuid.uuid4().hex
         self.song_dir = ""
         self.logger = logger
         self.draft_count = 1
@@ -26,12 +29,9 @@ class Song:
         project_root = os.path.abspath(os.path.join(current_dir, '..', '..'))
 
         songs_directory = os.path.join(project_root, 'Songs')
-        if not os.path.exists(songs_directory):
-            os.makedirs(songs_directory)
-        # Create the subdirectory for the song
+        # Create the subdirectory for the song (the cover art step may be creating it at the same time)
         song_directory = os.path.join(songs_directory, self.name)
-        if not os.path.exists(song_directory):
-           os.makedirs(song_directory)
+        os.makedirs(song_directory, exist_ok=True)
 
         header = f"# --{self.name.upper()}-- \n# Generated by mITy.John music's agency. \n\n"
         if not song_creation_data.sonicpi_code.startswith(header):
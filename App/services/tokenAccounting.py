@@ -0,0 +1,138 @@
+'''
+This file contains the token accounting of the LLM calls: the prompt size estimates behind the token limit
+checks and the token counts behind the cost of every call.
+
+Estimates are cheap. Tiktoken encodings are created once per model, and the count of every message is cached
+under a hash of its text (the cache holds no message text), so checking a growing conversation again only
+encodes its new messages. OpenAI and Azure OpenAI
+prompts are counted with the model's encoding plus the framing the chat format adds per message. Anthropic
+models do not use a tiktoken encoding, so their prompts are estimated from their length in characters.
+
+After every call the usage reported by the provider is what the cost is based on. The ratio between the
+reported prompt tokens and the estimate is tracked per model, as a moving average, and corrects later
+estimates.
+'''
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+FALLBACK_ENCODING = "o200k_base"
+TOKENS_PER_MESSAGE = 3  # role and separators of every message in the chat format
+TOKENS_PER_REPLY = 3  # every reply is primed with the assistant role
+CHARS_PER_TOKEN = 3.5  # Anthropic models, before any usage was reported
+CORRECTION_SMOOTHING = 0.3
+MESSAGE_CACHE_SIZE = 4096
+
+_corrections = {}
+_corrections_lock = threading.Lock()
+_counts = OrderedDict()  # (model, digest of a text) -> tokens, least recently used first
+_counts_lock = threading.Lock()
+
+
+def uses_tiktoken(provider):
+    return provider in ("openai", "azure")
+
+
+@lru_cache(maxsize=None)
+def encoding_for(model):
+    import tiktoken  # only OpenAI and Azure OpenAI prompts are counted with an encoding
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(FALLBACK_ENCODING)
+
+
+def _tiktoken_count(model, text):
+    key = (model, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest())
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+    count = len(encoding_for(model).encode(text, disallowed_special=()))
+    with _counts_lock:
+        _counts[key] = count
+        while len(_counts) > MESSAGE_CACHE_SIZE:
+            _counts.popitem(last=False)
+    return count
+
+
+def count_text(provider, model, text):
+    """Tokens of text for a model of provider, without correction."""
+    if uses_tiktoken(provider):
+        return _tiktoken_count(model, text)
+    return int(round(len(text) / CHARS_PER_TOKEN))
+
+
+def message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):  # content blocks
+        content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content
+
+
+def count_messages(provider, model, messages, system=None):
+    """Prompt tokens of a conversation (plus a separate system prompt, as Anthropic takes it), without correction."""
+    total = count_text(provider, model, system) if system else 0
+    for message in messages:
+        total += count_text(provider, model, message_text(message))
+        if uses_tiktoken(provider):
+            total += TOKENS_PER_MESSAGE
+    return total + (TOKENS_PER_REPLY if uses_tiktoken(provider) else 0)
+
+
+def correction(provider, model):
+    return _corrections.get((provider, model), 1.0)
+
+
+def estimate_prompt(provider, model, messages, system=None):
+    """Estimated prompt tokens of a conversation, corrected by the usage reported for earlier calls."""
+    return int(round(count_messages(provider, model, messages, system) * correction(provider, model)))
+
+
+def usage_counts(usage):
+    """(prompt tokens, completion tokens) of the usage of an OpenAI or Anthropic response, or None."""
+    if usage is None:
+        return None
+    prompt = getattr(usage, "prompt_tokens", None)
+    if prompt is None:
+        prompt = getattr(usage, "input_tokens", None)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion is None:
+        completion = getattr(usage, "output_tokens", None)
+    if prompt is None or completion is None:
+        return None
+    return prompt, completion
+
+
+def reconcile(provider, model, messages, response_text, usage, system=None):
+    """Token counts of a finished call, from the usage the provider reported (estimated when it reported none).
+
+    Returns a dict with prompt_tokens, completion_tokens, total_tokens, the uncorrected estimate of the prompt
+    and whether the counts were reported by the provider.
+    """
+    estimated = count_messages(provider, model, messages, system)
+    counts = usage_counts(usage)
+    if counts is not None:
+        prompt_tokens, completion_tokens = counts
+        if estimated > 0 and prompt_tokens > 0:
+            with _corrections_lock:
+                previous = _corrections.get((provider, model))
+                ratio = prompt_tokens / estimated
+                _corrections[(provider, model)] = ratio if previous is None else \
+                    previous + CORRECTION_SMOOTHING * (ratio - previous)
+    else:
+        logger.info(f"No token usage reported by {provider} for {model}, using estimates")
+        prompt_tokens = int(round(estimated * correction(provider, model)))
+        completion_tokens = count_text(provider, model, response_text or "")
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated_prompt_tokens": estimated,
+        "reported": counts is not None,
+    }
@@ -0,0 +1,251 @@
+'''
+This file contains the YAMNet engine used to classify samples and the long-lived worker process hosting it.
+
+The web process never imports TensorFlow: the first classification starts the worker, which loads YAMNet once
+and answers requests over a local, authenticated multiprocessing connection. The worker can be restarted on
+its own (see YamnetWorkerClient.restart). Sample analysis pool workers load their own engine instead.
+'''
+import os
+import csv
+import math
+import atexit
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "inc", "yamnet-tensorflow2-yamnet-v1")
+CLASS_MAP_PATH = os.path.join(MODEL_PATH, "assets", "yamnet_class_map.csv")
+
+YAMNET_SAMPLE_RATE = 16000
+YAMNET_HOP_SAMPLES = 7680  # 0.48s between two YAMNet frames
+YAMNET_WINDOW_SAMPLES = 15600  # 0.96s frame, including the STFT window
+YAMNET_BATCH_SAMPLES = YAMNET_SAMPLE_RATE * 600  # at most 10 minutes of audio per inference call
+
+
+def yamnet_frame_count(num_samples):
+    """Number of frames YAMNet produces for a waveform of num_samples (it zero-pads to whole frames)."""
+    return 1 + max(0, math.ceil((num_samples - YAMNET_WINDOW_SAMPLES) / YAMNET_HOP_SAMPLES))
+
+
+class YamnetEngine:
+    """YAMNet loaded in the current process."""
+
+    def __init__(self):
+        import tensorflow as tf  # only processes that run inference pay for TensorFlow
+        self.tf = tf
+        self.model = tf.saved_model.load(MODEL_PATH)
+        with open(CLASS_MAP_PATH, "r") as f:
+            # Row i of the class map (after its header) names score column i
+            self.class_names = [row["display_name"] for row in csv.DictReader(f)]
+
+    def class_name(self, index):
+        """Tag for a YAMNet class: the last part of its display name."""
+        return self.class_names[index].split(",")[-1].strip().replace('"', '')
+
+    def _classify_batch(self, waveforms, pooling):
+        """Run YAMNet once over several waveforms laid out back to back.
+
+        Every waveform starts on a frame boundary and is followed by enough silence that no frame
+        covers two waveforms, so the frames of each clip are exactly those of a standalone call.
+        """
+        parts = []
+        clips = []  # (first frame, frame count) per waveform
+        position = 0
+        for waveform in waveforms:
+            frames = yamnet_frame_count(len(waveform))
+            slot = np.zeros((frames + 2) * YAMNET_HOP_SAMPLES, dtype=np.float32)
+            slot[:len(waveform)] = waveform
+            parts.append(slot)
+            clips.append((position // YAMNET_HOP_SAMPLES, frames))
+            position += len(slot)
+
+        scores, embeddings, spectrogram = self.model(self.tf.convert_to_tensor(np.concatenate(parts)))
+        scores = scores.numpy()
+
+        results = []
+        for first, frames in clips:
+            clip_scores = scores[first:first + frames]
+            pooled = clip_scores.max(axis=0) if pooling == "max" else clip_scores.mean(axis=0)
+            top_5_indices = np.argsort(pooled)[::-1][:5]
+            results.append([(self.class_name(i), float(pooled[i])) for i in top_5_indices])
+        return results
+
+    def classify_waveforms(self, waveforms, pooling="mean"):
+        """Classify many 16kHz mono waveforms with as few YAMNet calls as possible.
+
+        Scores are pooled ("mean" or "max") over all frames of a clip, so the top 5 classes describe
+        the whole sample rather than its first second.
+        """
+        results = []
+        batch = []
+        batch_samples = 0
+        for waveform in list(waveforms) + [None]:
+            if batch and (waveform is None or batch_samples + len(waveform) > YAMNET_BATCH_SAMPLES):
+                try:
+                    results.extend(self._classify_batch(batch, pooling))
+                except Exception as e:
+                    logger.error(f"YAMNet classification failed: {e}")
+                    results.extend([("Error", 0.0)] for _ in batch)
+                batch = []
+                batch_samples = 0
+            if waveform is not None:
+                batch.append(waveform)
+                batch_samples += len(waveform)
+        return results
+
+
+def _handle_connection(engine, engine_lock, connection):
+    """Answer the requests of one client until it disconnects."""
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                return
+            command = request[0]
+            try:
+                if command == "classify":
+                    with engine_lock:
+                        connection.send(("ok", engine.classify_waveforms(request[1], request[2])))
+                elif command == "ping":
+                    connection.send(("ok", os.getpid()))
+                elif command == "shutdown":
+                    connection.send(("ok", None))
+                    os._exit(0)
+                else:
+                    connection.send(("error", f"Unknown command: {command}"))
+            except Exception as e:
+                connection.send(("error", str(e)))
+
+
+def serve(ready_connection, authkey):
+    """Worker process entry point: load YAMNet, report the listening address and serve forever."""
+    engine = YamnetEngine()
+    engine_lock = threading.Lock()
+    with Listener(("localhost", 0), authkey=authkey) as listener:
+        ready_connection.send(listener.address)
+        ready_connection.close()
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_handle_connection, args=(engine, engine_lock, connection), daemon=True).start()
+
+
+class YamnetWorkerClient:
+    """Connection to the YAMNet worker process, which is started on first use."""
+
+    def __init__(self, start_timeout=300):
+        self.start_timeout = start_timeout
+        self.authkey = os.urandom(16)
+        self.process = None
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        if self.process is not None and self.process.is_alive() and self.connection is not None:
+            return
+        self._stop()
+        logger.info("Starting YAMNet worker process")
+        context = multiprocessing.get_context("spawn")
+        ready_reader, ready_writer = context.Pipe(duplex=False)
+        self.process = context.Process(target=serve, args=(ready_writer, self.authkey), name="yamnet-worker", daemon=True)
+        self.process.start()
+        ready_writer.close()
+        try:
+            if not ready_reader.poll(self.start_timeout):
+                raise RuntimeError("YAMNet worker did not start in time")
+            address = ready_reader.recv()
+        except EOFError:
+            raise RuntimeError("YAMNet worker exited while loading the model")
+        finally:
+            ready_reader.close()
+        self.connection = Client(address, authkey=self.authkey)
+        logger.info(f"YAMNet worker running (pid {self.process.pid})")
+
+    def _stop(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except OSError:
+                pass
+            self.connection = None
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join(timeout=10)
+            self.process = None
+
+    def request(self, *message):
+        """Send a request to the worker, restarting it once if it went away."""
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    self._start()
+                    self.connection.send(message)
+                    status, payload = self.connection.recv()
+                    break
+                except (EOFError, OSError) as e:
+                    logger.warning(f"YAMNet worker connection lost: {e}")
+                    self._stop()
+                    if attempt:
+                        raise RuntimeError(f"YAMNet worker unavailable: {e}")
+        if status == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def classify_waveforms(self, waveforms, pooling="mean"):
+        return self.request("classify", [np.asarray(waveform, dtype=np.float32) for waveform in waveforms], pooling)
+
+    def status(self):
+        running = self.process is not None and self.process.is_alive()
+        return {"running": running, "pid": self.process.pid if running else None}
+
+    def restart(self):
+        """Stop the worker; the next request starts a fresh one."""
+        with self.lock:
+            self._stop()
+
+    def stop(self):
+        with self.lock:
+            self._stop()
+
+
+_client = None
+_client_lock = threading.Lock()
+_local_engine = None
+_local_engine_error = None
+
+
+def use_local_engine():
+    """Load YAMNet inside this process (analysis pool workers) instead of using the shared worker.
+
+    When loading fails, the error is raised and every later classification in this process fails with it.
+    """
+    global _local_engine, _local_engine_error
+    if _local_engine is None:
+        try:
+            _local_engine = YamnetEngine()
+        except Exception as e:
+            _local_engine_error = str(e)
+            raise
+    return _local_engine
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = YamnetWorkerClient()
+            atexit.register(_client.stop)
+        return _client
+
+
+def classify_waveforms(waveforms, pooling="mean"):
+    """Classify 16kHz mono waveforms with the local engine if this process has one, else via the worker."""
+    if _local_engine is None and _local_engine_error is not None:
+        raise RuntimeError(f"YAMNet unavailable: {_local_engine_error}")
+    classifier = _local_engine if _local_engine is not None else get_client()
+    return classifier.classify_waveforms(waveforms, pooling)
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+import soundfile as sf
+from App.services import audioFeatures
+from App.services import SampleMedataListing
+from App.benchmarks.corpus import MAJOR_STEPS, MINOR_STEPS, synth_sample
+
+SR = 44100
+TAGS = ("tempo_category", "brightness", "energy", "dynamic_range", "key")
+
+
+def reference_key(chroma_mean):
+    """Key detection as it was written before vectorisation: two loops of np.correlate."""
+    if np.max(chroma_mean) == 0:
+        return "Unknown"
+    chroma_mean = chroma_mean / np.max(chroma_mean)
+    major_scores = [np.correlate(chroma_mean, np.roll(audioFeatures.MAJOR_TEMPLATE, i))[0] for i in range(12)]
+    minor_scores = [np.correlate(chroma_mean, np.roll(audioFeatures.MINOR_TEMPLATE, i))[0] for i in range(12)]
+    best_major = np.argmax(major_scores)
+    best_minor = np.argmax(minor_scores)
+    if major_scores[best_major] > minor_scores[best_minor]:
+        return f"{audioFeatures.KEY_NAMES[best_major]} major"
+    return f"{audioFeatures.KEY_NAMES[best_minor]} minor"
+
+
+class TestKeyFromChroma(unittest.TestCase):
+    def test_matches_loop_implementation(self):
+        rng = np.random.default_rng(0)
+        vectors = [rng.random(12) for _ in range(200)]
+        vectors += [np.eye(12)[i] for i in range(12)]  # single notes tie between many keys
+        vectors += [np.roll(audioFeatures.MAJOR_TEMPLATE, i).astype(float) for i in range(12)]
+        vectors += [np.roll(audioFeatures.MINOR_TEMPLATE, i).astype(float) for i in range(12)]
+        for chroma_mean in vectors:
+            self.assertEqual(audioFeatures.key_from_chroma(chroma_mean), reference_key(chroma_mean))
+
+    def test_ties_go_to_minor(self):
+        # A major scale has the same pitch classes as its relative minor
+        c_major_scale = audioFeatures.MAJOR_TEMPLATE.astype(float)
+        self.assertEqual(audioFeatures.key_from_chroma(c_major_scale), "A minor")
+
+    def test_silence_is_unknown(self):
+        self.assertEqual(audioFeatures.key_from_chroma(np.zeros(12)), "Unknown")
+
+
+class TestSampleTags(unittest.TestCase):
+    """Tags of synthetic samples, as produced by the earlier beat_track / chroma_cqt pipeline."""
+
+    SAMPLES = {
+        "a_minor_128": (dict(root=9, steps=MINOR_STEPS, bpm=128),
+                        ("Energetic", "warm", "high energy", "intense and punchy", "A minor")),
+        "d_minor_100": (dict(root=2, steps=MINOR_STEPS, bpm=100, seed=1),
+                        ("Moderate", "warm", "high energy", "intense and punchy", "D minor")),
+        "g_major_80_soft": (dict(root=7, steps=MAJOR_STEPS, bpm=80, level=0.04, clicks=0.05, seed=2),
+                            ("Relaxed", "warm", "low energy", "soft and smooth", "E minor")),
+        "f_minor_140_hats": (dict(root=5, steps=MINOR_STEPS, bpm=140, level=0.3, clicks=0.5, hats=0.6, seed=3),
+                             ("Energetic", "bright", "high energy", "intense and punchy", "F minor")),
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.files = {}
+        for name, (params, _) in cls.SAMPLES.items():
+            cls.files[name] = os.path.join(cls.directory, f"{name}.wav")
+            sf.write(cls.files[name], synth_sample(**params), SR)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def tags(self, file_path):
+        features, waveform = SampleMedataListing.extract_features(file_path)
+        self.assertNotIn("Error", features)
+        self.assertIsNotNone(waveform)
+        return tuple(features[tag] for tag in TAGS)
+
+    def test_tags_unchanged(self):
+        for name, (_, expected) in self.SAMPLES.items():
+            with self.subTest(sample=name):
+                self.assertEqual(self.tags(self.files[name]), expected)
+
+    def test_streamed_tags_match(self):
+        with patch.object(SampleMedataListing.Config, "STREAM_THRESHOLD_SECONDS", 1):
+            for name, (_, expected) in self.SAMPLES.items():
+                with self.subTest(sample=name):
+                    self.assertEqual(self.tags(self.files[name]), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
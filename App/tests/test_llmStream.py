@@ -0,0 +1,146 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from App.services import llmStream
+from App.services.llmStream import ResponseStream
+
+LABEL = {"song": "Sea", "phase": "Songwriting", "provider": "openai", "model": "gpt-4o"}
+
+
+def openai_chunk(text=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=text))] if usage is None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+class FakeOpenAI:
+    """Chat completions client that streams the given chunks, then raises error if one is given."""
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request):
+        self.requests.append(request)
+        yield from self.chunks
+        if self.error is not None:
+            raise self.error
+
+
+class FakeAnthropicStream:
+    def __init__(self, texts):
+        self.text_stream = iter(texts)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def get_final_message(self):
+        content = [SimpleNamespace(type="text", text="Hello "), SimpleNamespace(type="tool_use", text=None),
+                   SimpleNamespace(type="text", text="sea")]
+        return SimpleNamespace(content=content, usage={"input_tokens": 3, "output_tokens": 2})
+
+
+class TestResponseStream(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+
+    def stream(self, min_interval):
+        stream = ResponseStream(min_interval=min_interval)
+        stream.subscribe(self.events.append)
+        return stream
+
+    def test_deltas_are_coalesced(self):
+        stream = self.stream(min_interval=60)
+        stream_id = stream.start(**LABEL)
+        for text in ("Hel", "lo ", "", "sea"):
+            stream.delta(stream_id, text)
+        stream.finish(stream_id)
+        self.assertEqual([event["event"] for event in self.events], ["start", "delta", "delta", "end"])
+        self.assertEqual(self.events[0]["phase"], "Songwriting")
+        self.assertEqual([event["delta"] for event in self.events[1:3]], ["Hel", "lo sea"])
+        self.assertEqual(self.events[2]["chars"], 9)
+        end = self.events[3]
+        self.assertEqual((end["chars"], end["error"]), (9, None))
+        self.assertIsNotNone(end["first_token_seconds"])
+
+    def test_every_delta_is_published_without_interval(self):
+        stream = self.stream(min_interval=0)
+        stream_id = stream.start()
+        for text in ("a", "b", "c"):
+            stream.delta(stream_id, text)
+        stream.finish(stream_id, error="timeout")
+        self.assertEqual([event.get("delta") for event in self.events], [None, "a", "b", "c", None])
+        self.assertEqual(self.events[-1]["error"], "timeout")
+
+    def test_finished_and_unknown_streams_are_ignored(self):
+        stream = self.stream(min_interval=0)
+        stream_id = stream.start()
+        stream.finish(stream_id)
+        stream.delta(stream_id, "late")
+        stream.finish(stream_id)
+        stream.delta(99, "unknown")
+        self.assertEqual([event["event"] for event in self.events], ["start", "end"])
+        self.assertIsNone(self.events[-1]["first_token_seconds"])
+
+    def test_failing_subscriber_does_not_stop_the_others(self):
+        stream = ResponseStream()
+
+        def fail(event):
+            raise RuntimeError("disconnected")
+
+        stream.subscribe(fail)
+        callback = stream.subscribe(self.events.append)
+        stream.start()
+        stream.unsubscribe(callback)
+        stream.start()
+        self.assertEqual(len(self.events), 1)
+
+
+class TestProviderStreams(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        stream = ResponseStream(min_interval=0)
+        stream.subscribe(self.events.append)
+        patcher = patch.object(llmStream, "responses", stream)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def deltas(self):
+        return [event["delta"] for event in self.events if event["event"] == "delta"]
+
+    def test_openai_text_and_usage(self):
+        usage = SimpleNamespace(prompt_tokens=5, completion_tokens=2)
+        client = FakeOpenAI([openai_chunk("Hello "), openai_chunk(None), openai_chunk("sea"), openai_chunk(usage=usage)])
+        text, reported = llmStream.stream_openai(client, LABEL, model="gpt-4o", messages=[])
+        self.assertEqual((text, reported), ("Hello sea", usage))
+        self.assertEqual(self.deltas(), ["Hello ", "sea"])
+        self.assertEqual(client.requests[0]["stream_options"], {"include_usage": True})
+        self.assertTrue(client.requests[0]["stream"])
+
+    def test_openai_without_usage(self):
+        client = FakeOpenAI([openai_chunk("Hi")])
+        self.assertEqual(llmStream.stream_openai(client, LABEL, include_usage=False, messages=[]), ("Hi", None))
+        self.assertNotIn("stream_options", client.requests[0])
+
+    def test_openai_error_ends_the_stream(self):
+        client = FakeOpenAI([openai_chunk("Hel")], error=ConnectionError("reset"))
+        with self.assertRaises(ConnectionError):
+            llmStream.stream_openai(client, LABEL, messages=[])
+        self.assertEqual(self.events[-1]["event"], "end")
+        self.assertEqual(self.events[-1]["error"], "reset")
+
+    def test_anthropic_text_and_usage(self):
+        client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **request: FakeAnthropicStream(["Hello ", "sea"])))
+        text, usage = llmStream.stream_anthropic(client, dict(LABEL, provider="anthropic"), model="claude", messages=[])
+        self.assertEqual(text, "Hello sea")
+        self.assertEqual(usage["output_tokens"], 2)
+        self.assertEqual(self.deltas(), ["Hello ", "sea"])
+        self.assertEqual(self.events[0]["provider"], "anthropic")
+
+
+if __name__ == '__main__':
+    unittest.main()
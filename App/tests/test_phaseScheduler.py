@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import unittest
+from App.config import Config
+from App.services import phaseScheduler
+from App.services.songCreationData import SongCreationData
+
+AGENTS = ("mITyJohn", "mITyJohn_Eval", "mITyJohn_Full", "mITyJohn_Art")
+
+
+def load_agent(agent):
+    directory = os.path.join(Config.PROJECT_ROOT, "AgentConfig", agent)
+    with open(os.path.join(directory, "MusicCreationPhaseConfig.json")) as f:
+        phase_config = json.load(f)
+    with open(os.path.join(directory, "MusicCreationChainConfig.json")) as f:
+        chain = json.load(f)["chain"]
+    return phase_config, chain
+
+
+class SimulatedChain:
+    """Runs a chain like GPTAgent.execute_chain_step, with phases that answer from the parameters they read.
+
+    Every chat phase answers with its declared outcome computed from its inputs, plus a field it did not
+    declare; the second Code Review asks to stop the review cycles.
+    """
+
+    def __init__(self, phase_config, jitter):
+        self.phase_config = phase_config
+        self.jitter = jitter
+        self.data = SongCreationData(logging.getLogger("test"))
+        self.data.song_description = "a song about the sea"
+        self.data.total_duration = "120"
+        self.stop_review_and_modify = False
+        self.artifacts = {}
+        self.reviews = 0
+        self.lock = threading.Lock()
+        self.spans = {}
+
+    def read(self, names):
+        return "|".join(f"{name}={self.data.get_parameter(name)}" for name in sorted(names))
+
+    def run_phase(self, phase):
+        time.sleep(random.uniform(0, self.jitter))
+        settings = self.phase_config[phase]
+        task_type = settings["type"]
+        if task_type in ("chat", "local_chat"):
+            inputs = self.read(settings["input"].values())
+            response = {field: f"{phase}({inputs})" for field in settings["outcome"]}
+            response["lyrics"] = f"unrequested lyrics from {phase}"
+            if phase == "Code Review":
+                with self.lock:
+                    self.reviews += 1
+                    if self.reviews == 2:
+                        self.stop_review_and_modify = True
+            self.data.update_parameters_from_response(phaseScheduler.declared_response(settings, response))
+        elif task_type == "human_chat":
+            self.data.set_parameter("review", f"human({self.read(['sonicpi_code'])})")
+        elif task_type == "file":
+            self.data.set_parameter("sonicpi_code", f"# header\n{self.data.sonicpi_code}")
+            self.artifacts["song file"] = self.data.sonicpi_code
+        elif task_type == "readme":
+            self.artifacts["booklet"] = self.read(phaseScheduler.TYPE_ACCESS["readme"][0] - {phaseScheduler.SONG_FILE})
+        elif task_type == "art":
+            self.artifacts["cover art"] = self.read(["song_description"])
+        elif task_type == "recording":
+            self.artifacts["recording"] = self.artifacts.get("song file")
+
+    def run_step(self, step):
+        started = time.perf_counter()
+        if step["phaseType"] == "ComposedPhase":
+            for _ in range(step["cycleNum"]):
+                if self.stop_review_and_modify:
+                    break
+                for sub_step in step["Composition"]:
+                    if self.stop_review_and_modify:
+                        break
+                    self.run_phase(sub_step["phase"])
+        else:
+            self.run_phase(step["phase"])
+        self.spans[step["phase"]] = (started, time.perf_counter())
+
+    def result(self):
+        return dict(vars(self.data), logger=None), dict(self.artifacts), self.stop_review_and_modify
+
+
+def run_chain(agent, workers, jitter=0.0):
+    phase_config, chain = load_agent(agent)
+    simulation = SimulatedChain(phase_config, jitter)
+    dependencies = phaseScheduler.build_dependencies(chain, phase_config)
+    phaseScheduler.run_steps(chain, dependencies, simulation.run_step, workers)
+    return simulation, chain, dependencies
+
+
+class TestPhaseScheduler(unittest.TestCase):
+    def test_concurrent_chain_gives_the_serial_result(self):
+        for agent in AGENTS:
+            serial, _, _ = run_chain(agent, workers=1)
+            for seed in range(5):
+                random.seed(seed)
+                concurrent, _, _ = run_chain(agent, workers=4, jitter=0.005)
+                with self.subTest(agent=agent, seed=seed):
+                    self.assertEqual(concurrent.result(), serial.result())
+
+    def test_conflicting_steps_keep_chain_order(self):
+        for agent in AGENTS:
+            phase_config, _ = load_agent(agent)
+            random.seed(1)
+            simulation, chain, _ = run_chain(agent, workers=4, jitter=0.005)
+            access = [phaseScheduler.step_access(step, phase_config) for step in chain]
+            for later in range(len(chain)):
+                for earlier in range(later):
+                    if phaseScheduler.conflict(access[earlier], access[later]):
+                        with self.subTest(agent=agent, earlier=chain[earlier]["phase"], later=chain[later]["phase"]):
+                            self.assertLessEqual(simulation.spans[chain[earlier]["phase"]][1],
+                                                 simulation.spans[chain[later]["phase"]][0])
+
+    def test_dependencies_of_the_default_chain(self):
+        phase_config, chain = load_agent("mITyJohn")
+        dependencies = phaseScheduler.build_dependencies(chain, phase_config)
+        index = {step["phase"]: i for i, step in enumerate(chain)}
+        self.assertEqual(dependencies[index["Cover Art"]], set())
+        self.assertIn(index["Song Track Creation"], dependencies[index["Booklet Creation"]])
+        self.assertIn(index["Song Code Review"], dependencies[index["Song mixing"]])
+        for phase in ("Songwriting", "Segmentation", "Arrangements"):
+            self.assertIn(index[phase] - 1, dependencies[index[phase]])
+
+    def test_art_and_file_share_the_song_directory(self):
+        phase_config = {"Cover Art": {"type": "art"}, "Song File": {"type": "file"}, "Booklet": {"type": "readme"}}
+        chain = [{"phase": phase, "phaseType": "SimplePhase"} for phase in phase_config]
+        access = [phaseScheduler.step_access(step, phase_config) for step in chain]
+        for reads, writes in access[:2]:
+            self.assertIn(phaseScheduler.SONG_DIRECTORY, writes)
+        # Both create the directory if it is missing, so neither waits for the other; the booklet waits for the file
+        self.assertFalse(phaseScheduler.conflict(access[0], access[1]))
+        self.assertEqual(phaseScheduler.build_dependencies(chain, phase_config), [set(), set(), {1}])
+
+
+    def test_undeclared_outcome_runs_alone(self):
+        phase_config = {"Free": {"type": "chat", "input": {}}, "Art": {"type": "art"}}
+        chain = [{"phase": "Art", "phaseType": "SimplePhase"}, {"phase": "Free", "phaseType": "SimplePhase"},
+                 {"phase": "Unknown", "phaseType": "SimplePhase"}]
+        self.assertEqual(phaseScheduler.build_dependencies(chain, phase_config), [set(), {0}, {0, 1}])
+
+    def test_declared_response(self):
+        settings = {"outcome": {"theme": "theme"}}
+        self.assertEqual(phaseScheduler.declared_response(settings, {"theme": "t", "lyrics": "l"}), {"theme": "t"})
+        self.assertEqual(phaseScheduler.declared_response({}, {"lyrics": "l"}), {"lyrics": "l"})
+        self.assertFalse(phaseScheduler.may_write(settings, "sonicpi_code"))
+
+    def test_failure_stops_the_chain(self):
+        chain = [{"phase": name, "phaseType": "SimplePhase"} for name in ("A", "B", "C")]
+        started = []
+
+        def run_step(step):
+            started.append(step["phase"])
+            if step["phase"] == "A":
+                raise RuntimeError("A failed")
+
+        with self.assertRaises(RuntimeError):
+            phaseScheduler.run_steps(chain, [set(), {0}, {1}], run_step, workers=4)
+        self.assertEqual(started, ["A"])
+
+
+if __name__ == '__main__':
+    unittest.main()
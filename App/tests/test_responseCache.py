@@ -0,0 +1,80 @@
+import os
+import time
+import tempfile
+import unittest
+from App.services import responseCache
+from App.services.responseCache import ResponseCache, request_key
+
+MESSAGES = [{"role": "user", "content": "Write a theme"}]
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.directory.name, max_bytes=10_000, ttl_seconds=3600)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hit_and_miss(self):
+        key = request_key("Song", "openai", "gpt-4o", "system", MESSAGES)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, '{"theme": "sea"}', provider="openai", model="gpt-4o")
+        self.assertEqual(self.cache.get(key), '{"theme": "sea"}')
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_key_depends_on_run_and_request(self):
+        key = request_key("Song", "openai", "gpt-4o", "system", MESSAGES)
+        self.assertEqual(key, request_key("Song", "openai", "gpt-4o", "system", [dict(MESSAGES[0])]))
+        self.assertNotEqual(key, request_key("Other song", "openai", "gpt-4o", "system", MESSAGES))
+        self.assertNotEqual(key, request_key("Song", "openai", "gpt-4o-mini", "system", MESSAGES))
+        self.assertNotEqual(key, request_key("Song", "openai", "gpt-4o", "other system", MESSAGES))
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.put("aa1", "old")
+        self.cache.ttl_seconds = 0
+        time.sleep(0.01)
+        self.assertIsNone(self.cache.get("aa1"))
+        self.assertEqual(self.cache.stats()["expired"], 1)
+        self.assertFalse(os.path.exists(self.cache.entry_file("aa1")))
+
+    def test_reload_expires_by_creation_not_last_use(self):
+        self.cache.put("aa1", "old")
+        self.cache.put("bb2", "new")
+        self.cache.get("aa1")
+        created = time.time() - 7200
+        os.utime(self.cache.entry_file("aa1"), (created, created))
+        reloaded = ResponseCache(self.directory.name, max_bytes=10_000, ttl_seconds=3600)
+        self.assertEqual(reloaded.stats()["entries"], 1)
+        self.assertEqual(reloaded.get("bb2"), "new")
+        self.assertFalse(os.path.exists(self.cache.entry_file("aa1")))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.put("aa1", "x" * 100)
+        entry_size = os.path.getsize(self.cache.entry_file("aa1"))
+        self.cache.max_bytes = entry_size * 5 // 2  # room for two entries, whatever digits their times have
+        time.sleep(0.01)
+        self.cache.put("bb2", "x" * 100)
+        time.sleep(0.01)
+        self.cache.get("aa1")
+        self.cache.put("cc3", "x" * 100)
+        self.assertEqual(self.cache.get("aa1"), "x" * 100)
+        self.assertIsNone(self.cache.get("bb2"))
+        self.assertEqual(self.cache.get("cc3"), "x" * 100)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_phase_opt_in(self):
+        enabled = responseCache.Config.LLM_CACHE
+        try:
+            responseCache.Config.LLM_CACHE = True
+            self.assertTrue(responseCache.phase_uses_cache({"cache": True}))
+            self.assertFalse(responseCache.phase_uses_cache({}))
+            responseCache.Config.LLM_CACHE = False
+            self.assertFalse(responseCache.phase_uses_cache({"cache": True}))
+        finally:
+            responseCache.Config.LLM_CACHE = enabled
+
+
+if __name__ == '__main__':
+    unittest.main()
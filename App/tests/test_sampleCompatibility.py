@@ -0,0 +1,39 @@
+import unittest
+from unittest.mock import patch
+from App.services import sampleCompatibility
+
+
+class TestTargetFromText(unittest.TestCase):
+    def test_keys_named_in_context(self):
+        cases = {
+            "A song in A minor at 120 BPM": ("A minor", 120.0),
+            "in the key of Bb minor": ("A# minor", None),
+            "Key: F# major": ("F# major", None),
+            "an E minor key ballad": ("E minor", None),
+            "use_bpm 96 # key of Eb": ("D# major", 96.0),
+        }
+        for text, target in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual(sampleCompatibility.target_from_text(text), target)
+
+    def test_prose_is_not_a_key(self):
+        for text in ("A major influence on the song", "keys of C and D", "B minor details aside"):
+            with self.subTest(text=text):
+                self.assertEqual(sampleCompatibility.target_from_text(text), (None, None))
+
+
+class TestCompatibility(unittest.TestCase):
+    def test_tolerance_defaults_to_config(self):
+        with patch.object(sampleCompatibility.Config, "SAMPLE_BPM_TOLERANCE", 0.1):
+            self.assertTrue(sampleCompatibility.compatible_tempo(110, 120))
+        with patch.object(sampleCompatibility.Config, "SAMPLE_BPM_TOLERANCE", 0.04):
+            self.assertFalse(sampleCompatibility.compatible_tempo(110, 120))
+            self.assertTrue(sampleCompatibility.compatible_tempo(61, 120))  # half time
+
+    def test_compatible_keys_are_camelot_neighbours(self):
+        self.assertEqual(sorted(sampleCompatibility.compatible_keys("A minor")),
+                         ["A minor", "C major", "D minor", "E minor"])
+
+
+if __name__ == '__main__':
+    unittest.main()
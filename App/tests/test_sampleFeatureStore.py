@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from App.services import sampleDatabase, sampleFeatureStore
+
+LIBRARY = [
+    {"Filename": "Keys/pad.wav", "BPM": 120, "Duration": 8, "Key": "A minor", "Tags": ["Piano", "high energy", "warm"]},
+    {"Filename": "Keys/lead.wav", "BPM": 124, "Duration": 2, "Key": "A minor", "Tags": ["Synthesizer", "low energy", "bright"]},
+    {"Filename": "Drums/kick.wav", "BPM": 126, "Duration": 1, "Key": "Unknown", "Tags": ["Drum", "high energy"]},
+    {"Filename": "Vox/choir.wav", "Duration": 4, "Key": "C major", "Tags": ["Choir"]},
+] + [{"Filename": f"Misc/{i}.wav", "BPM": 90, "Duration": 1, "Key": "D minor", "Tags": [f"tag{i}"]} for i in range(70)]
+
+
+def filenames(records):
+    return [item["Filename"] for item in records]
+
+
+class TestSampleFeatureStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        sampleDatabase.write_library(self.path, LIBRARY)
+        self.store = sampleFeatureStore.open_store(self.path)
+
+    def query(self, **filters):
+        return filenames(sampleFeatureStore.query_records(self.path, **filters))
+
+    def test_filters(self):
+        self.assertEqual(self.query(bpm=(118, 126), key="A minor", energy="high energy"), ["Keys/pad.wav"])
+        self.assertEqual(self.query(bpm=(118, None)), ["Keys/pad.wav", "Keys/lead.wav", "Drums/kick.wav"])
+        self.assertEqual(self.query(duration=(None, 1.5), key="A minor"), [])
+        self.assertEqual(self.query(brightness="bright"), ["Keys/lead.wav"])
+        self.assertEqual(self.query(tags=["high energy", "Drum"]), ["Drums/kick.wav"])
+        self.assertEqual(self.query(any_tags=["Choir", "tag69"]), ["Vox/choir.wav", "Misc/69.wav"])
+        self.assertEqual(self.query(key="H minor"), [])
+        self.assertEqual(self.query(tags=["Bass"]), [])
+
+    def test_columns(self):
+        self.assertEqual(len(self.store), len(LIBRARY))
+        self.assertEqual(self.store.tags.shape, (len(LIBRARY), 2))  # more than 64 tags take two words
+        self.assertTrue(np.isnan(self.store.bpm[3]))
+        self.assertEqual(self.store.key[2], sampleFeatureStore.UNKNOWN)
+
+    def test_store_follows_the_database(self):
+        self.assertIs(sampleFeatureStore.open_store(self.path), self.store)
+        generation = sampleDatabase.write_library(self.path, LIBRARY[:2])
+        self.assertIsNone(self.store.records([0]))  # rows of the old generation are not read any more
+        store = sampleFeatureStore.open_store(self.path)
+        self.assertEqual((store.generation, len(store)), (generation, 2))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, sampleFeatureStore.STORE_DIRECTORY))),
+                         sorted([sampleFeatureStore.CURRENT_FILE, str(generation)]))
+
+    def test_written_store_is_mapped_by_other_processes(self):
+        sampleFeatureStore._stores.clear()
+        store = sampleFeatureStore.open_store(self.path)
+        self.assertIsNot(store, self.store)
+        self.assertEqual(store.path, self.store.path)
+        self.assertEqual(filenames(store.records([1])), ["Keys/lead.wav"])
+
+
+if __name__ == '__main__':
+    unittest.main()
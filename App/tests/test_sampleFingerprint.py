@@ -0,0 +1,142 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+import faiss
+import librosa
+import numpy as np
+import soundfile as sf
+from App.config import Config
+from App.services import SampleMedataListing, sampleDatabase, sampleIndex, sampleProgress
+from App.services.sampleFingerprint import FingerprintBuilder, FingerprintIndex
+from App.benchmarks.corpus import MAJOR_STEPS, MINOR_STEPS, synth_sample
+from App.tests.test_audioFeatures import SR
+from App.tests.test_sampleIndex import HashingModel
+
+
+def take_fingerprint(y, sr=SR):
+    builder = FingerprintBuilder(sr)
+    builder.add(y)
+    return builder.fingerprint(len(y) / sr)
+
+
+def bit_error(a, b):
+    bits = [np.unpackbits(np.frombuffer(bytes.fromhex(record["bits"]), dtype=np.uint8)) for record in (a, b)]
+    return np.count_nonzero(bits[0] != bits[1]) / len(bits[0])
+
+
+def padded(y, before, after):
+    return np.concatenate([np.zeros(int(before * SR), np.float32), y, np.zeros(int(after * SR), np.float32)])
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.y = synth_sample(9, MINOR_STEPS, 100, seconds=4.0, seed=1)
+        self.original = take_fingerprint(self.y)
+
+    def test_copies_stay_within_the_bit_error(self):
+        copies = {
+            "resampled": take_fingerprint(librosa.resample(self.y, orig_sr=SR, target_sr=22050), 22050),
+            "re-levelled": take_fingerprint(self.y * 0.3),
+            "silence-padded": take_fingerprint(padded(self.y, 0.5, 1.0)),
+        }
+        index = FingerprintIndex(Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+        index.add("original", self.original)
+        for name, record in copies.items():
+            with self.subTest(name):
+                self.assertLessEqual(bit_error(self.original, record), Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+                self.assertEqual(index.match(record), "original")
+
+    def test_different_samples_do_not_collide(self):
+        others = {
+            "key": synth_sample(2, MINOR_STEPS, 100, seconds=4.0, seed=1),
+            "mode": synth_sample(9, MAJOR_STEPS, 100, seconds=4.0, seed=1),
+            "key and mode": synth_sample(0, MAJOR_STEPS, 128, seconds=4.0, seed=2),
+            "noise": np.random.default_rng(0).uniform(-0.5, 0.5, len(self.y)).astype(np.float32),
+        }
+        index = FingerprintIndex(Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+        index.add("original", self.original)
+        for name, y in others.items():
+            with self.subTest(name):
+                record = take_fingerprint(y)
+                self.assertGreater(bit_error(self.original, record), Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+                self.assertIsNone(index.match(record))
+                index.add(name, record)
+
+    def test_samples_of_another_length_do_not_collide(self):
+        index = FingerprintIndex(Config.SAMPLE_DEDUP_MAX_BIT_ERROR)
+        index.add("original", self.original)
+        longer = take_fingerprint(synth_sample(9, MINOR_STEPS, 100, seconds=6.0, seed=1))
+        self.assertIsNone(index.match(longer))
+
+    def test_silence_has_no_fingerprint(self):
+        record = take_fingerprint(np.zeros(SR, np.float32))
+        self.assertIsNone(record["bits"])
+        self.assertIsNone(FingerprintIndex().match(record))
+
+
+class TestLibraryDeduplication(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        for patcher in (patch.object(sampleIndex, "load_embedding_model", return_value=HashingModel()),
+                        patch.object(SampleMedataListing, "classify_waveforms",
+                                     side_effect=lambda waveforms, pooling="mean": [[("Error", 0.0)] for _ in waveforms]),
+                        patch.object(Config, "SAMPLE_DEDUP", True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        a = synth_sample(9, MINOR_STEPS, 100, seconds=3.0, seed=1)
+        b = synth_sample(0, MAJOR_STEPS, 128, seconds=3.0, seed=2)
+        self.write("Loops/a.wav", a)
+        self.write("Loops/b.wav", b)
+        self.write("Copies/a_22k.flac", librosa.resample(a, orig_sr=SR, target_sr=22050), 22050)
+        self.write("Copies/a_quiet.wav", a * 0.3)
+        self.write("Copies/b_padded.wav", padded(b, 0.5, 1.0))
+
+    def write(self, name, y, sr=SR):
+        file_path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        sf.write(file_path, y, sr)
+
+    def listing(self):
+        with open(os.path.join(self.path, "sample_duplicates.json"), encoding="utf-8") as f:
+            duplicates = json.load(f)
+        with open(os.path.join(self.path, "sample_metadata.json"), encoding="utf-8") as f:
+            metadata = [item["Filename"] for item in json.load(f)]
+        records = [item["Filename"] for item in sampleDatabase.open_database(self.path).records()]
+        indexed = faiss.read_index(os.path.join(self.path, sampleIndex.INDEX_FILE)).ntotal
+        return duplicates, metadata, records, indexed
+
+    def test_each_group_is_listed_once(self):
+        SampleMedataListing.index_directory(self.path, workers=1)
+        duplicates, metadata, records, indexed = self.listing()
+
+        self.assertEqual(len(duplicates), 2)
+        groups = [sorted([original] + copies) for original, copies in duplicates.items()]
+        self.assertCountEqual(groups, [["Copies/a_22k.flac", "Copies/a_quiet.wav", "Loops/a.wav"],
+                                       ["Copies/b_padded.wav", "Loops/b.wav"]])
+        self.assertEqual(records, metadata)
+        self.assertCountEqual(records, list(duplicates))
+        self.assertEqual(indexed, 2)
+
+        SampleMedataListing.index_directory(self.path, workers=1)
+        self.assertEqual(self.listing(), (duplicates, metadata, records, indexed))
+
+    def test_a_running_listing_is_not_started_again(self):
+        progress = sampleProgress.IndexingProgress()
+        with patch.object(sampleProgress, "progress", progress):
+            progress.start()
+            self.assertFalse(SampleMedataListing.process_directory(self.path, workers=1))
+            self.assertFalse(os.path.exists(os.path.join(self.path, "sample_metadata.json")))
+            self.assertTrue(progress.running)
+
+            self.assertTrue(SampleMedataListing.process_directory(self.path, workers=1, started=True))
+            self.assertTrue(os.path.exists(os.path.join(self.path, "sample_metadata.json")))
+            self.assertFalse(progress.running)
+
+
+if __name__ == '__main__':
+    unittest.main()
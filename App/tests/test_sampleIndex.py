@@ -0,0 +1,126 @@
+import os
+import zlib
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from App.config import Config
+from App.services import sampleIndex
+
+DIMENSION = 16
+
+
+class HashingModel:
+    """Deterministic stand-in with the encode interface of SentenceTransformer; counts the texts it encodes."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def encode(self, texts, batch_size=None, convert_to_numpy=True, normalize_embeddings=True):
+        self.encoded += len(texts)
+        vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIMENSION)
+                            for text in texts])
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def library(count, offset=0):
+    return [{"Filename": f"Drums/loop{i}.wav", "Tags": ["Drum", f"tag{i}"], "Description": f"Loop number {i}"}
+            for i in range(offset, offset + count)]
+
+
+class TestSampleIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = self.directory.name
+        self.model = HashingModel()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def cached_hashes(self):
+        return set(sampleIndex.load_embedding_cache(self.path))
+
+    def test_only_new_samples_are_embedded(self):
+        sampleIndex.update_index(self.path, library(5), self.model)
+        sampleIndex.update_index(self.path, library(6), self.model)
+        self.assertEqual(self.model.encoded, 6)
+        self.assertTrue(sampleIndex.is_current(self.path, 6))
+
+    def test_empty_library_removes_the_index(self):
+        sampleIndex.update_index(self.path, library(3), self.model)
+        self.assertIsNone(sampleIndex.update_index(self.path, [], self.model))
+        self.assertFalse(os.path.exists(os.path.join(self.path, sampleIndex.INDEX_FILE)))
+        self.assertEqual(self.cached_hashes(), set())
+        self.assertTrue(sampleIndex.is_current(self.path, 0))
+        self.assertFalse(sampleIndex.is_current(self.path, 3))
+
+    def test_caches_keep_only_listed_samples(self):
+        sampleIndex.update_index(self.path, library(4), self.model)
+        kept = library(2)
+        sampleIndex.update_index(self.path, kept, self.model)
+        expected = {sampleIndex.text_hash(sampleIndex.sample_text(item)) for item in kept}
+        self.assertEqual(self.cached_hashes(), expected)
+
+        appended = kept + library(2, offset=10)
+        index = sampleIndex.append_to_index(self.path, appended, len(kept), self.model)
+        self.assertEqual(index.ntotal, 4)
+        expected = {sampleIndex.text_hash(sampleIndex.sample_text(item)) for item in appended}
+        self.assertEqual(self.cached_hashes(), expected)
+
+    def test_appended_samples_are_found(self):
+        metadata = library(5)
+        sampleIndex.update_index(self.path, metadata, self.model)
+        metadata += library(3, offset=5)
+        index = sampleIndex.append_to_index(self.path, metadata, 5, self.model)
+        query = sampleIndex.encode_query(self.model, sampleIndex.sample_text(metadata[6]))
+        self.assertEqual(sampleIndex.search(index, query, 1)[0][0], 6)
+
+
+def random_embeddings(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestIndexTypes(unittest.TestCase):
+    def test_choose_index_type(self):
+        self.assertEqual(sampleIndex.choose_index_type(sampleIndex.FLAT_MAX_SAMPLES, "auto"), "flat")
+        self.assertEqual(sampleIndex.choose_index_type(sampleIndex.FLAT_MAX_SAMPLES + 1, "auto"), "hnsw")
+        self.assertEqual(sampleIndex.choose_index_type(sampleIndex.HNSW_MAX_SAMPLES + 1, "Auto"), "ivfpq")
+        self.assertEqual(sampleIndex.choose_index_type(10, "hnsw"), "hnsw")
+        with self.assertRaises(ValueError):
+            sampleIndex.choose_index_type(10, "lsh")
+
+    def test_every_type_finds_the_nearest_samples(self):
+        embeddings = random_embeddings(sampleIndex.PQ_MIN_TRAIN_POINTS)
+        queries = range(0, len(embeddings), 500)
+        for index_type in sampleIndex.INDEX_TYPES:
+            index = sampleIndex.build_index(embeddings, index_type)
+            self.assertEqual(sampleIndex.index_type_of(index), index_type)
+            self.assertEqual(index.ntotal, len(embeddings))
+            found = [sampleIndex.search(index, embeddings[row:row + 1], 1)[0][0] for row in queries]
+            with self.subTest(index_type=index_type):
+                self.assertGreaterEqual(np.mean(np.array(found) == np.array(queries)), 0.9)
+
+    def test_ivfpq_needs_enough_samples_to_train(self):
+        index = sampleIndex.build_index(random_embeddings(100), "ivfpq")
+        self.assertEqual(sampleIndex.index_type_of(index), "flat")
+
+    def test_pq_subquantizers(self):
+        for dimension in (16, 384, 768):
+            m = sampleIndex.pq_subquantizers(dimension)
+            self.assertEqual((dimension % m, m % 2), (0, 0))
+
+    def test_appending_past_the_flat_limit_rebuilds_the_index(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        model = HashingModel()
+        with patch.object(Config, "SAMPLE_INDEX_TYPE", "auto"), \
+                patch.object(sampleIndex, "FLAT_MAX_SAMPLES", 4):
+            sampleIndex.update_index(directory.name, library(4), model)
+            index = sampleIndex.append_to_index(directory.name, library(6), 4, model)
+        self.assertEqual(sampleIndex.index_type_of(index), "hnsw")
+        self.assertEqual((index.ntotal, model.encoded), (6, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
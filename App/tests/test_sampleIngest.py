@@ -0,0 +1,79 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+import faiss
+from App.services import sampleDatabase, sampleIndex, sampleIngest, sampleRetrieval
+from App.services.sampleManifest import SampleManifest
+from App.tests.test_sampleIndex import HashingModel
+
+
+def entry(name, description):
+    return {"Filename": f"Drums/{name}", "Tags": ["Drum"], "Description": description}
+
+
+class TestMergeIntoLibrary(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        os.makedirs(os.path.join(self.path, "Drums"))
+        self.model = HashingModel()
+        patcher = patch.object(sampleIndex, "load_embedding_model", return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        library = {self.write(name): entry(name, f"Loop {name}") for name in ("a.wav", "b.wav")}
+        sampleIngest.merge_into_library(self.path, library)
+        self.model.encoded = 0
+
+    def write(self, name, content=b"RIFF"):
+        file_path = os.path.join(self.path, "Drums", name)
+        with open(file_path, "wb") as f:
+            f.write(content + name.encode("utf-8"))
+        return file_path
+
+    def records(self):
+        return [(item["Filename"], item["Description"]) for item in sampleDatabase.open_database(self.path).records()]
+
+    def indexed(self):
+        loaded = sampleRetrieval.get_retriever(self.path).get_index()
+        stored = faiss.read_index(os.path.join(self.path, sampleIndex.INDEX_FILE))
+        self.assertEqual(loaded.index.ntotal, stored.ntotal)
+        self.assertEqual(loaded.generation, sampleDatabase.open_database(self.path).generation())
+        return stored.ntotal
+
+    def test_new_files_are_appended(self):
+        merged = sampleIngest.merge_into_library(self.path, {self.write("c.wav"): entry("c.wav", "Loop c.wav")})
+        self.assertEqual(merged, ["Drums/c.wav"])
+        self.assertEqual([name for name, _ in self.records()], ["Drums/a.wav", "Drums/b.wav", "Drums/c.wav"])
+        self.assertEqual(self.indexed(), 3)
+        self.assertEqual(self.model.encoded, 1)
+        with open(os.path.join(self.path, "sample_metadata.json"), encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)), 3)
+        with open(os.path.join(self.path, "summary_samples.json"), encoding="utf-8") as f:
+            self.assertEqual([item["subfolder"] for item in json.load(f)], ["Drums"])
+
+    def test_changed_files_replace_their_entry(self):
+        with patch.object(sampleIndex, "append_to_index") as append_to_index:
+            sampleIngest.merge_into_library(self.path, {self.write("a.wav", b"WAVE"): entry("a.wav", "New a")})
+        append_to_index.assert_not_called()
+        self.assertEqual(self.records(), [("Drums/a.wav", "New a"), ("Drums/b.wav", "Loop b.wav")])
+        self.assertEqual(self.indexed(), 2)
+        self.assertEqual(self.model.encoded, 1)  # b.wav comes from the embedding cache
+
+    def test_duplicates_and_errors_are_not_added(self):
+        duplicate = dict(entry("a.wav", "Loop a.wav"), **{"Duplicate Of": "Drums/b.wav"})
+        analysed = {self.write("a.wav", b"WAVE"): duplicate,
+                    self.write("c.wav"): {"Filename": "Drums/c.wav", "Error": "unreadable"}}
+        self.assertEqual(sampleIngest.merge_into_library(self.path, analysed), [])
+        self.assertEqual(self.records(), [("Drums/b.wav", "Loop b.wav")])
+        self.assertEqual(self.indexed(), 1)
+        self.assertEqual(SampleManifest(self.path).entries["Drums/c.wav"]["metadata"]["Error"], "unreadable")
+        with open(os.path.join(self.path, "sample_duplicates.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f), {"Drums/b.wav": ["Drums/a.wav"]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import json
+import tempfile
+import unittest
+from App.services.sampleManifest import SampleManifest
+
+METADATA = {"Filename": "pads/warm.wav", "BPM": 90}
+
+
+class TestSampleManifest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        os.makedirs(os.path.join(self.directory, "pads"))
+        self.file = os.path.join(self.directory, "pads", "warm.wav")
+        self.write(b"RIFF0000")
+        self.manifest = SampleManifest(self.directory)
+        self.manifest.update(self.file, METADATA)
+
+    def write(self, content, mtime_ns=None):
+        with open(self.file, "wb") as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(self.file, ns=(mtime_ns, mtime_ns))
+
+    def test_unchanged_file_is_cached_across_saves(self):
+        self.assertEqual(self.manifest.key(self.file), "pads/warm.wav")
+        self.manifest.save()
+        self.assertEqual(SampleManifest(self.directory).cached_metadata(self.file), METADATA)
+
+    def test_touched_file_with_the_same_content_is_cached(self):
+        self.write(b"RIFF0000", mtime_ns=1_000_000_000)
+        self.assertEqual(self.manifest.cached_metadata(self.file), METADATA)
+        self.assertEqual(self.manifest.entries["pads/warm.wav"]["mtime"], 1_000_000_000)
+
+    def test_changed_file_is_analysed_again(self):
+        self.write(b"RIFF0001", mtime_ns=1_000_000_000)  # same size, new content
+        self.assertIsNone(self.manifest.cached_metadata(self.file))
+        self.write(b"RIFF00001")
+        self.assertIsNone(self.manifest.cached_metadata(self.file))
+        self.assertIsNone(self.manifest.cached_metadata(os.path.join(self.directory, "new.wav")))
+
+    def test_outdated_manifest_starts_empty(self):
+        with open(self.manifest.manifest_file, "w", encoding="utf-8") as f:
+            json.dump({"version": 0, "files": self.manifest.entries}, f)
+        self.assertEqual(SampleManifest(self.directory).entries, {})
+
+    def test_prune(self):
+        other = os.path.join(self.directory, "kick.wav")
+        with open(other, "wb") as f:
+            f.write(b"RIFF")
+        self.manifest.update(other, {"Filename": "kick.wav"})
+        self.assertEqual(self.manifest.prune([other]), ["pads/warm.wav"])
+        self.assertEqual(list(self.manifest.entries), ["kick.wav"])
+
+    def test_fingerprint_follows_the_file(self):
+        self.manifest.set_fingerprint(self.file, [1, 2, 3])
+        self.manifest.update(self.file, METADATA)
+        self.assertEqual(self.manifest.fingerprint(self.file), [1, 2, 3])
+        self.write(b"RIFF0001", mtime_ns=1_000_000_000)
+        self.assertIsNone(self.manifest.fingerprint(self.file))
+
+    def test_fingerprint_of_a_new_file_has_no_metadata(self):
+        self.write(b"RIFF0001", mtime_ns=1_000_000_000)
+        self.manifest.set_fingerprint(self.file, [4, 5])
+        self.assertEqual(self.manifest.fingerprint(self.file), [4, 5])
+        self.assertIsNone(self.manifest.cached_metadata(self.file))
+
+
+if __name__ == '__main__':
+    unittest.main()
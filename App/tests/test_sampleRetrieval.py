@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+import faiss
+from App.services import sampleDatabase, sampleIndex, sampleRetrieval
+from App.tests.test_sampleIndex import HashingModel, library
+
+
+class TestSampleRetriever(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        self.model = HashingModel()
+        patcher = patch.object(sampleIndex, "load_embedding_model", return_value=self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.retriever = sampleRetrieval.SampleRetriever(self.path)
+
+    def test_unindexed_library(self):
+        self.assertIsNone(self.retriever.get_index())
+        self.assertEqual(self.retriever.search("kick", 3), [])
+
+    def test_index_is_loaded_once_and_searched(self):
+        metadata = library(5)
+        sampleIndex.update_index(self.path, metadata, self.model)
+        loaded = self.retriever.get_index()
+        self.assertIs(self.retriever.get_index(), loaded)
+        self.assertEqual(self.retriever.search(sampleIndex.sample_text(metadata[3]), 2)[0][0], 3)
+
+    def test_index_written_by_another_process_is_reloaded(self):
+        sampleIndex.update_index(self.path, library(5), self.model)
+        self.assertEqual(self.retriever.sample_count(), 5)
+        sampleIndex.update_index(self.path, library(7), self.model)
+        self.assertEqual(self.retriever.sample_count(), 7)
+        sampleIndex.update_index(self.path, [], self.model)
+        self.assertIsNone(self.retriever.get_index())
+
+    def test_index_file_carries_the_generation_it_matches(self):
+        metadata = library(5)
+        sampleIndex.update_index(self.path, metadata, self.model)
+        self.assertIsNone(self.retriever.get_index().generation)  # no database yet
+        sampleDatabase.write_library(self.path, metadata)
+        sampleIndex.update_index(self.path, library(6), self.model)
+        self.assertIsNone(self.retriever.get_index().generation)  # 6 vectors for 5 samples
+        generation = sampleDatabase.write_library(self.path, library(6))
+        sampleIndex.update_index(self.path, library(6, offset=1), self.model)
+        self.assertEqual(self.retriever.get_index().generation, generation)
+
+    def test_swapped_index_is_served_without_reloading(self):
+        sampleIndex.update_index(self.path, library(5), self.model)
+        self.retriever.get_index()
+        index = sampleIndex.append_to_index(self.path, library(6), 5, self.model)
+        with patch.object(faiss, "read_index") as read_index:
+            self.retriever.swap_index(index, 7)
+            self.assertIs(self.retriever.get_index().index, index)
+            self.assertEqual(self.retriever.get_index().generation, 7)
+        read_index.assert_not_called()
+
+    def test_one_retriever_per_library(self):
+        retriever = sampleRetrieval.get_retriever(self.path)
+        self.assertIs(sampleRetrieval.get_retriever(self.path), retriever)
+        sampleRetrieval.swap_index(self.path, None, None)
+        self.assertIsNone(retriever.loaded)
+
+
+if __name__ == '__main__':
+    unittest.main()
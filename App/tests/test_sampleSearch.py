@@ -0,0 +1,67 @@
+import tempfile
+import unittest
+from App.services import sampleDatabase, sampleSearch
+
+LIBRARY = [
+    {"Filename": "Keys/warm_pad.wav", "BPM": 90, "Duration": 8, "Key": "A minor", "Tags": ["warm", "Synthesizer"],
+     "Description": "A warm pad", "Track Type": "Instrumentals Only"},
+    {"Filename": "Vox/choir.wav", "BPM": 120, "Duration": 4, "Key": "C major", "Tags": ["bright", "Choir"],
+     "Description": "A bright choir", "Track Type": "Vocals Only"},
+    {"Filename": "Keys/piano_loop.wav", "BPM": 100, "Duration": 6, "Key": "A minor", "Tags": ["warm", "Piano"],
+     "Description": "A warm piano loop", "Track Type": "Both Vocals and Instrumentals"},
+    {"Filename": "Drums/kick.wav", "BPM": 128, "Duration": 1, "Key": "Unknown", "Tags": ["Drum"],
+     "Description": "A punchy kick"},
+]
+
+
+class TestSampleSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        sampleDatabase.write_library(cls.directory.name, LIBRARY)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def search(self, query="", **filters):
+        total, results = sampleSearch.search(self.directory.name, query, **filters)
+        return total, [item["Filename"] for item in results]
+
+    def test_track_type_matches_a_prefix_in_any_case(self):
+        self.assertEqual(self.search(track_type="Instrumental"), (1, ["Keys/warm_pad.wav"]))
+        self.assertEqual(self.search(track_type="vocals only"), (1, ["Vox/choir.wav"]))
+        self.assertEqual(self.search(track_type="Drums"), (0, []))
+
+    def test_filters(self):
+        self.assertEqual(self.search(bpm=(95, 125)), (2, ["Vox/choir.wav", "Keys/piano_loop.wav"]))
+        self.assertEqual(self.search(key="A minor", duration=(None, 7)), (1, ["Keys/piano_loop.wav"]))
+        self.assertEqual(self.search(key="B minor"), (0, []))
+
+    def test_words_and_prefix_of_the_last_word(self):
+        self.assertEqual(self.search("warm pia"), (1, ["Keys/piano_loop.wav"]))
+        self.assertEqual(self.search("warm")[0], 2)
+        self.assertEqual(self.search("warm ")[0], 2)
+
+    def test_index_follows_library_changes(self):
+        self.assertEqual(self.search("kick")[0], 1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sampleDatabase.write_library(directory.name, LIBRARY)
+        sampleSearch.search(directory.name, "kick")
+        sampleDatabase.write_library(directory.name, LIBRARY[:3])
+        self.assertEqual(sampleSearch.search(directory.name, "kick"), (0, []))
+
+    def test_rows_are_read_from_the_generation_they_were_found_in(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        sampleDatabase.write_library(directory.name, LIBRARY)
+        index = sampleSearch.get_search_index(directory.name)
+        sampleDatabase.write_library(directory.name, LIBRARY[::-1])
+        database = sampleDatabase.open_database(directory.name)
+        self.assertIsNone(database.records([0], generation=index.generation))
+        self.assertEqual(sampleSearch.search(directory.name, "kick"), (1, [LIBRARY[3]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from App.services import tokenAccounting
+
+
+class WordEncoding:
+    """Encoding with one token per word, counting the texts it encodes."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text, disallowed_special=()):
+        self.encoded.append(text)
+        return text.split()
+
+
+def conversation(*texts):
+    return [{"role": "user", "content": text} for text in texts]
+
+
+class TokenAccountingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.encoding = WordEncoding()
+        for patcher in (patch.object(tokenAccounting, "encoding_for", return_value=self.encoding),
+                        patch.dict(tokenAccounting._counts, clear=True),
+                        patch.dict(tokenAccounting._corrections, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestMessageCache(TokenAccountingTestCase):
+    def test_counts_are_cached_per_model(self):
+        messages = conversation("write a theme", "make it darker")
+        first = tokenAccounting.count_messages("openai", "gpt-4o", messages)
+        self.assertEqual(first, 6 + 2 * tokenAccounting.TOKENS_PER_MESSAGE + tokenAccounting.TOKENS_PER_REPLY)
+        self.assertEqual(len(self.encoding.encoded), 2)
+
+        messages += conversation("add drums")
+        self.assertEqual(tokenAccounting.count_messages("openai", "gpt-4o", messages),
+                         first + 2 + tokenAccounting.TOKENS_PER_MESSAGE)
+        self.assertEqual(self.encoding.encoded[2:], ["add drums"])  # only the new message is encoded
+
+        tokenAccounting.count_text("azure", "gpt-4", "add drums")
+        self.assertEqual(len(self.encoding.encoded), 4)
+
+    def test_keys_hold_no_text(self):
+        tokenAccounting.count_text("openai", "gpt-4o", "a secret lyric")
+        (model, digest), = tokenAccounting._counts
+        self.assertEqual(model, "gpt-4o")
+        self.assertEqual(len(digest), 16)
+        self.assertNotIn(b"secret", digest)
+
+    def test_least_recently_used_counts_are_evicted(self):
+        with patch.object(tokenAccounting, "MESSAGE_CACHE_SIZE", 2):
+            for text in ("one", "two", "one", "three"):
+                tokenAccounting.count_text("openai", "gpt-4o", text)
+            self.assertEqual(len(tokenAccounting._counts), 2)
+            self.assertEqual(self.encoding.encoded, ["one", "two", "three"])
+
+            tokenAccounting.count_text("openai", "gpt-4o", "one")
+            tokenAccounting.count_text("openai", "gpt-4o", "two")
+            self.assertEqual(self.encoding.encoded[3:], ["two"])
+
+    def test_anthropic_prompts_are_estimated_from_characters(self):
+        tokens = tokenAccounting.count_messages("anthropic", "claude", conversation("x" * 70), system="y" * 35)
+        self.assertEqual(tokens, 30)
+        self.assertEqual(self.encoding.encoded, [])
+
+
+class TestReconcile(TokenAccountingTestCase):
+    def reported(self, prompt_tokens, completion_tokens=10):
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def test_estimate_converges_to_reported_usage(self):
+        messages = conversation("write a theme in A minor")
+        estimated = tokenAccounting.count_messages("openai", "gpt-4o", messages)
+        usage = tokenAccounting.reconcile("openai", "gpt-4o", messages, "ok", self.reported(round(estimated * 1.2)))
+        self.assertEqual(usage, {"prompt_tokens": round(estimated * 1.2), "completion_tokens": 10,
+                                 "total_tokens": round(estimated * 1.2) + 10, "estimated_prompt_tokens": estimated,
+                                 "reported": True})
+        self.assertEqual(tokenAccounting.estimate_prompt("openai", "gpt-4o", messages), round(estimated * 1.2))
+
+        errors = []
+        for _ in range(20):
+            tokenAccounting.reconcile("openai", "gpt-4o", messages, "ok", self.reported(estimated * 2))
+            errors.append(abs(tokenAccounting.estimate_prompt("openai", "gpt-4o", messages) - estimated * 2))
+        self.assertEqual(errors, sorted(errors, reverse=True))
+        self.assertLessEqual(errors[-1], 1)
+        self.assertEqual(tokenAccounting.correction("openai", "gpt-5"), 1.0)  # corrections are per model
+
+    def test_correction_stays_within_the_reported_ratios(self):
+        messages = conversation("write a theme in A minor")
+        estimated = tokenAccounting.count_messages("openai", "gpt-4o", messages)
+        for i in range(50):
+            ratio = 0.5 if i % 2 else 3.0
+            tokenAccounting.reconcile("openai", "gpt-4o", messages, "ok", self.reported(round(estimated * ratio)))
+            self.assertGreaterEqual(tokenAccounting.correction("openai", "gpt-4o"), 0.5 - 0.01)
+            self.assertLessEqual(tokenAccounting.correction("openai", "gpt-4o"), 3.0 + 0.01)
+
+    def test_missing_usage_is_estimated(self):
+        messages = conversation("write a theme")
+        tokenAccounting.reconcile("openai", "gpt-4o", messages, "ok", self.reported(30))
+        usage = tokenAccounting.reconcile("openai", "gpt-4o", messages, "a calm theme", None)
+        estimated = tokenAccounting.count_messages("openai", "gpt-4o", messages)
+        self.assertFalse(usage["reported"])
+        self.assertEqual(usage["prompt_tokens"], 30)
+        self.assertEqual(usage["completion_tokens"], 3)
+        self.assertEqual(usage["estimated_prompt_tokens"], estimated)
+        self.assertEqual(tokenAccounting.correction("openai", "gpt-4o"), 30 / estimated)
+
+
+if __name__ == '__main__':
+    unittest.main()